@@ -1,14 +1,43 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from anthropic import Anthropic
 from datetime import datetime
+from functools import partial
+import json
 import os
+import time
 from firebase import db
 from firebase_admin import firestore
+import ai_gateway
+from ai_gateway import AIGatewayBusy, gateway
+import answer_cache
+from answer_cache import cacheable, text_key
+from context_builder import build_context, load_context, refresh_summary
+from conversation_store import append_turn, decode_cursor, list_turns, migrate_history
+from http_cache import cache_headers, etag_for, not_modified_response
+from transcript_index import build_text_index, format_passages, retrieve_passages
+import metrics
+import subscription_service as subscription
 
 # Create router
 ai_router = APIRouter()
-anthropic = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+
+# Prompt caching only takes effect on models that support it, such as
+# Claude 3.5 Sonnet or Claude 3 Haiku
+AI_MODEL = os.getenv("AI_MODEL", "claude-3-5-sonnet-20241022")
+AI_MAX_TOKENS = 1000
+# Token counts recorded per answer and summed on the ai_texts document
+USAGE_FIELDS = [
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+]
+# Turns per page of GET /conversation
+DEFAULT_CONVERSATION_PAGE_SIZE = 100
+MAX_CONVERSATION_PAGE_SIZE = 500
 
 class TextUpload(BaseModel):
     text: str
@@ -76,13 +105,20 @@ async def upload_text(text_upload: TextUpload):
 
         # Create ai_texts subcollection under the file document
         ai_text_ref = file_ref.collection("ai_texts").document(text_id)
+        index_hash = await build_text_index(
+            text_upload.text, file_data.get("transcript_hash")
+        )
 
         ai_text_ref.set(
             {
                 "text": text_upload.text,
                 "user_id": text_upload.user_id,
                 "created_at": firestore.SERVER_TIMESTAMP,
-                "conversation_history": [],
+                # Turns live in the ai_texts/{text_id}/turns subcollection
+                # Bumped on every change to the conversation; used for ETags
+                "version": 0,
+                # Retrieval index of long texts, in the transcript store
+                "index_hash": index_hash,
                 "last_accessed": firestore.SERVER_TIMESTAMP,
                 "file_type": text_upload.file_type,  # Store file type for future reference
             }
@@ -93,94 +129,261 @@ async def upload_text(text_upload: TextUpload):
         raise HTTPException(status_code=500, detail=f"Failed to store text: {str(e)}")
 
 
-@ai_router.post("/ask", response_model=Response)
-async def ask_question(question: Question):
-    """Ask a question about previously uploaded text"""
+def get_ai_text(question: Question):
+    """Get the AI text document a question is about, checking its owner."""
+    collection_name = get_collection_name(question.file_type)
+
+    # Get the AI text document from the correct path
+    ai_text_ref = (
+        db.collection("uploads")
+        .document(question.user_id)
+        .collection(collection_name)
+        .document(question.file_id)
+        .collection("ai_texts")
+        .document(question.text_id)
+    )
+
+    ai_text_doc = ai_text_ref.get()
+
+    if not ai_text_doc.exists:
+        raise HTTPException(status_code=404, detail="Text ID not found")
+
+    doc_data = ai_text_doc.to_dict()
+
+    if doc_data["user_id"] != question.user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this text")
+
+    migrate_history(ai_text_ref, doc_data)
+    return ai_text_ref, doc_data
+
+
+def usage_counts(usage) -> dict:
+    return {field: getattr(usage, field, None) or 0 for field in USAGE_FIELDS}
+
+
+def record_turn(
+    ai_text_ref, question: str, answer: str, usage=None, cached: bool = False
+):
+    """Append a finished question and answer to the conversation.
+
+    The answer's token counts, including prompt cache reads and writes, are
+    stored with the turn and added to the document's running totals. Answers
+    from the answer cache are marked and count no tokens.
+    """
+    counts = usage_counts(usage)
+    for field, count in counts.items():
+        metrics.increment(f"ai.{field}", count)
+
+    append_turn(
+        ai_text_ref,
+        {
+            "question": question,
+            "answer": answer,
+            "timestamp": datetime.now().isoformat(),
+            "usage": counts,
+            **({"cached": True} if cached else {}),
+        },
+        {
+            f"token_usage.{field}": firestore.Increment(count)
+            for field, count in counts.items()
+        },
+    )
+
+
+def log_usage(text_id: str, context: dict, usage, seconds: float):
+    """Log the estimated and actual token counts of an answer and its latency."""
+    counts = usage_counts(usage)
+    print(
+        f"AI answer for {text_id} in {seconds:.2f}s: "
+        f"~{context['estimated_tokens']} input tokens estimated "
+        f"({context['turns']} turns, {context['dropped_turns']} dropped); "
+        f"{counts['input_tokens']} input, "
+        f"{counts['cache_read_input_tokens']} cache read, "
+        f"{counts['cache_creation_input_tokens']} cache write, "
+        f"{counts['output_tokens']} output"
+    )
+
+
+async def refresh_conversation_summary(ai_text_ref):
+    """Background task after an answer; a failure only means less context."""
     try:
-        collection_name = get_collection_name(question.file_type)
-
-        # Get the AI text document from the correct path
-        ai_text_ref = (
-            db.collection("uploads")
-            .document(question.user_id)
-            .collection(collection_name)
-            .document(question.file_id)
-            .collection("ai_texts")
-            .document(question.text_id)
+        await refresh_summary(
+            ai_text_ref, partial(gateway.create, ai_gateway.BACKGROUND)
         )
+    except Exception as e:
+        metrics.increment("ai.summary_errors")
+        print(f"Failed to refresh conversation summary: {str(e)}")
 
-        ai_text_doc = ai_text_ref.get()
 
-        if not ai_text_doc.exists:
-            raise HTTPException(status_code=404, detail="Text ID not found")
+async def question_lane(user_id: str) -> int:
+    """Pro users' questions go ahead of free users' in the AI gateway's queue."""
+    if await subscription.is_pro_user(user_id):
+        return ai_gateway.PRO
+    return ai_gateway.FREE
 
-        doc_data = ai_text_doc.to_dict()
 
-        if doc_data["user_id"] != question.user_id:
-            raise HTTPException(
-                status_code=403, detail="Not authorized to access this text"
-            )
+def answer_cache_scope(doc_data: dict, question: str):
+    """The answer cache scope of a question, or None if it can't be cached."""
+    return text_key(doc_data, AI_MODEL) if cacheable(doc_data, question) else None
 
-        text = doc_data["text"]
-        history = doc_data.get("conversation_history", [])
 
-        messages = [
-            {
-                "role": "user",
-                "content": f"Here's the text content to analyze, answer any question I have:\n\n{text}",
-            },
-        ]
+async def question_context(ai_text_ref, doc_data: dict, question: str) -> dict:
+    """Prompt for a question: long texts contribute only retrieved passages."""
+    passages = await retrieve_passages(ai_text_ref, doc_data, question)
+    stored = load_context(ai_text_ref, doc_data)
+    return build_context(
+        doc_data["text"],
+        stored["summary"],
+        stored["turns"],
+        question,
+        passages=format_passages(passages) if passages is not None else None,
+    )
+
 
-        for turn in history:
-            messages.append({"role": "user", "content": turn["question"]})
-            messages.append({"role": "assistant", "content": turn["answer"]})
+@ai_router.post("/ask", response_model=Response)
+async def ask_question(question: Question, background_tasks: BackgroundTasks):
+    """Ask a question about previously uploaded text"""
+    try:
+        ai_text_ref, doc_data = get_ai_text(question)
+        scope = answer_cache_scope(doc_data, question.question)
+        cached = answer_cache.cache.get(scope, question.question) if scope else None
+        if cached is not None:
+            record_turn(ai_text_ref, question.question, cached, cached=True)
+            return Response(answer=cached, text_id=question.text_id)
 
-        messages.append({"role": "user", "content": question.question})
+        context = await question_context(ai_text_ref, doc_data, question.question)
+        lane = await question_lane(question.user_id)
 
         try:
-            response = anthropic.messages.create(
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                system=(
-                    "You are a helpful AI assistant named Scribe. You take a transcription "
-                    "in for a video or audio file and you answer questions if the user has "
-                    "any. Answer questions based only on the provided text content. Be concise "
-                    "and accurate. Talk to the user like a friend with proper greetings. Don't "
-                    "start giving the summary; let only answer what the user asks about it. "
-                    "Make it like a conversation."
-                ),
-                messages=messages,
+            started = time.perf_counter()
+            response = await gateway.create(
+                lane,
+                model=AI_MODEL,
+                max_tokens=AI_MAX_TOKENS,
+                system=context["system"],
+                messages=context["messages"],
             )
+            elapsed = time.perf_counter() - started
+            metrics.observe("ai.answer_seconds", elapsed)
+            log_usage(question.text_id, context, response.usage, elapsed)
 
             answer = response.content[0].text
-
-            new_history_entry = {
-                "question": question.question,
-                "answer": answer,
-                "timestamp": datetime.now().isoformat(),
-            }
-
-            history.append(new_history_entry)
-
-            ai_text_ref.update(
-                {
-                    "conversation_history": history,
-                    "last_accessed": firestore.SERVER_TIMESTAMP,
-                }
-            )
+            record_turn(ai_text_ref, question.question, answer, response.usage)
+            if scope:
+                answer_cache.cache.put(scope, question.question, answer)
+            background_tasks.add_task(refresh_conversation_summary, ai_text_ref)
 
             return Response(answer=answer, text_id=question.text_id)
 
+        except AIGatewayBusy:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
 
+    except HTTPException:
+        raise
+    except AIGatewayBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@ai_router.post("/ask/stream")
+async def ask_question_stream(question: Question):
+    """
+    Ask a question and stream the answer as Server-Sent Events.
+
+    Sends a "token" event per text chunk as Claude generates it, then a
+    "done" event with the full answer once it has been saved to the
+    conversation, or an "error" event. An answer cut short by the client
+    disconnecting isn't saved. A cached answer arrives as a single token event.
+    """
+    try:
+        ai_text_ref, doc_data = get_ai_text(question)
+        scope = answer_cache_scope(doc_data, question.question)
+        cached = answer_cache.cache.get(scope, question.question) if scope else None
+        if cached is None:
+            context = await question_context(ai_text_ref, doc_data, question.question)
+            lane = await question_lane(question.user_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    async def event_stream():
+        if cached is not None:
+            record_turn(ai_text_ref, question.question, cached, cached=True)
+            yield sse_event("token", {"text": cached})
+            yield sse_event("done", {"answer": cached, "text_id": question.text_id})
+            return
+
+        started = time.perf_counter()
+        chunks = []
+        try:
+            async with gateway.stream(
+                lane,
+                model=AI_MODEL,
+                max_tokens=AI_MAX_TOKENS,
+                system=context["system"],
+                messages=context["messages"],
+            ) as stream:
+                async for text in stream.text_stream:
+                    if not chunks:
+                        metrics.observe(
+                            "ai.time_to_first_token_seconds",
+                            time.perf_counter() - started,
+                        )
+                    chunks.append(text)
+                    yield sse_event("token", {"text": text})
+                final = await stream.get_final_message()
+            elapsed = time.perf_counter() - started
+            metrics.observe("ai.answer_seconds", elapsed)
+            log_usage(question.text_id, context, final.usage, elapsed)
+
+            answer = "".join(chunks)
+            record_turn(ai_text_ref, question.question, answer, final.usage)
+            if scope:
+                answer_cache.cache.put(scope, question.question, answer)
+            yield sse_event("done", {"answer": answer, "text_id": question.text_id})
+        except Exception as e:
+            metrics.increment("ai.stream_errors")
+            yield sse_event("error", {"detail": f"AI service error: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(refresh_conversation_summary, ai_text_ref),
+    )
+
+
 @ai_router.get("/conversation/{text_id}")
-async def get_conversation(text_id: str, user_id: str, file_id: str, file_type: str):
-    """Retrieve the conversation history for a specific text"""
+async def get_conversation(
+    request: Request,
+    text_id: str,
+    user_id: str,
+    file_id: str,
+    file_type: str,
+    cursor: str = None,
+    page_size: int = Query(
+        DEFAULT_CONVERSATION_PAGE_SIZE, ge=1, le=MAX_CONVERSATION_PAGE_SIZE
+    ),
+):
+    """
+    Retrieve the conversation history for a specific text, oldest turn
+    first, one page at a time. Pass next_cursor back as cursor for the
+    following page; it's null on the last one.
+    """
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
     try:
         collection_name = get_collection_name(file_type)
 
@@ -205,16 +408,34 @@ async def get_conversation(text_id: str, user_id: str, file_id: str, file_type:
                 status_code=403, detail="Not authorized to access this text"
             )
 
+        if migrate_history(ai_text_ref, doc_data):
+            doc_data = ai_text_ref.get().to_dict()
         ai_text_ref.update({"last_accessed": firestore.SERVER_TIMESTAMP})
 
-        return {
-            "text_id": text_id,
-            "text": doc_data["text"],
-            "conversation": doc_data.get("conversation_history", []),
-            "created_at": doc_data.get("created_at"),
-            "last_accessed": doc_data.get("last_accessed"),
-            "file_type": doc_data.get("file_type"),
-        }
+        # The version changes with every new turn. last_accessed changes on
+        # every read, so it's left out of the body for the tag to stay valid.
+        tag = etag_for(
+            "conversation", text_id, doc_data.get("version", 0), cursor, page_size
+        )
+        not_modified = not_modified_response(request, tag)
+        if not_modified:
+            return not_modified
+
+        turns, next_cursor = list_turns(ai_text_ref, page_size, cursor)
+
+        return JSONResponse(
+            jsonable_encoder(
+                {
+                    "text_id": text_id,
+                    "text": doc_data["text"],
+                    "conversation": turns,
+                    "next_cursor": next_cursor,
+                    "created_at": doc_data.get("created_at"),
+                    "file_type": doc_data.get("file_type"),
+                }
+            ),
+            headers=cache_headers(tag),
+        )
 
     except Exception as e:
         raise HTTPException(
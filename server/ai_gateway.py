@@ -0,0 +1,248 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+import anthropic
+from anthropic import AsyncAnthropic
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# Claude requests in flight at once per worker; the rest wait in line
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+# Requests allowed to wait for a slot before new ones are turned away
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "100"))
+# Retries of rate-limited, overloaded or failed requests
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))
+# Bounds in seconds on the wait between retries
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "30"))
+
+# Priority lanes, served lowest first
+PRO = 0
+FREE = 1
+BACKGROUND = 2
+LANES = {PRO: "pro", FREE: "free", BACKGROUND: "background"}
+
+# 408 timeout, 409 lock conflict, 429 rate limit and 529 overloaded (a 5xx)
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class AIGatewayBusy(Exception):
+    """Raised when the queue of requests waiting for Claude is full."""
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, anthropic.APIConnectionError):
+        # Includes timeouts
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error: Exception):
+    """The server's requested wait from Retry-After(-Ms) headers, or None."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """
+    Seconds to wait before retry number `attempt` (from 0).
+
+    A Retry-After from the server is honoured, with a little jitter so
+    requests told the same time don't all return at once; otherwise the
+    wait is full-jitter exponential backoff.
+    """
+    requested = retry_after_seconds(error)
+    if requested is not None:
+        return min(requested, AI_RETRY_MAX_DELAY) + random.uniform(0, AI_RETRY_BASE_DELAY)
+    return random.uniform(0, min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * 2**attempt))
+
+
+class PriorityLimiter:
+    """
+    Bounded number of concurrent holders, with waiters served by lane.
+
+    When a slot frees up it goes to the longest-waiting request of the
+    highest-priority lane, so Pro users' questions overtake queued free
+    ones and background work only runs when nobody else is waiting.
+    """
+
+    def __init__(self, capacity: int, max_queue: int):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters = []  # heap of (lane, sequence, future)
+        self._sequence = itertools.count()
+
+    def queued(self, lane: int = None) -> int:
+        return sum(
+            1
+            for waiter_lane, _, future in self._waiters
+            if not future.done() and (lane is None or waiter_lane == lane)
+        )
+
+    def _report(self):
+        metrics.set_gauge("ai_gateway.in_flight", self.in_flight)
+        metrics.set_gauge("ai_gateway.queue_depth", self.queued())
+
+    async def acquire(self, lane: int = FREE):
+        started = time.perf_counter()
+        if self.in_flight < self.capacity and not self.queued():
+            self.in_flight += 1
+        else:
+            if self.queued() >= self.max_queue:
+                metrics.increment("ai_gateway.rejected")
+                raise AIGatewayBusy("The AI service is busy, please try again shortly")
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (lane, next(self._sequence), future))
+            self._report()
+            try:
+                # The slot is handed over by release(), already counted
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Cancelled just after being handed the slot
+                    self.release()
+                raise
+        metrics.observe(
+            f"ai_gateway.queue_wait_seconds.{LANES[lane]}", time.perf_counter() - started
+        )
+        self._report()
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                self._report()
+                return
+        self.in_flight -= 1
+        self._report()
+
+    @asynccontextmanager
+    async def slot(self, lane: int = FREE):
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class AIGateway:
+    """
+    The one way this worker talks to Claude.
+
+    Every request waits for a slot in a PriorityLimiter, then is retried on
+    rate limits, overload and connection errors with jittered backoff that
+    respects Retry-After. The slot is held while backing off, so a rate
+    limited worker also sends less. The client is an ordinary AsyncAnthropic,
+    so pointing ANTHROPIC_BASE_URL (or an httpx transport) at a local fake
+    server exercises all of this in tests.
+    """
+
+    def __init__(
+        self,
+        client: AsyncAnthropic = None,
+        concurrency: int = AI_MAX_CONCURRENCY,
+        max_queue: int = AI_MAX_QUEUE,
+        max_retries: int = AI_MAX_RETRIES,
+    ):
+        # Retries happen here, where they can wait without taking extra slots
+        self.client = client or AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0
+        )
+        self.limiter = PriorityLimiter(concurrency, max_queue)
+        self.max_retries = max_retries
+
+    @property
+    def messages(self):
+        """Messages API with prompt caching (a beta namespace in this SDK version)."""
+        return self.client.beta.prompt_caching.messages
+
+    async def _with_retries(self, call):
+        attempt = 0
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_delay(attempt, e)
+                metrics.increment("ai_gateway.retries")
+                print(f"Retrying Claude request in {delay:.1f}s after: {str(e)}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def create(self, lane: int = FREE, **kwargs):
+        """messages.create through the queue, with retries."""
+        async with self.limiter.slot(lane):
+            started = time.perf_counter()
+            try:
+                return await self._with_retries(lambda: self.messages.create(**kwargs))
+            finally:
+                metrics.observe(
+                    "ai_gateway.request_seconds", time.perf_counter() - started
+                )
+
+    @asynccontextmanager
+    async def stream(self, lane: int = FREE, **kwargs):
+        """
+        messages.stream through the queue. Opening the stream is retried;
+        once it's open, errors reach the caller, since tokens may already
+        have been sent on.
+        """
+        async with self.limiter.slot(lane):
+            started = time.perf_counter()
+            manager = None
+
+            async def open_stream():
+                nonlocal manager
+                manager = self.messages.stream(**kwargs)
+                return await manager.__aenter__()
+
+            try:
+                stream = await self._with_retries(open_stream)
+                try:
+                    yield stream
+                except BaseException as e:
+                    if not await manager.__aexit__(type(e), e, e.__traceback__):
+                        raise
+                else:
+                    await manager.__aexit__(None, None, None)
+            finally:
+                metrics.observe(
+                    "ai_gateway.request_seconds", time.perf_counter() - started
+                )
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.limiter.in_flight,
+            "capacity": self.limiter.capacity,
+            "queued": {name: self.limiter.queued(lane) for lane, name in LANES.items()},
+            "max_queue": self.limiter.max_queue,
+        }
+
+
+gateway = AIGateway()
@@ -0,0 +1,135 @@
+import os
+import re
+import threading
+import time
+from cachetools import LRUCache, TTLCache
+from dotenv import load_dotenv
+import metrics
+from transcript_store import content_hash
+
+load_dotenv()
+
+# How long and how many answers each worker keeps
+AI_ANSWER_CACHE_TTL_SECONDS = int(os.getenv("AI_ANSWER_CACHE_TTL_SECONDS", "86400"))
+AI_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("AI_ANSWER_CACHE_MAX_ENTRIES", "5000"))
+# Word overlap (Jaccard) at which a differently worded question about the same
+# text reuses an answer; 0 matches normalized questions exactly only
+AI_ANSWER_CACHE_SIMILARITY = float(os.getenv("AI_ANSWER_CACHE_SIMILARITY", "0"))
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+# Polite filler that doesn't change what's being asked
+FILLER_WORDS = frozenset("please can could would you kindly me us just".split())
+# Words that point back at earlier answers; a question using them may need
+# the conversation, so it's only cached as a conversation's first question
+REFERENCE_WORDS = frozenset(
+    "it its that those these they them their he him his she her above earlier "
+    "previous previously before again more else also another elaborate expand "
+    "further same instead other said mentioned".split()
+)
+
+
+def question_words(question: str) -> list:
+    return [
+        word
+        for word in WORD_PATTERN.findall(question.lower())
+        if word not in FILLER_WORDS
+    ]
+
+
+def normalize_question(question: str) -> str:
+    """Case, punctuation, spacing and polite filler removed."""
+    return " ".join(question_words(question))
+
+
+def depends_on_history(question: str) -> bool:
+    return any(word in REFERENCE_WORDS for word in question_words(question))
+
+
+def cacheable(doc_data: dict, question: str) -> bool:
+    """
+    Whether an answer to this question can come from, or go to, the cache:
+    the conversation has no turns yet (its version is still 0), or the
+    question stands on its own.
+    """
+    return doc_data.get("version", 0) == 0 or not depends_on_history(question)
+
+
+def text_key(doc_data: dict, model: str) -> str:
+    """Cache scope of an ai_texts document: its text's content and the model."""
+    digest = doc_data.get("index_hash") or content_hash(doc_data["text"].encode("utf-8"))
+    return f"{digest}:{model}"
+
+
+def _similarity(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a | b else 0.0
+
+
+class AnswerCache:
+    """
+    Answers to stand-alone questions, keyed by text content and question.
+
+    Texts are keyed by content hash, so every copy of a transcript shares its
+    answers. With a similarity threshold, a question that misses exactly is
+    compared with the other questions cached for the same text.
+    """
+
+    def __init__(
+        self,
+        ttl: int = AI_ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = AI_ANSWER_CACHE_MAX_ENTRIES,
+        similarity: float = AI_ANSWER_CACHE_SIMILARITY,
+        timer=time.monotonic,
+    ):
+        self.similarity = similarity
+        self._answers = TTLCache(maxsize=max_entries, ttl=ttl, timer=timer)
+        # Normalized questions cached per text, for near-duplicate lookups
+        self._questions = LRUCache(maxsize=max_entries)
+        self._lock = threading.Lock()
+
+    def get(self, text: str, question: str):
+        """The cached answer for the question about this text, or None."""
+        normalized = normalize_question(question)
+        with self._lock:
+            answer = self._answers.get((text, normalized))
+            if answer is None and self.similarity > 0:
+                answer = self._nearest(text, normalized)
+        metrics.increment("ai.answer_cache.hits" if answer else "ai.answer_cache.misses")
+        return answer
+
+    def _nearest(self, text: str, normalized: str):
+        words = set(normalized.split())
+        best, best_score = None, self.similarity
+        for candidate in list(self._questions.get(text, ())):
+            answer = self._answers.get((text, candidate))
+            if answer is None:
+                # Expired or evicted
+                self._questions[text].discard(candidate)
+                continue
+            score = _similarity(words, set(candidate.split()))
+            if score >= best_score:
+                best, best_score = answer, score
+        return best
+
+    def put(self, text: str, question: str, answer: str):
+        normalized = normalize_question(question)
+        with self._lock:
+            self._answers[(text, normalized)] = answer
+            if self.similarity > 0:
+                self._questions.setdefault(text, set()).add(normalized)
+
+    def clear(self):
+        with self._lock:
+            self._answers.clear()
+            self._questions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._answers),
+                "max_entries": self._answers.maxsize,
+                "ttl_seconds": self._answers.ttl,
+                "similarity": self.similarity,
+            }
+
+
+cache = AnswerCache()
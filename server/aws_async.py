@@ -0,0 +1,126 @@
+# aws_async.py
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from dotenv import load_dotenv
+import aws_service
+from media_probe import FFPROBE_TIMEOUT_SECONDS, probe_duration
+
+load_dotenv()
+
+# Blocking boto3/requests calls run on this bounded pool so they never stall
+# the event loop; size it to the number of concurrent AWS calls per worker
+AWS_MAX_WORKERS = int(os.getenv("AWS_MAX_WORKERS", "16"))
+
+# Presigned URLs handed to ffprobe only need to outlive the probe
+FFPROBE_URL_EXPIRATION = FFPROBE_TIMEOUT_SECONDS * 2
+
+_executor = ThreadPoolExecutor(max_workers=AWS_MAX_WORKERS, thread_name_prefix="aws")
+
+
+async def run_in_aws_pool(func, *args, **kwargs):
+    """Run a blocking AWS call on the AWS thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+def shutdown():
+    """Stop accepting new AWS calls and release the pool's threads."""
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def upload_file_to_s3(file_obj, filename, content_type):
+    return await run_in_aws_pool(
+        aws_service.upload_file_to_s3, file_obj, filename, content_type
+    )
+
+
+async def generate_presigned_url(filename, expiration=3600):
+    return await run_in_aws_pool(
+        aws_service.generate_presigned_url, filename, expiration
+    )
+
+
+async def start_transcription_job(
+    file_path: str, job_name: str, language_code: str = "en-US"
+):
+    """Start an AWS Transcribe job for the given S3 file."""
+    return await run_in_aws_pool(
+        aws_service.start_transcription_job, file_path, job_name, language_code
+    )
+
+
+async def get_transcription_job_status(job_name: str):
+    """Get the status of a transcription job."""
+    return await run_in_aws_pool(aws_service.get_transcription_job_status, job_name)
+
+
+async def list_transcription_jobs(
+    status: str, job_name_contains: str = None, next_token: str = None, max_results=100
+):
+    """List one page of transcription job summaries with the given status."""
+    return await run_in_aws_pool(
+        aws_service.list_transcription_jobs,
+        status,
+        job_name_contains,
+        next_token,
+        max_results,
+    )
+
+
+async def get_transcription_result(transcript_uri: str):
+    """Get the transcription result from the provided URI."""
+    return await run_in_aws_pool(aws_service.get_transcription_result, transcript_uri)
+
+
+async def create_multipart_upload(filename, content_type):
+    return await run_in_aws_pool(
+        aws_service.create_multipart_upload, filename, content_type
+    )
+
+
+async def generate_presigned_part_urls(filename, upload_id, part_count, expiration=3600):
+    return await run_in_aws_pool(
+        aws_service.generate_presigned_part_urls,
+        filename,
+        upload_id,
+        part_count,
+        expiration,
+    )
+
+
+async def complete_multipart_upload(filename, upload_id, parts):
+    return await run_in_aws_pool(
+        aws_service.complete_multipart_upload, filename, upload_id, parts
+    )
+
+
+async def abort_multipart_upload(filename, upload_id):
+    return await run_in_aws_pool(
+        aws_service.abort_multipart_upload, filename, upload_id
+    )
+
+
+async def get_object_size(filename):
+    return await run_in_aws_pool(aws_service.get_object_size, filename)
+
+
+async def delete_file_from_s3(filename):
+    return await run_in_aws_pool(aws_service.delete_file_from_s3, filename)
+
+
+async def probe_s3_object_duration(filename, size=None):
+    """
+    Read a stored object's media duration from its headers via ranged GETs.
+
+    Containers the header parsers don't know go to ffprobe as a short-lived
+    presigned URL, so the object is never downloaded to this server.
+    """
+
+    def probe():
+        url = aws_service.generate_presigned_url(filename, FFPROBE_URL_EXPIRATION)
+        with aws_service.open_s3_object(filename, size) as reader:
+            return probe_duration(reader, filename, url)
+
+    return await run_in_aws_pool(probe)
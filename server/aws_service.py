@@ -1,8 +1,10 @@
 # aws_service.py
+import io
 import boto3
 from botocore.exceptions import NoCredentialsError, ClientError
 import os
 from dotenv import load_dotenv
+from s3_upload import S3UploadEngine
 
 load_dotenv()
 
@@ -27,15 +29,16 @@ transcribe_client = boto3.client(
     region_name=AWS_REGION,
 )
 
+upload_engine = S3UploadEngine(s3_client, S3_BUCKET_NAME)
+
 
 def upload_file_to_s3(file_obj, filename, content_type):
+    """Upload a file object to S3, in parallel parts when it is large.
+
+    Returns the UploadProgress with the final byte count and throughput.
+    """
     try:
-        s3_client.upload_fileobj(
-            file_obj,
-            S3_BUCKET_NAME,
-            filename,
-            ExtraArgs={"ContentType": content_type},
-        )
+        return upload_engine.upload(file_obj, filename, content_type)
     except NoCredentialsError:
         raise ValueError("AWS credentials not found.")
     except ClientError as e:
@@ -97,6 +100,61 @@ def get_transcription_job_status(job_name: str):
         raise ValueError(f"Failed to get transcription job status: {str(e)}")
 
 
+def list_transcription_jobs(
+    status: str, job_name_contains: str = None, next_token: str = None, max_results=100
+):
+    """List one page of transcription job summaries with the given status.
+
+    Returns a (summaries, next_token) tuple; next_token is None on the last page.
+    """
+    try:
+        params = {"Status": status, "MaxResults": max_results}
+        if job_name_contains:
+            params["JobNameContains"] = job_name_contains
+        if next_token:
+            params["NextToken"] = next_token
+        response = transcribe_client.list_transcription_jobs(**params)
+        return response.get("TranscriptionJobSummaries", []), response.get("NextToken")
+    except ClientError as e:
+        raise ValueError(f"Failed to list transcription jobs: {str(e)}")
+
+
+def download_transcription_result(transcript_uri: str) -> bytes:
+    """Download the raw transcription JSON from the provided URI."""
+    import requests
+
+    try:
+        response = requests.get(transcript_uri)
+        response.raise_for_status()
+        return response.content
+    except Exception as e:
+        raise ValueError(f"Failed to get transcription result: {str(e)}")
+
+
+def put_bytes_to_s3(filename, data: bytes, content_type, extra_args=None):
+    """Store a small object (a cached artifact, not media) in S3."""
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=filename,
+            Body=data,
+            ContentType=content_type,
+            **(extra_args or {}),
+        )
+    except ClientError as e:
+        raise ValueError(f"Failed to upload to S3: {str(e)}")
+
+
+def get_bytes_from_s3(filename):
+    """Read a small object from S3, or return None if it doesn't exist."""
+    try:
+        return s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=filename)["Body"].read()
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+            return None
+        raise ValueError(f"Failed to read from S3: {str(e)}")
+
+
 def get_transcription_result(transcript_uri: str):
     """Get the transcription result from the provided URI."""
     import requests
@@ -106,3 +164,136 @@ def get_transcription_result(transcript_uri: str):
         return response.json()
     except Exception as e:
         raise ValueError(f"Failed to get transcription result: {str(e)}")
+
+
+def create_multipart_upload(filename, content_type):
+    """Start a multipart upload that the client will send parts to directly."""
+    try:
+        response = s3_client.create_multipart_upload(
+            Bucket=S3_BUCKET_NAME, Key=filename, ContentType=content_type
+        )
+        return response["UploadId"]
+    except ClientError as e:
+        raise ValueError(f"Failed to start multipart upload: {str(e)}")
+
+
+def generate_presigned_part_urls(filename, upload_id, part_count, expiration=3600):
+    """Generate one presigned PUT URL per part of a multipart upload."""
+    try:
+        return [
+            {
+                "part_number": part_number,
+                "url": s3_client.generate_presigned_url(
+                    "upload_part",
+                    Params={
+                        "Bucket": S3_BUCKET_NAME,
+                        "Key": filename,
+                        "UploadId": upload_id,
+                        "PartNumber": part_number,
+                    },
+                    ExpiresIn=expiration,
+                ),
+            }
+            for part_number in range(1, part_count + 1)
+        ]
+    except ClientError as e:
+        raise ValueError(f"Could not generate presigned part URLs: {str(e)}")
+
+
+def complete_multipart_upload(filename, upload_id, parts):
+    """Finish a multipart upload from the client's (part_number, etag) list."""
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=S3_BUCKET_NAME,
+            Key=filename,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": part_number, "ETag": etag}
+                    for part_number, etag in sorted(parts)
+                ]
+            },
+        )
+    except ClientError as e:
+        raise ValueError(f"Failed to complete multipart upload: {str(e)}")
+
+
+def abort_multipart_upload(filename, upload_id):
+    """Abort a multipart upload and free the parts already stored."""
+    try:
+        s3_client.abort_multipart_upload(
+            Bucket=S3_BUCKET_NAME, Key=filename, UploadId=upload_id
+        )
+    except ClientError as e:
+        raise ValueError(f"Failed to abort multipart upload: {str(e)}")
+
+
+def get_object_size(filename):
+    """Get the size in bytes of an object stored in S3."""
+    try:
+        return s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=filename)[
+            "ContentLength"
+        ]
+    except ClientError as e:
+        raise ValueError(f"Failed to read S3 object metadata: {str(e)}")
+
+
+def delete_file_from_s3(filename):
+    try:
+        s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=filename)
+    except ClientError as e:
+        raise ValueError(f"Failed to delete from S3: {str(e)}")
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over an S3 object.
+
+    Every read is a ranged GET, so header parsers (see media_probe) can inspect
+    a stored upload without downloading all of it. Wrap it in an
+    io.BufferedReader to batch small reads into fewer requests.
+    """
+
+    def __init__(self, filename, size=None):
+        self.filename = filename
+        self.size = get_object_size(filename) if size is None else size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        end = min(self.position + len(buffer), self.size) - 1
+        try:
+            response = s3_client.get_object(
+                Bucket=S3_BUCKET_NAME,
+                Key=self.filename,
+                Range=f"bytes={self.position}-{end}",
+            )
+        except ClientError as e:
+            raise ValueError(f"Failed to read from S3: {str(e)}")
+        data = response["Body"].read()
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def open_s3_object(filename, size=None, buffer_size=256 * 1024):
+    """Open an S3 object as a buffered, seekable binary file."""
+    return io.BufferedReader(S3ObjectReader(filename, size), buffer_size=buffer_size)
@@ -0,0 +1,83 @@
+"""
+Measure request throughput under parallel uploads with blocking vs pooled AWS calls.
+
+Usage:
+    python benchmarks/bench_aws_concurrency.py [parallel uploads] [upload seconds]
+
+A sleeping stand-in replaces the S3 upload so no AWS account is needed. The
+"blocking" app calls it inline in an async handler, as main.py used to; the
+"pooled" app awaits it through aws_async. Alongside the uploads, a cheap
+health-check request is timed to show how long the event loop is stalled.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx
+from fastapi import FastAPI
+import aws_async
+
+
+def fake_upload(seconds: float):
+    time.sleep(seconds)
+
+
+def build_app(pooled: bool, upload_seconds: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload():
+        if pooled:
+            await aws_async.run_in_aws_pool(fake_upload, upload_seconds)
+        else:
+            fake_upload(upload_seconds)
+        return {"ok": True}
+
+    @app.get("/")
+    async def health():
+        return {"ok": True}
+
+    return app
+
+
+async def run(pooled: bool, parallel: int, upload_seconds: float):
+    app = build_app(pooled, upload_seconds)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        start = time.perf_counter()
+        due = start + upload_seconds / 10
+
+        async def health_latency():
+            # Measured from when the request was due, so time spent waiting
+            # for a blocked event loop is included
+            await asyncio.sleep(upload_seconds / 10)
+            await client.get("/")
+            return time.perf_counter() - due
+
+        health_task = asyncio.create_task(health_latency())
+        await asyncio.gather(*(client.post("/upload") for _ in range(parallel)))
+        elapsed = time.perf_counter() - start
+        health_seconds = await health_task
+
+    return parallel / elapsed, health_seconds
+
+
+def main():
+    parallel = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    upload_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.25
+
+    print(f"{parallel} parallel uploads of {upload_seconds}s each, "
+          f"AWS pool size {aws_async.AWS_MAX_WORKERS}")
+    print(f"{'mode':<10}{'uploads/s':>12}{'health check (ms)':>20}")
+    for label, pooled in [("blocking", False), ("pooled", True)]:
+        throughput, health_seconds = asyncio.run(run(pooled, parallel, upload_seconds))
+        print(f"{label:<10}{throughput:>12.1f}{health_seconds * 1000:>20.1f}")
+    aws_async.shutdown()
+
+
+if __name__ == "__main__":
+    main()
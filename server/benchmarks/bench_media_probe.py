@@ -0,0 +1,88 @@
+"""
+Compare per-file duration probe latency against the old MoviePy path.
+
+Usage:
+    python benchmarks/bench_media_probe.py [media files...]
+
+Without arguments, short sample files are generated with the ffmpeg binary
+bundled by imageio-ffmpeg.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from media_probe import probe_duration
+
+ITERATIONS = 20
+SAMPLE_SECONDS = 30
+
+
+def generate_samples(directory: str) -> list:
+    import imageio_ffmpeg
+
+    ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+    samples = []
+    for ext in ["mp4", "mov", "webm", "mkv"]:
+        path = os.path.join(directory, f"sample.{ext}")
+        subprocess.run(
+            [ffmpeg, "-loglevel", "error", "-y",
+             "-f", "lavfi", "-i", f"sine=duration={SAMPLE_SECONDS}",
+             "-f", "lavfi", "-i", f"color=size=320x240:duration={SAMPLE_SECONDS}",
+             "-shortest", path],
+            check=True,
+        )
+        samples.append(path)
+    for ext in ["wav", "mp3", "ogg", "flac"]:
+        path = os.path.join(directory, f"sample.{ext}")
+        subprocess.run(
+            [ffmpeg, "-loglevel", "error", "-y",
+             "-f", "lavfi", "-i", f"sine=duration={SAMPLE_SECONDS}", path],
+            check=True,
+        )
+        samples.append(path)
+    return samples
+
+
+def time_call(func, path: str, iterations: int):
+    timings = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = func(path)
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def moviepy_duration(path: str) -> float:
+    from moviepy.editor import VideoFileClip
+
+    with VideoFileClip(path) as clip:
+        return clip.duration
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        paths = sys.argv[1:] or generate_samples(directory)
+
+        print(f"{'file':<16}{'probe (ms)':>12}{'moviepy (ms)':>14}{'duration (s)':>14}")
+        for path in paths:
+            duration, probe_ms = time_call(probe_duration, path, ITERATIONS)
+            try:
+                _, moviepy_ms = time_call(moviepy_duration, path, max(1, ITERATIONS // 10))
+                moviepy_display = f"{moviepy_ms:.2f}"
+            except Exception:
+                # MoviePy only handles files with a video stream
+                moviepy_display = "n/a"
+            print(
+                f"{os.path.basename(path):<16}{probe_ms:>12.3f}"
+                f"{moviepy_display:>14}{duration:>14.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
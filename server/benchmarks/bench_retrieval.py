@@ -0,0 +1,157 @@
+"""
+Compare prompt size and latency of retrieved passages against full-text prompting.
+
+Usage:
+    python benchmarks/bench_retrieval.py [transcript hours...]
+
+A synthetic transcript is generated per length: two speakers talking at about
+150 words a minute, with a handful of distinct facts planted at known times.
+For each length it reports the estimated prompt tokens with the full text and
+with the top-k passages, the time to build, serialize and load the index, and
+the per-question time to search and build the context. With ANTHROPIC_API_KEY
+set, each question is also sent to Claude both ways and the actual input
+tokens and answer latency are reported.
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from context_builder import build_context
+from transcript_format import CompactTranscript, encode_transcript
+from transcript_index import (
+    AI_RETRIEVAL_TOP_K,
+    TranscriptIndex,
+    chunk_transcript,
+    format_passages,
+)
+
+WORDS_PER_SECOND = 2.5
+FILLER = (
+    "so yeah I think we should probably look at that again later because it "
+    "kind of depends on what everyone else says about the plan and the timeline"
+).split()
+FACTS = [
+    ("The warehouse lease in Rotterdam ends in March.", "When does the Rotterdam lease end?"),
+    ("Priya will own the accessibility audit.", "Who owns the accessibility audit?"),
+    ("The churn rate fell to four percent after onboarding changed.", "What happened to churn?"),
+    ("We chose Postgres over Cassandra for the billing ledger.", "Which database is the billing ledger on?"),
+]
+ITERATIONS = 20
+
+
+def synthetic_transcript(hours: float, seed: int = 7) -> dict:
+    """AWS Transcribe-shaped JSON with facts planted at spread-out times."""
+    rng = random.Random(seed)
+    total_words = int(hours * 3600 * WORDS_PER_SECOND)
+    facts = [
+        (int(total_words * (i + 1) / (len(FACTS) + 1)), fact)
+        for i, (fact, _) in enumerate(FACTS)
+    ]
+
+    items, texts, position = [], [], 0
+    speaker, t = 0, 0.0
+    while position < total_words:
+        if facts and position >= facts[0][0]:
+            words = facts.pop(0)[1].split()
+        else:
+            words = rng.sample(FILLER, rng.randint(6, 14))
+        if rng.random() < 0.3:
+            speaker = 1 - speaker
+        for content in words:
+            items.append(
+                {
+                    "start_time": f"{t:.2f}",
+                    "end_time": f"{t + 0.3:.2f}",
+                    "speaker_label": f"spk_{speaker}",
+                    "alternatives": [{"confidence": "0.95", "content": content}],
+                    "type": "pronunciation",
+                }
+            )
+            t += 1 / WORDS_PER_SECOND
+        texts.append(" ".join(words))
+        position += len(words)
+
+    return {"results": {"transcripts": [{"transcript": " ".join(texts)}], "items": items}}
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+async def ask_claude(context: dict) -> tuple:
+    """Send a built context to Claude; returns (input tokens, seconds)."""
+    from anthropic import AsyncAnthropic
+
+    client = AsyncAnthropic()
+    started = time.perf_counter()
+    response = await client.messages.create(
+        model=os.getenv("AI_MODEL", "claude-3-haiku-20240307"),
+        max_tokens=200,
+        system=[{"type": "text", "text": b["text"]} for b in context["system"]],
+        messages=context["messages"],
+    )
+    return response.usage.input_tokens, time.perf_counter() - started
+
+
+def run(hours: float):
+    transcript = CompactTranscript(encode_transcript(synthetic_transcript(hours)))
+    text = transcript.text
+
+    chunks, chunk_ms = timed(chunk_transcript, transcript)
+    index, build_ms = timed(TranscriptIndex.build, chunks)
+    data, save_ms = timed(index.to_bytes)
+    index, load_ms = timed(TranscriptIndex.from_bytes, data)
+
+    print(
+        f"\n{hours:g} h: {len(transcript)} words, {len(chunks)} passages, "
+        f"index {len(data) / 1024:.0f} KiB "
+        f"(text {len(text.encode()) / 1024:.0f} KiB); "
+        f"chunk {chunk_ms:.0f} ms, build {build_ms:.0f} ms, "
+        f"save {save_ms:.0f} ms, load {load_ms:.0f} ms"
+    )
+    print(
+        f"{'question':<44}{'full tokens':>12}{'top-k tokens':>14}"
+        f"{'search (ms)':>13}{'fact found':>12}"
+    )
+
+    budget = 10**9
+    for fact, question in FACTS:
+        full = build_context(text, None, [], question, budget=budget)
+        samples = []
+        for _ in range(ITERATIONS):
+            started = time.perf_counter()
+            passages = index.search(question, AI_RETRIEVAL_TOP_K)
+            retrieved = build_context(
+                text, None, [], question, budget=budget, passages=format_passages(passages)
+            )
+            samples.append((time.perf_counter() - started) * 1000)
+        found = any(fact.rstrip(".") in p["text"] for p in passages)
+        print(
+            f"{question:<44}{full['estimated_tokens']:>12}"
+            f"{retrieved['estimated_tokens']:>14}"
+            f"{statistics.median(samples):>13.2f}{str(found):>12}"
+        )
+
+        if os.getenv("ANTHROPIC_API_KEY"):
+            full_tokens, full_s = asyncio.run(ask_claude(full))
+            top_tokens, top_s = asyncio.run(ask_claude(retrieved))
+            print(
+                f"{'  Claude input tokens / answer seconds':<44}"
+                f"{full_tokens:>7} {full_s:>4.1f}s{top_tokens:>9} {top_s:>4.1f}s"
+            )
+
+
+def main():
+    for hours in [float(arg) for arg in sys.argv[1:]] or [0.5, 2, 4]:
+        run(hours)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark the S3 upload engine at different file sizes and settings.
+
+Usage:
+    pip install moto
+    python benchmarks/bench_s3_upload.py [size in MB...]
+
+Uploads go to an in-process moto S3 mock, so the numbers show the engine's
+own overhead and parallelism rather than real network throughput.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import boto3
+from moto import mock_aws
+from s3_upload import MB, S3UploadEngine
+
+BUCKET = "scribe-bench"
+
+CONFIGURATIONS = [
+    # (label, part size, workers)
+    ("single put", None, 1),
+    ("8MB x 1", 8 * MB, 1),
+    ("8MB x 4", 8 * MB, 4),
+    ("16MB x 8", 16 * MB, 8),
+]
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [16, 64, 256]
+
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+
+        print(f"{'size':>8}  {'configuration':<12}{'seconds':>10}{'MB/s':>10}{'parts':>8}")
+        for size in sizes:
+            with tempfile.TemporaryFile() as f:
+                f.write(os.urandom(size * MB))
+                for label, part_size, workers in CONFIGURATIONS:
+                    engine = S3UploadEngine(
+                        client,
+                        BUCKET,
+                        multipart_threshold=part_size or (size + 1) * MB,
+                        part_size=part_size or MB,
+                        max_workers=workers,
+                    )
+                    f.seek(0)
+                    progress = engine.upload(f, f"bench/{size}.bin", "video/mp4")
+                    print(
+                        f"{size:>6}MB  {label:<12}{progress.elapsed_seconds:>10.2f}"
+                        f"{progress.bytes_per_second / MB:>10.1f}"
+                        f"{progress.parts_completed:>8}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
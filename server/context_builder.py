@@ -0,0 +1,228 @@
+import math
+import os
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from firebase_admin import firestore
+from firebase import db
+from conversation_store import AI_CONTEXT_TURNS, recent_turns, turn_position
+import metrics
+
+load_dotenv()
+
+# Most input tokens a single question may send to Claude
+AI_INPUT_TOKEN_BUDGET = int(os.getenv("AI_INPUT_TOKEN_BUDGET", "100000"))
+# Latest turns always kept verbatim; older ones are folded into the summary
+AI_RECENT_TURNS = int(os.getenv("AI_RECENT_TURNS", "6"))
+# Turns allowed to pile up past the verbatim ones before the summary is
+# refreshed, so it isn't rewritten (and its prompt cache lost) on every question
+AI_SUMMARY_BATCH_TURNS = int(os.getenv("AI_SUMMARY_BATCH_TURNS", "4"))
+# A fast, inexpensive model is enough for summarizing the conversation
+AI_SUMMARY_MODEL = os.getenv("AI_SUMMARY_MODEL", "claude-3-haiku-20240307")
+AI_SUMMARY_MAX_TOKENS = 500
+
+# Claude's tokenizer isn't available locally and counting through the API
+# costs a round trip, so tokens are estimated from the text length. This
+# errs high for English; the real counts come back with each response.
+CHARS_PER_TOKEN = 3.5
+# Role and formatting tokens added per message
+MESSAGE_OVERHEAD_TOKENS = 5
+
+# Marks the end of a prompt prefix Anthropic should cache between requests
+CACHE_CONTROL = {"type": "ephemeral"}
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant named Scribe. You take a transcription "
+    "in for a video or audio file and you answer questions if the user has "
+    "any. Answer questions based only on the provided text content. Be concise "
+    "and accurate. Talk to the user like a friend with proper greetings. Don't "
+    "start giving the summary; let only answer what the user asks about it. "
+    "Make it like a conversation."
+)
+RETRIEVAL_NOTE = (
+    "The text content is too long to include in full. Each question comes with "
+    "the passages of it most relevant to that question, headed by their time "
+    "range and speaker when known; mention the times when they help. If the "
+    "passages don't answer the question, say so."
+)
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an "
+    "assistant about a transcript. Update the summary with the new exchanges. "
+    "Keep every fact, name, number and open question the assistant may need to "
+    "answer follow-up questions; drop greetings and repetition. Reply with the "
+    "updated summary only."
+)
+
+
+def count_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def turn_tokens(turn: dict) -> int:
+    return (
+        count_tokens(turn["question"])
+        + count_tokens(turn["answer"])
+        + 2 * MESSAGE_OVERHEAD_TOKENS
+    )
+
+
+def build_system(text: str, summary: str = None, retrieval: bool = False) -> list:
+    """
+    The static instructions and the transcript, as one cached prompt prefix,
+    followed by the summary of earlier turns when there is one.
+
+    The prefix is identical for every question about a text, so after the
+    first question it's read from Anthropic's prompt cache instead of being
+    processed again. With retrieval the transcript is left out; the passages
+    relevant to each question are sent with the question instead.
+    """
+    if retrieval:
+        source = RETRIEVAL_NOTE
+    else:
+        source = f"Here's the text content to analyze, answer any question I have:\n\n{text}"
+    system = [
+        {"type": "text", "text": SYSTEM_PROMPT},
+        {"type": "text", "text": source, "cache_control": CACHE_CONTROL},
+    ]
+    if summary:
+        system.append(
+            {
+                "type": "text",
+                "text": f"Summary of our earlier conversation:\n\n{summary}",
+                "cache_control": CACHE_CONTROL,
+            }
+        )
+    return system
+
+
+def build_messages(history: list, question: str) -> list:
+    messages = []
+
+    for turn in history:
+        messages.append({"role": "user", "content": turn["question"]})
+        messages.append({"role": "assistant", "content": turn["answer"]})
+
+    # Cache the conversation so far too; the next question extends it
+    if messages:
+        messages[-1]["content"] = [
+            {"type": "text", "text": messages[-1]["content"], "cache_control": CACHE_CONTROL}
+        ]
+
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+def load_context(ai_text_ref, doc_data: dict) -> dict:
+    """
+    Read what a question needs besides the transcript: the stored summary
+    and the turns it doesn't cover yet (at most AI_CONTEXT_TURNS, newest).
+    """
+    summary = doc_data.get("summary") or {}
+    turns = recent_turns(ai_text_ref, AI_CONTEXT_TURNS, after=summary.get("through"))
+    return {"summary": summary.get("text"), "turns": turns}
+
+
+def build_context(
+    text: str,
+    summary: str,
+    turns: list,
+    question: str,
+    budget: int = AI_INPUT_TOKEN_BUDGET,
+    passages: str = None,
+) -> dict:
+    """
+    Assemble the system blocks and messages for a question within the budget.
+
+    The transcript (or the retrieved passages, when given), summary and
+    question always go in; turns not yet in the summary are added newest
+    first for as long as they fit. Raises a 413 if the transcript alone
+    doesn't fit.
+    """
+    system = build_system(text, summary, retrieval=passages is not None)
+    if passages is not None:
+        question = f"Relevant passages:\n\n{passages}\n\nQuestion: {question}"
+    tokens = sum(count_tokens(block["text"]) for block in system)
+    tokens += count_tokens(question) + MESSAGE_OVERHEAD_TOKENS
+    if tokens > budget:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Text is too long to ask about (about {tokens} tokens, limit {budget})",
+        )
+
+    kept = []
+    for turn in reversed(turns):
+        cost = turn_tokens(turn)
+        if tokens + cost > budget:
+            break
+        tokens += cost
+        kept.append(turn)
+    kept.reverse()
+
+    dropped = len(turns) - len(kept)
+    if dropped:
+        metrics.increment("ai.context_turns_dropped", dropped)
+    metrics.observe("ai.estimated_input_tokens", tokens)
+
+    return {
+        "system": system,
+        "messages": build_messages(kept, question),
+        "estimated_tokens": tokens,
+        "turns": len(kept),
+        "dropped_turns": dropped,
+    }
+
+
+def summary_request(summary: str, turns: list) -> str:
+    exchanges = "\n\n".join(
+        f"User: {turn['question']}\nAssistant: {turn['answer']}" for turn in turns
+    )
+    return (
+        f"Current summary:\n{summary or '(none yet)'}\n\n"
+        f"New exchanges:\n{exchanges}"
+    )
+
+
+@firestore.transactional
+def _store_summary(transaction, ai_text_ref, previous: dict, summary: dict) -> bool:
+    """Save the summary unless another request refreshed it in the meantime."""
+    snapshot = ai_text_ref.get(transaction=transaction)
+    current = (snapshot.to_dict() or {}).get("summary") or {}
+    if (current.get("through") or {}).get("id") != (previous.get("through") or {}).get("id"):
+        return False
+    transaction.update(ai_text_ref, {"summary": summary})
+    return True
+
+
+async def refresh_summary(ai_text_ref, create) -> bool:
+    """
+    Fold the turns older than the verbatim window into the running summary.
+
+    Runs after an answer is sent. Nothing happens until more than
+    AI_SUMMARY_BATCH_TURNS turns have accumulated past the verbatim ones;
+    then the previous summary and those turns are summarized with `create`
+    (the Messages API's create) and stored with the position of the last
+    turn they cover. Returns whether a new summary was stored.
+    """
+    doc_data = ai_text_ref.get().to_dict() or {}
+    previous = doc_data.get("summary") or {}
+    turns = recent_turns(ai_text_ref, AI_CONTEXT_TURNS, after=previous.get("through"))
+    if len(turns) <= AI_RECENT_TURNS + AI_SUMMARY_BATCH_TURNS:
+        return False
+
+    folded = turns[: len(turns) - AI_RECENT_TURNS]
+    response = await create(
+        model=AI_SUMMARY_MODEL,
+        max_tokens=AI_SUMMARY_MAX_TOKENS,
+        system=SUMMARY_PROMPT,
+        messages=[
+            {"role": "user", "content": summary_request(previous.get("text"), folded)}
+        ],
+    )
+    summary = {
+        "text": response.content[0].text,
+        "through": turn_position(folded[-1]),
+        "turns": previous.get("turns", 0) + len(folded),
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+
+    stored = _store_summary(db.transaction(), ai_text_ref, previous, summary)
+    metrics.increment("ai.summary_refreshes" if stored else "ai.summary_conflicts")
+    return stored
@@ -0,0 +1,158 @@
+import base64
+import json
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from firebase_admin import firestore
+from firebase import db
+
+load_dotenv()
+
+# Earlier turns sent to Claude with each new question
+AI_CONTEXT_TURNS = int(os.getenv("AI_CONTEXT_TURNS", "20"))
+# Firestore allows 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+# Fields of a turn document returned to clients and used as context
+TURN_FIELDS = ["question", "answer", "timestamp", "usage"]
+
+
+def turns_ref(ai_text_ref):
+    """The append-only turns subcollection of an ai_texts document."""
+    return ai_text_ref.collection("turns")
+
+
+def _turn(doc) -> dict:
+    data = doc.to_dict()
+    return {"id": doc.id, **{field: data.get(field) for field in TURN_FIELDS}}
+
+
+def encode_cursor(doc) -> str:
+    """Opaque page cursor holding the last turn's (created_at, doc ID)."""
+    position = [doc.get("created_at").isoformat(), doc.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Reverse encode_cursor into a start_after position; raises ValueError."""
+    try:
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"created_at": datetime.fromisoformat(created_at), "__name__": doc_id}
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def append_turn(ai_text_ref, turn: dict, doc_updates: dict = None):
+    """
+    Add a turn to the conversation.
+
+    The turn is created as its own document, in the same batch as the
+    version bump on the ai_texts document, so concurrent questions on one
+    text never overwrite each other's turns and the ai_texts document stays
+    the same size however long the conversation gets.
+    """
+    turn_ref = turns_ref(ai_text_ref).document()
+    batch = db.batch()
+    batch.create(turn_ref, {**turn, "created_at": firestore.SERVER_TIMESTAMP})
+    batch.update(
+        ai_text_ref,
+        {
+            "version": firestore.Increment(1),
+            "last_accessed": firestore.SERVER_TIMESTAMP,
+            **(doc_updates or {}),
+        },
+    )
+    batch.commit()
+    return turn_ref.id
+
+
+def turn_position(turn: dict) -> dict:
+    """Where a turn sits in the conversation, as stored alongside summaries."""
+    return {"created_at": turn["created_at"], "id": turn["id"]}
+
+
+def recent_turns(ai_text_ref, limit: int = AI_CONTEXT_TURNS, after: dict = None) -> list:
+    """
+    The last `limit` turns, oldest first, read with a single query.
+
+    With `after` (a turn_position), only turns newer than that one are read.
+    """
+    if limit <= 0:
+        return []
+    query = (
+        turns_ref(ai_text_ref)
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+        .order_by("__name__", direction=firestore.Query.DESCENDING)
+        .limit(limit)
+    )
+    if after:
+        query = query.end_before(
+            {"created_at": after["created_at"], "__name__": after["id"]}
+        )
+    return [
+        {**_turn(doc), "created_at": doc.get("created_at")}
+        for doc in reversed(list(query.stream()))
+    ]
+
+
+def list_turns(ai_text_ref, page_size: int, cursor: str = None) -> tuple:
+    """One page of the conversation in order. Returns (turns, next cursor or None)."""
+    query = (
+        turns_ref(ai_text_ref)
+        .order_by("created_at")
+        .order_by("__name__")
+        .limit(page_size)
+    )
+    if cursor:
+        query = query.start_after(decode_cursor(cursor))
+
+    docs = list(query.stream())
+    next_cursor = encode_cursor(docs[-1]) if len(docs) == page_size else None
+    return [_turn(doc) for doc in docs], next_cursor
+
+
+def migrate_history(ai_text_ref, doc_data: dict) -> int:
+    """
+    Move a conversation_history array written by earlier versions into turns.
+
+    Legacy turns get deterministic document IDs and their original
+    timestamps, so running this twice, even concurrently, writes the same
+    documents. The array is removed in the last batch. Returns the number of
+    turns moved.
+    """
+    history = doc_data.get("conversation_history")
+    if not history:
+        return 0
+
+    writes = []
+    for index, turn in enumerate(history):
+        try:
+            created_at = datetime.fromisoformat(turn["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            created_at = datetime.min
+        writes.append(
+            (
+                turns_ref(ai_text_ref).document(f"legacy-{index:05d}"),
+                {
+                    **{field: turn.get(field) for field in TURN_FIELDS},
+                    "created_at": created_at,
+                },
+            )
+        )
+
+    for start in range(0, len(writes), MAX_BATCH_WRITES - 1):
+        batch = db.batch()
+        for turn_ref, data in writes[start : start + MAX_BATCH_WRITES - 1]:
+            batch.set(turn_ref, data)
+        if start + MAX_BATCH_WRITES - 1 >= len(writes):
+            batch.update(
+                ai_text_ref,
+                {
+                    "conversation_history": firestore.DELETE_FIELD,
+                    "version": firestore.Increment(1),
+                },
+            )
+        batch.commit()
+
+    print(f"Moved {len(history)} conversation turns to {ai_text_ref.id}/turns")
+    return len(history)
@@ -0,0 +1,179 @@
+import gzip
+import hashlib
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+import metrics
+
+# Responses smaller than this aren't worth compressing
+COMPRESSION_MINIMUM_SIZE = 1024
+# Clients may keep responses but must revalidate them with their ETag
+CACHE_CONTROL = "private, no-cache"
+
+# Suffixes of the pre-compressed variants kept in the transcript store
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def supported_encodings() -> list:
+    """Content codings we can produce, most preferred first."""
+    return ["br", "gzip"]
+
+
+def negotiate_encoding(accept_encoding: str):
+    """Pick the best content coding the client accepts, or None for identity."""
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for entry in accept_encoding.split(","):
+        coding, _, params = entry.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best = None
+    for coding in supported_encodings():
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (coding, weight)
+    return best[0] if best else None
+
+
+def compress(data: bytes, coding: str, level: int = None) -> bytes:
+    """Compress bytes with a content coding from supported_encodings()."""
+    if coding == "br":
+        return brotli.compress(data, quality=11 if level is None else level)
+    # mtime=0 keeps the output byte-identical for the same input
+    return gzip.compress(data, compresslevel=9 if level is None else level, mtime=0)
+
+
+def etag_for(*parts) -> str:
+    """Opaque entity tag for a response determined by the given values."""
+    return hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()[
+        :32
+    ]
+
+
+def format_etag(tag: str, coding: str = None) -> str:
+    """Strong ETag header value; each content coding gets its own tag."""
+    return f'"{tag}-{coding}"' if coding else f'"{tag}"'
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    """Weak comparison of an If-None-Match header against any coding of a tag."""
+    if not if_none_match:
+        return False
+    candidates = {format_etag(tag)} | {
+        format_etag(tag, coding) for coding in ENCODING_SUFFIXES
+    }
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value == "*":
+            return True
+        if value.startswith("W/"):
+            value = value[2:]
+        if value in candidates:
+            return True
+    return False
+
+
+def cache_headers(tag: str, coding: str = None) -> dict:
+    headers = {
+        "ETag": format_etag(tag, coding),
+        "Cache-Control": CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if coding:
+        headers["Content-Encoding"] = coding
+    return headers
+
+
+def not_modified_response(request, tag: str):
+    """Return a 304 response if the request already holds this tag, else None."""
+    if not etag_matches(request.headers.get("if-none-match"), tag):
+        return None
+    metrics.increment("http_cache.not_modified")
+    coding = negotiate_encoding(request.headers.get("accept-encoding"))
+    return Response(status_code=304, headers=cache_headers(tag, coding))
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type == "text/event-stream":
+        return False
+    return content_type.startswith("text/") or content_type in (
+        "application/json",
+        "application/javascript",
+        "application/xml",
+    )
+
+
+class CompressionMiddleware:
+    """
+    Compress complete responses with the best coding the client accepts.
+
+    Streamed responses (Server-Sent Events, chunked bodies) and responses that
+    already carry a Content-Encoding, such as pre-compressed transcripts, pass
+    through untouched. A strong ETag on a compressed response is rewritten to
+    the tag of that coding so the two representations never share one.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        coding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not is_compressible(headers.get("content-type", ""))
+            ):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            # Dynamic responses use a faster level than stored variants
+            compressed = compress(body, coding, level=5 if coding == "br" else 6)
+            headers["Content-Encoding"] = coding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and etag.startswith('"'):
+                headers["ETag"] = format_etag(etag.strip('"'), coding)
+            metrics.observe("http_cache.compression_ratio", len(compressed) / len(body))
+
+            passthrough = True
+            await send(start)
+            await send({**message, "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
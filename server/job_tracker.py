@@ -0,0 +1,361 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from firebase_admin import firestore
+from firebase import db
+import aws_async
+import metrics
+from lease import Lease
+
+load_dotenv()
+
+# Bounds on how long the tracker waits between checks of running jobs
+TRANSCRIPTION_MIN_POLL_INTERVAL = float(os.getenv("TRANSCRIPTION_MIN_POLL_INTERVAL", "10"))
+TRANSCRIPTION_MAX_POLL_INTERVAL = float(os.getenv("TRANSCRIPTION_MAX_POLL_INTERVAL", "300"))
+# How often jobs registered by other replicas are picked up from Firestore
+TRANSCRIPTION_JOB_RELOAD_INTERVAL = float(
+    os.getenv("TRANSCRIPTION_JOB_RELOAD_INTERVAL", "60")
+)
+# AWS Transcribe typically needs a fraction of the media's length; the first
+# check of a job waits about this long per second of media
+TRANSCRIBE_SECONDS_PER_MEDIA_SECOND = float(
+    os.getenv("TRANSCRIBE_SECONDS_PER_MEDIA_SECOND", "0.5")
+)
+# Replicas that may poll AWS; of those, only the holder of the tracker lease
+# does, while the rest just register the jobs they start
+JOB_TRACKER_ENABLED = os.getenv("JOB_TRACKER_ENABLED", "true").lower() == "true"
+# How long the tracker lease lasts without renewal; the holder renews it three
+# times per period, and another replica takes over once it lapses
+JOB_TRACKER_LEASE_SECONDS = float(os.getenv("JOB_TRACKER_LEASE_SECONDS", "60"))
+# Shared secret expected on transcription completion events
+TRANSCRIPTION_EVENT_TOKEN = os.getenv("TRANSCRIPTION_EVENT_TOKEN")
+
+# Every job started by upload_media shares this prefix
+JOB_NAME_PREFIX = "transcribe_"
+RUNNING_STATUSES = ("QUEUED", "IN_PROGRESS")
+LIST_JOBS_PAGE_SIZE = 100
+# Firestore allows 500 writes per batch; each finished job takes two
+JOBS_PER_WRITE_BATCH = 250
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+
+# Lease electing the replica that polls
+LEASE_COLLECTION = "leases"
+LEASE_DOCUMENT = "transcription_job_tracker"
+
+
+def upload_status_fields(status: dict) -> dict:
+    """Map a job status to the fields stored on the upload document."""
+    fields = {"transcription_status": status["status"]}
+    if status["status"] == "COMPLETED":
+        fields["transcript_uri"] = status["transcript_uri"]
+    elif status["status"] == "FAILED":
+        fields["failure_reason"] = status.get("failure_reason", "Unknown error")
+    return fields
+
+
+def stored_status(doc_data: dict) -> dict:
+    """Build a transcription status response from an upload document."""
+    status = {
+        "status": doc_data.get("transcription_status", "IN_PROGRESS"),
+        "job_name": doc_data.get("transcription_job_name"),
+    }
+    if status["status"] == "COMPLETED":
+        status["transcript_uri"] = doc_data.get("transcript_uri")
+    elif status["status"] == "FAILED":
+        status["failure_reason"] = doc_data.get("failure_reason", "Unknown error")
+    return status
+
+
+class JobTracker:
+    """
+    Watch in-flight transcription jobs from a single background task and write
+    each job's final status to its upload document exactly once.
+
+    Each poll lists the account's running jobs a page at a time with
+    ListTranscriptionJobs, so the AWS cost is O(jobs / page size) whatever the
+    number of clients. Only jobs that have dropped off that list are fetched
+    individually, once, for their transcript location. Results are written to
+    Firestore in batches.
+
+    Polls are scheduled from each job's age and media duration: the first
+    check waits for the expected processing time, and jobs that run past it
+    are checked with exponential backoff.
+
+    Jobs are registered in the transcription_jobs collection when they start
+    and reloaded periodically, so the tracker also covers jobs started by other
+    workers or before a restart. Completion events (see record_result) settle a
+    job without waiting for the next poll.
+
+    Every replica may run a tracker, but only the one holding a Firestore
+    lease polls; the others stand by and take over if it stops renewing.
+    """
+
+    def __init__(
+        self,
+        min_poll_interval: float = TRANSCRIPTION_MIN_POLL_INTERVAL,
+        max_poll_interval: float = TRANSCRIPTION_MAX_POLL_INTERVAL,
+        reload_interval: float = TRANSCRIPTION_JOB_RELOAD_INTERVAL,
+        lease: Lease = None,
+    ):
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.reload_interval = reload_interval
+        self.lease = lease or Lease(
+            db.collection(LEASE_COLLECTION).document(LEASE_DOCUMENT),
+            JOB_TRACKER_LEASE_SECONDS,
+        )
+        self.leader = False
+        self._lease_checked = 0.0
+        self._jobs = {}  # job_name -> {"doc_path", "created_at", "media_duration", ...}
+        self._task = None
+        self._wake = asyncio.Event()
+        self._last_reload = 0.0
+
+    async def register(self, job_name: str, doc_ref, user_id: str, media_duration=None):
+        """Record a newly started job in Firestore, and watch it if polling here.
+
+        Standbys only record it; the lease holder picks it up on its next
+        reload, so their in-memory jobs don't pile up unpruned.
+        """
+        await asyncio.to_thread(
+            db.collection("transcription_jobs").document(job_name).set,
+            {
+                "job_name": job_name,
+                "doc_path": doc_ref.path,
+                "user_id": user_id,
+                "status": "IN_PROGRESS",
+                "media_duration": media_duration,
+                "created_at": firestore.SERVER_TIMESTAMP,
+            },
+        )
+        if self.leader:
+            self.track(job_name, doc_ref.path, time.time(), media_duration)
+
+    def track(self, job_name: str, doc_path: str, created_at: float, media_duration=None):
+        """Start watching a job that is already registered."""
+        if job_name not in self._jobs:
+            expected = self.expected_seconds(media_duration)
+            self._jobs[job_name] = {
+                "doc_path": doc_path,
+                "created_at": created_at,
+                "media_duration": media_duration,
+                "checks": 0,
+                "next_check": created_at + expected,
+            }
+            self._wake.set()
+        metrics.set_gauge("transcription_jobs.tracked", len(self._jobs))
+
+    def expected_seconds(self, media_duration) -> float:
+        """How long a job is expected to run before its first check."""
+        if not media_duration:
+            return self.min_poll_interval
+        return max(
+            self.min_poll_interval, media_duration * TRANSCRIBE_SECONDS_PER_MEDIA_SECOND
+        )
+
+    async def load_in_progress_jobs(self):
+        """Watch every job Firestore has as in progress, including ones started
+        by other workers or before a restart."""
+        jobs = await asyncio.to_thread(self._read_in_progress_jobs)
+        in_progress = set()
+        for job_name, data in jobs:
+            created_at = data.get("created_at")
+            self.track(
+                job_name,
+                data["doc_path"],
+                created_at.timestamp() if created_at else time.time(),
+                data.get("media_duration"),
+            )
+            in_progress.add(job_name)
+
+        # Jobs settled elsewhere (by an event, or another tracker) are dropped
+        for job_name in set(self._jobs) - in_progress:
+            del self._jobs[job_name]
+        self._last_reload = time.time()
+        metrics.set_gauge("transcription_jobs.tracked", len(self._jobs))
+
+    def _read_in_progress_jobs(self) -> list:
+        """(job name, data) of each in-progress job. Blocking."""
+        jobs = (
+            db.collection("transcription_jobs")
+            .where("status", "==", "IN_PROGRESS")
+            .stream()
+        )
+        return [(job.id, job.to_dict()) for job in jobs]
+
+    async def record_result(self, job_name: str, status: dict, doc_path: str = None):
+        """Write a finished job's status to its upload document and stop watching."""
+        if doc_path is None and job_name in self._jobs:
+            doc_path = self._jobs[job_name]["doc_path"]
+        if doc_path is None:
+            job_doc = await asyncio.to_thread(
+                db.collection("transcription_jobs").document(job_name).get
+            )
+            if not job_doc.exists:
+                print(f"Ignoring status for unknown transcription job {job_name}")
+                return
+            doc_path = job_doc.to_dict()["doc_path"]
+
+        await self.record_results([(job_name, doc_path, status)])
+
+    async def record_results(self, results: list):
+        """Write (job_name, doc_path, status) results to Firestore in batches."""
+        finished = [
+            result for result in results if result[2]["status"] in TERMINAL_STATUSES
+        ]
+        if finished:
+            # Firestore's client blocks, so the writes run off the event loop
+            await asyncio.to_thread(self._write_results, finished)
+
+        for job_name, _, status in finished:
+            self._jobs.pop(job_name, None)
+            metrics.increment(f"transcription_jobs.{status['status'].lower()}")
+        metrics.set_gauge("transcription_jobs.tracked", len(self._jobs))
+
+    def _write_results(self, finished: list):
+        """Commit finished jobs' statuses in batches. Blocking."""
+        for start in range(0, len(finished), JOBS_PER_WRITE_BATCH):
+            batch = db.batch()
+            for job_name, doc_path, status in finished[
+                start : start + JOBS_PER_WRITE_BATCH
+            ]:
+                batch.update(db.document(doc_path), upload_status_fields(status))
+                batch.update(
+                    db.collection("transcription_jobs").document(job_name),
+                    {
+                        "status": status["status"],
+                        "completed_at": firestore.SERVER_TIMESTAMP,
+                    },
+                )
+            batch.commit()
+
+    async def list_running_jobs(self) -> set:
+        """Page through every queued or running job and return their names."""
+        running = set()
+        for job_status in RUNNING_STATUSES:
+            next_token = None
+            while True:
+                summaries, next_token = await aws_async.list_transcription_jobs(
+                    job_status, JOB_NAME_PREFIX, next_token, LIST_JOBS_PAGE_SIZE
+                )
+                metrics.increment("transcription_jobs.aws_list_calls")
+                running.update(summary["TranscriptionJobName"] for summary in summaries)
+                if not next_token:
+                    break
+        return running
+
+    def due_jobs(self, now: float) -> list:
+        return [name for name, job in self._jobs.items() if job["next_check"] <= now]
+
+    def next_poll_delay(self, now: float) -> float:
+        """Seconds until the next job is due, within the poll interval bounds."""
+        next_check = min(
+            (job["next_check"] for job in self._jobs.values()),
+            default=now + self.max_poll_interval,
+        )
+        delay = min(next_check - now, self.reload_interval - (now - self._last_reload))
+        return min(self.max_poll_interval, max(self.min_poll_interval, delay))
+
+    async def poll_once(self):
+        """Reconcile tracked jobs with the running jobs AWS reports."""
+        if not self._jobs:
+            return
+
+        running = await self.list_running_jobs()
+
+        results = []
+        now = time.time()
+        for job_name, job in list(self._jobs.items()):
+            if job_name in running:
+                # Still running: back off, doubling the wait after each check
+                if job["next_check"] <= now:
+                    job["checks"] += 1
+                    job["next_check"] = now + min(
+                        self.max_poll_interval,
+                        self.min_poll_interval * 2 ** job["checks"],
+                    )
+                continue
+
+            # No longer listed as running, so fetch its final status once
+            try:
+                status = await aws_async.get_transcription_job_status(job_name)
+                metrics.increment("transcription_jobs.aws_status_calls")
+                results.append((job_name, job["doc_path"], status))
+            except Exception as e:
+                print(f"Error checking transcription job {job_name}: {str(e)}")
+
+        await self.record_results(results)
+
+    async def hold_lease(self) -> bool:
+        """Take or renew the tracker lease when due; return whether it's held."""
+        now = time.time()
+        if now - self._lease_checked < self.lease.duration / 3:
+            return self.leader
+        try:
+            leader = await asyncio.to_thread(self.lease.acquire)
+        except Exception as e:
+            print(f"Error renewing the job tracker lease: {str(e)}")
+            leader = False
+        if leader and not self.leader:
+            # Pick up the jobs the previous holder was watching right away
+            self._last_reload = 0.0
+        elif self.leader and not leader:
+            # The new holder watches them now
+            self._jobs.clear()
+            metrics.set_gauge("transcription_jobs.tracked", 0)
+        self.leader = leader
+        self._lease_checked = now
+        metrics.set_gauge("transcription_jobs.leader", int(leader))
+        return leader
+
+    async def _run(self):
+        while True:
+            if not await self.hold_lease():
+                # Another replica polls; check back in case its lease lapses
+                delay = self.lease.duration / 3
+            else:
+                if time.time() - self._last_reload >= self.reload_interval:
+                    try:
+                        await self.load_in_progress_jobs()
+                    except Exception as e:
+                        print(f"Error loading in-progress transcription jobs: {str(e)}")
+
+                if self.due_jobs(time.time()):
+                    try:
+                        await self.poll_once()
+                    except Exception as e:
+                        print(f"Error polling transcription jobs: {str(e)}")
+
+                delay = min(self.next_poll_delay(time.time()), self.lease.duration / 3)
+
+            # Sleep until the next job is due, or until a new job is tracked
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.leader:
+            # Let another replica take over without waiting for expiry
+            try:
+                await asyncio.to_thread(self.lease.release)
+            except Exception as e:
+                print(f"Error releasing the job tracker lease: {str(e)}")
+            self.leader = False
+
+
+tracker = JobTracker()
@@ -0,0 +1,59 @@
+import os
+import socket
+import time
+import uuid
+from firebase_admin import firestore
+from firebase import db
+
+
+def claim_lease(lease: dict, holder: str, now: float, duration: float):
+    """Return the new lease document if holder may take or renew it, else None."""
+    if lease and lease.get("holder") != holder and lease.get("expires_at", 0) > now:
+        return None
+    return {"holder": holder, "expires_at": now + duration, "renewed_at": now}
+
+
+class Lease:
+    """
+    Firestore lease electing one replica to run some background work.
+
+    The lease document names its holder and an expiry time; it is taken or
+    renewed in a transaction, so two replicas can't both hold it. A holder
+    that dies simply stops renewing, and another replica takes over once the
+    lease expires.
+    """
+
+    def __init__(self, ref, duration: float, holder: str = None):
+        self.ref = ref
+        self.duration = duration
+        self.holder = holder or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    def acquire(self) -> bool:
+        """Take or renew the lease. Blocking."""
+
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = self.ref.get(transaction=transaction)
+            lease = claim_lease(
+                snapshot.to_dict() if snapshot.exists else None,
+                self.holder,
+                time.time(),
+                self.duration,
+            )
+            if lease is None:
+                return False
+            transaction.set(self.ref, lease)
+            return True
+
+        return claim(db.transaction())
+
+    def release(self):
+        """Give the lease up early so another replica needn't wait for expiry."""
+
+        @firestore.transactional
+        def drop(transaction):
+            snapshot = self.ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.to_dict().get("holder") == self.holder:
+                transaction.delete(self.ref)
+
+        drop(db.transaction())
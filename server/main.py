@@ -1,28 +1,85 @@
-import time
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
+from fastapi import (
+    FastAPI,
+    File,
+    UploadFile,
+    HTTPException,
+    Depends,
+    Header,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from starlette.middleware.cors import CORSMiddleware
 from firebase_admin import firestore
+import json
 import uuid
 import os
 import sys
 import argparse
 from dotenv import load_dotenv
-import tempfile
-from moviepy.editor import VideoFileClip
-from mutagen import File as MutagenFile
+from starlette.concurrency import run_in_threadpool
 from ai import ai_router
-from aws_service import (
+from ai_gateway import gateway as ai_gateway
+import answer_cache
+from status_events import status_events_router
+import aws_async
+from aws_async import (
     upload_file_to_s3,
-    generate_presigned_url,
     start_transcription_job,
     get_transcription_job_status,
-    get_transcription_result,
+    create_multipart_upload,
+    generate_presigned_part_urls,
+    complete_multipart_upload,
+    abort_multipart_upload,
+    get_object_size,
+    delete_file_from_s3,
+    probe_s3_object_duration,
 )
 from firebase import db
-from models import SubscriptionTier
+import metrics
+from job_tracker import (
+    tracker as job_tracker,
+    stored_status,
+    JOB_TRACKER_ENABLED,
+    TRANSCRIPTION_EVENT_TOKEN,
+)
+from s3_upload import list_upload_progress, S3_PART_SIZE
+from transcript_store import (
+    load_compact_transcript,
+    load_transcript,
+    store as transcript_store,
+)
+from media_probe import probe_duration
+from upload_index import (
+    MEDIA_COLLECTIONS,
+    find_upload_doc,
+    list_uploads,
+    locator as upload_locator,
+)
+from presigned_urls import (
+    presigned_url,
+    presigned_urls,
+    s3_key_from_url,
+    upload_s3_key,
+)
+from http_cache import (
+    CompressionMiddleware,
+    cache_headers,
+    etag_for,
+    negotiate_encoding,
+    not_modified_response,
+)
+from models import (
+    SubscriptionTier,
+    MultipartUploadRequest,
+    CompleteMultipartUploadRequest,
+    AbortMultipartUploadRequest,
+    MediaUrlsRequest,
+)
 import subscription_service as subscription
-from migration import migrate_user_subscriptions
+from migration import migrate_user_subscriptions, supervisor as migration_supervisor
 
 load_dotenv()
 
@@ -41,25 +98,72 @@ PRO_MAX_DURATION_SECONDS = (
 TESTING_MODE = False  # Global flag for testing mode
 MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() == "true"
 
-def get_audio_duration(file_path: str) -> float:
-    """Get audio file duration using mutagen."""
-    audio = MutagenFile(file_path)
-    if audio is None:
-        raise ValueError("Could not determine audio file duration")
-    return audio.info.length
+# Uploads are validated in chunks of this size so memory stays flat per request
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB in bytes
+
+# Direct-to-S3 uploads: S3 allows at most 10,000 parts per multipart upload
+MAX_UPLOAD_PARTS = 10000
+PRESIGNED_PART_URL_EXPIRATION = 3600  # 1 hour in seconds
+
+# Words per page when a transcript is read by time window or cursor
+DEFAULT_TRANSCRIPT_PAGE_SIZE = 500
+MAX_TRANSCRIPT_PAGE_SIZE = 5000
+
+# Presigned URLs refreshed per /media-urls request
+MAX_MEDIA_URL_BATCH = 500
+
+# Uploads per page of a user's library
+DEFAULT_UPLOAD_PAGE_SIZE = 50
+MAX_UPLOAD_PAGE_SIZE = 200
+
+
+def get_tier_limits(is_pro: bool) -> tuple:
+    """Get the (file size, duration) limits for a subscription tier."""
+    if is_pro:
+        return PRO_MAX_FILE_SIZE, PRO_MAX_DURATION_SECONDS
+    return MAX_FILE_SIZE, MAX_DURATION_SECONDS
+
+
+def raise_file_size_exceeded(file_size_limit: int, is_pro: bool) -> None:
+    """Raise the 400 error returned when an upload is over its tier's size limit."""
+    if is_pro:
+        limit_display = f"{file_size_limit / (1024 * 1024 * 1024):.1f} GB"
+    else:
+        limit_display = f"{file_size_limit / (1024 * 1024):.0f} MB"
+
+    raise HTTPException(
+        status_code=400, detail=f"File size exceeds {limit_display} limit"
+    )
+
+
+def raise_duration_exceeded(duration_limit: int, is_pro: bool) -> None:
+    """Raise the 400 error returned when an upload is over its tier's duration limit."""
+    if is_pro:
+        limit_display = f"{duration_limit / 3600:.0f}-hour"
+    else:
+        limit_display = f"{duration_limit / 60:.0f}-minute"
+
+    raise HTTPException(
+        status_code=400, detail=f"File duration exceeds {limit_display} limit"
+    )
+
+
+def is_media_content_type(content_type: str) -> bool:
+    return content_type.startswith("audio/") or content_type.startswith("video/")
 
 
 async def validate_media_file(
     file: UploadFile, user_id: str, testing_mode: bool = False
-) -> None:
-    """Validate uploaded media file, with different limits for Pro users."""
+) -> float:
+    """Validate uploaded media file, with different limits for Pro users.
+
+    Returns the media duration in seconds.
+    """
     if not file:
         raise HTTPException(status_code=400, detail="File size is required.")
 
     # Validate file type
-    if not (
-        file.content_type.startswith("audio/") or file.content_type.startswith("video/")
-    ):
+    if not is_media_content_type(file.content_type):
         raise HTTPException(
             status_code=400,
             detail="Invalid file type. Only audio and video files are allowed.",
@@ -69,39 +173,28 @@ async def validate_media_file(
     is_pro = await subscription.is_pro_user(user_id)
 
     # Set limits based on subscription tier
-    file_size_limit = PRO_MAX_FILE_SIZE if is_pro else MAX_FILE_SIZE
-    duration_limit = PRO_MAX_DURATION_SECONDS if is_pro else MAX_DURATION_SECONDS
+    file_size_limit, duration_limit = get_tier_limits(is_pro)
 
-    # Check file size first
-    file_contents = await file.read()
-    file_size = len(file_contents)
-
-    if file_size > file_size_limit:
-        if is_pro:
-            limit_display = f"{file_size_limit / (1024 * 1024 * 1024):.1f} GB"
-        else:
-            limit_display = f"{file_size_limit / (1024 * 1024):.0f} MB"
-
-        raise HTTPException(
-            status_code=400, detail=f"File size exceeds {limit_display} limit"
-        )
-
-    # Create temporary file for duration check
-    with tempfile.NamedTemporaryFile(
-        delete=False, suffix=os.path.splitext(file.filename)[1]
-    ) as temp_file:
-        temp_file.write(file_contents)
-        temp_file_path = temp_file.name
+    # Reject early when the multipart parser already knows the size
+    if file.size is not None and file.size > file_size_limit:
+        raise_file_size_exceeded(file_size_limit, is_pro)
 
     try:
-        # Check duration based on file type
-        duration = None
+        # Stream the upload chunk by chunk so the whole file is never held in
+        # memory, stopping as soon as the size limit is crossed
+        file_size = 0
+        await file.seek(0)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > file_size_limit:
+                raise_file_size_exceeded(file_size_limit, is_pro)
+
+        # Read the duration from the container headers; only unknown
+        # containers fall back to ffprobe, so keep it off the event loop
         try:
-            if file.content_type.startswith("video/"):
-                with VideoFileClip(temp_file_path) as video:
-                    duration = video.duration
-            elif file.content_type.startswith("audio/"):
-                duration = get_audio_duration(temp_file_path)
+            duration = await run_in_threadpool(
+                probe_duration, file.file, file.filename
+            )
         except Exception as e:
             print(f"Error reading duration: {str(e)}")
             duration = None
@@ -110,35 +203,31 @@ async def validate_media_file(
             raise HTTPException(status_code=400, detail="File duration is required.")
 
         if duration > duration_limit:
-            if is_pro:
-                limit_display = f"{duration_limit / 3600:.0f}-hour"
-            else:
-                limit_display = f"{duration_limit / 60:.0f}-minute"
-
-            raise HTTPException(
-                status_code=400, detail=f"File duration exceeds {limit_display} limit"
-            )
+            raise_duration_exceeded(duration_limit, is_pro)
 
     finally:
-        # Clean up temporary file
-        try:
-            os.unlink(temp_file_path)
-        except:
-            pass
         # Reset file position for subsequent operations
-        file.file.seek(0)
+        await file.seek(0)
 
-    # Reset file position after reading
-    await file.seek(0)
+    return duration
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Run migration on startup if enabled
+    # Run migration in the background if enabled; one replica takes the lease
+    # and runs it while every replica starts serving right away
     if MIGRATE_ON_STARTUP:
-        print("Running subscription migration on startup...")
-        await migrate_user_subscriptions()
+        print("Starting subscription migration in the background...")
+        migration_supervisor.start()
+    if JOB_TRACKER_ENABLED:
+        job_tracker.start()
+    if subscription.SUBSCRIPTION_CACHE_LISTENER:
+        subscription.start_subscription_listener()
     yield
+    subscription.stop_subscription_listener()
+    await migration_supervisor.stop()
+    await job_tracker.stop()
+    aws_async.shutdown()
 
 
 # Add a command line parser for migrations
@@ -178,9 +267,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+app.add_middleware(CompressionMiddleware)
 
 app.include_router(ai_router, prefix="/ai")
+app.include_router(status_events_router)
 
 @app.get("/")
 async def read_root():
@@ -195,7 +287,7 @@ async def upload_media(user_id: str, file: UploadFile = File(...)):
     print(f"User ID: {user_id}")
     print(f"Testing mode: {TESTING_MODE}")
 
-    await validate_media_file(file, user_id, testing_mode=TESTING_MODE)
+    duration = await validate_media_file(file, user_id, testing_mode=TESTING_MODE)
 
     unique_filename = f"{uuid.uuid4()}_{file.filename}"
     media_type = "audio" if file.content_type.startswith("audio/") else "video"
@@ -209,42 +301,209 @@ async def upload_media(user_id: str, file: UploadFile = File(...)):
             }
 
         # Upload file to S3
-        upload_file_to_s3(file.file, s3_path, file.content_type)
-        file_url = generate_presigned_url(s3_path)
-
-        # Start transcription job
-        job_name = f"transcribe_{uuid.uuid4()}"
-        transcription_job_name = start_transcription_job(s3_path, job_name)
-
-        # Save metadata to Firestore
-        doc_ref = (
-            db.collection("uploads")
-            .document(user_id)
-            .collection(f"{media_type}_files")
-            .document()
+        upload_progress = await upload_file_to_s3(file.file, s3_path, file.content_type)
+        print(
+            f"Uploaded {upload_progress.bytes_sent} bytes to S3 at "
+            f"{upload_progress.bytes_per_second / (1024 * 1024):.1f} MB/s"
         )
-        doc_id = doc_ref.id
-        doc_ref.set(
-            {
-                "id": doc_id,
-                "filename": unique_filename,
-                "original_filename": file.filename,
-                "file_url": file_url,
-                "user_id": user_id,
-                "content_type": file.content_type,
-                "upload_timestamp": firestore.SERVER_TIMESTAMP,
-                "transcription_job_name": transcription_job_name,
-                "transcription_status": "IN_PROGRESS",
-            }
+        return await start_transcription_and_save(
+            user_id, media_type, s3_path, file.filename, file.content_type, duration
         )
 
-        return {
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+async def start_transcription_and_save(
+    user_id: str,
+    media_type: str,
+    s3_path: str,
+    original_filename: str,
+    content_type: str,
+    media_duration: float = None,
+) -> dict:
+    """Start transcribing an uploaded S3 object and record it in Firestore."""
+    unique_filename = s3_path.split("/", 2)[2]
+    file_url = (await presigned_url(s3_path))["url"]
+
+    # Start transcription job
+    job_name = f"transcribe_{uuid.uuid4()}"
+    transcription_job_name = await start_transcription_job(s3_path, job_name)
+
+    # Save metadata to Firestore
+    doc_ref = (
+        db.collection("uploads")
+        .document(user_id)
+        .collection(f"{media_type}_files")
+        .document()
+    )
+    doc_id = doc_ref.id
+    upload_locator.remember(user_id, doc_id, f"{media_type}_files")
+    doc_ref.set(
+        {
             "id": doc_id,
             "filename": unique_filename,
+            "original_filename": original_filename,
             "file_url": file_url,
+            "s3_key": s3_path,
+            "user_id": user_id,
+            "content_type": content_type,
+            "media_duration": media_duration,
+            "upload_timestamp": firestore.SERVER_TIMESTAMP,
             "transcription_job_name": transcription_job_name,
+            "transcription_status": "IN_PROGRESS",
+            "job_registered": True,
         }
+    )
+    await job_tracker.register(
+        transcription_job_name, doc_ref, user_id, media_duration
+    )
 
+    return {
+        "id": doc_id,
+        "filename": unique_filename,
+        "file_url": file_url,
+        "transcription_job_name": transcription_job_name,
+    }
+
+
+def parse_upload_key(user_id: str, key: str) -> str:
+    """Check that an S3 key belongs to the user and return its media type."""
+    parts = key.split("/", 2)
+    if len(parts) != 3 or parts[0] != user_id or parts[1] not in ("audio", "video"):
+        raise HTTPException(status_code=403, detail="Not authorized to access this upload")
+    return parts[1]
+
+
+@app.post("/uploads/multipart/initiate")
+async def initiate_multipart_upload(request: MultipartUploadRequest):
+    """Hand out presigned part URLs so the client can upload straight to S3"""
+    if not is_media_content_type(request.content_type):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Only audio and video files are allowed.",
+        )
+
+    # Reject uploads that are declared over the limit before any bytes move;
+    # the stored size is checked again on completion
+    is_pro = await subscription.is_pro_user(request.user_id)
+    file_size_limit, _ = get_tier_limits(is_pro)
+    if request.file_size > file_size_limit:
+        raise_file_size_exceeded(file_size_limit, is_pro)
+
+    media_type = "audio" if request.content_type.startswith("audio/") else "video"
+    filename = os.path.basename(request.filename)
+    s3_path = f"{request.user_id}/{media_type}/{uuid.uuid4()}_{filename}"
+    part_size = max(S3_PART_SIZE, -(-request.file_size // MAX_UPLOAD_PARTS))
+    part_count = max(1, -(-request.file_size // part_size))
+
+    try:
+        upload_id = await create_multipart_upload(s3_path, request.content_type)
+        part_urls = await generate_presigned_part_urls(
+            s3_path, upload_id, part_count, PRESIGNED_PART_URL_EXPIRATION
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    return {
+        "key": s3_path,
+        "upload_id": upload_id,
+        "part_size": part_size,
+        "parts": part_urls,
+        "expires_in": PRESIGNED_PART_URL_EXPIRATION,
+    }
+
+
+@app.post("/uploads/multipart/complete")
+async def finish_multipart_upload(request: CompleteMultipartUploadRequest):
+    """Finalize a direct upload, validate the stored object and start transcription"""
+    media_type = parse_upload_key(request.user_id, request.key)
+
+    try:
+        await complete_multipart_upload(
+            request.key,
+            request.upload_id,
+            [(part.part_number, part.etag) for part in request.parts],
+        )
+        file_size = await get_object_size(request.key)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    is_pro = await subscription.is_pro_user(request.user_id)
+    file_size_limit, duration_limit = get_tier_limits(is_pro)
+
+    try:
+        if file_size > file_size_limit:
+            raise_file_size_exceeded(file_size_limit, is_pro)
+
+        # Only the container headers are fetched, via ranged reads
+        try:
+            duration = await probe_s3_object_duration(request.key, file_size)
+        except Exception as e:
+            print(f"Error reading duration: {str(e)}")
+            duration = None
+
+        if duration is None:
+            raise HTTPException(status_code=400, detail="File duration is required.")
+        if duration > duration_limit:
+            raise_duration_exceeded(duration_limit, is_pro)
+    except HTTPException:
+        # Don't keep objects that failed validation
+        try:
+            await delete_file_from_s3(request.key)
+        except ValueError as e:
+            print(f"Error deleting rejected upload: {str(e)}")
+        raise
+
+    try:
+        return await start_transcription_and_save(
+            request.user_id,
+            media_type,
+            request.key,
+            request.filename,
+            request.content_type,
+            duration,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+@app.post("/uploads/multipart/abort")
+async def cancel_multipart_upload(request: AbortMultipartUploadRequest):
+    """Abort a direct upload and discard any parts already sent"""
+    parse_upload_key(request.user_id, request.key)
+
+    try:
+        await abort_multipart_upload(request.key, request.upload_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    return {"key": request.key, "message": "Upload aborted"}
+
+
+@app.get("/upload-progress/{user_id}")
+async def get_upload_progress(user_id: str):
+    """Get progress and throughput of the user's S3 uploads running on this worker"""
+    return {"user_id": user_id, "uploads": list_upload_progress(f"{user_id}/")}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Get the in-process metrics recorded by this worker"""
+    return {
+        **metrics.snapshot(),
+        "transcript_store": transcript_store.stats(),
+        "subscription_cache": subscription.subscription_cache_stats(),
+        "answer_cache": answer_cache.cache.stats(),
+        "ai_gateway": ai_gateway.stats(),
+    }
+
+
+@app.get("/migrations/subscriptions/status")
+async def get_subscription_migration_status():
+    """Get the background subscription migration's progress"""
+    try:
+        return await migration_supervisor.status()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
@@ -252,22 +511,9 @@ async def upload_media(user_id: str, file: UploadFile = File(...)):
 @app.get("/transcription-status/{user_id}/{doc_id}")
 async def get_transcription_status(user_id: str, doc_id: str):
     try:
-        # Get the document from Firestore
-        media_types = ["audio_files", "video_files"]
-        doc = None
-
-        for media_type in media_types:
-            doc_ref = (
-                db.collection("uploads")
-                .document(user_id)
-                .collection(media_type)
-                .document(doc_id)
-            )
-            doc = doc_ref.get()
-            if doc.exists:
-                break
-
-        if not doc or not doc.exists:
+        # Get the document from Firestore in a single round trip
+        doc = find_upload_doc(user_id, doc_id)
+        if doc is None:
             raise HTTPException(status_code=404, detail="Document not found")
 
         doc_data = doc.to_dict()
@@ -276,24 +522,16 @@ async def get_transcription_status(user_id: str, doc_id: str):
         if not job_name:
             raise HTTPException(status_code=404, detail="No transcription job found")
 
-        # Get status from AWS Transcribe
-        status = get_transcription_job_status(job_name)
-
-        # Update status in Firestore if completed
-        if status["status"] == "COMPLETED":
-            doc.reference.update(
-                {
-                    "transcription_status": "COMPLETED",
-                    "transcript_uri": status["transcript_uri"],
-                }
-            )
-        elif status["status"] == "FAILED":
-            doc.reference.update(
-                {
-                    "transcription_status": "FAILED",
-                    "failure_reason": status.get("failure_reason", "Unknown error"),
-                }
+        # The job tracker writes the final status to the document, so answer
+        # from Firestore; uploads from before the tracker are handed to it once
+        status = stored_status(doc_data)
+        if status["status"] not in ("COMPLETED", "FAILED") and not doc_data.get(
+            "job_registered"
+        ):
+            await job_tracker.register(
+                job_name, doc.reference, user_id, doc_data.get("media_duration")
             )
+            doc.reference.update({"job_registered": True})
 
         return status
 
@@ -301,25 +539,63 @@ async def get_transcription_status(user_id: str, doc_id: str):
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
-@app.get("/transcription/{user_id}/{doc_id}")
-async def get_transcription(user_id: str, doc_id: str):
+@app.post("/events/transcription-job")
+async def transcription_job_event(
+    event: dict, x_scribe_event_token: str = Header(None)
+):
+    """Record a finished transcription job from an AWS Transcribe state-change
+    event, delivered by an EventBridge API destination or an SNS subscription"""
+    if not TRANSCRIPTION_EVENT_TOKEN or x_scribe_event_token != TRANSCRIPTION_EVENT_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid event token")
+
+    # SNS wraps the EventBridge event in a notification envelope
+    if event.get("Type") == "Notification":
+        event = json.loads(event["Message"])
+
+    detail = event.get("detail", {})
+    job_name = detail.get("TranscriptionJobName")
+    job_status = detail.get("TranscriptionJobStatus")
+    if not job_name or job_status not in ("COMPLETED", "FAILED"):
+        return {"recorded": False}
+
     try:
-        # Get the document from Firestore
-        media_types = ["audio_files", "video_files"]
-        doc = None
-
-        for media_type in media_types:
-            doc_ref = (
-                db.collection("uploads")
-                .document(user_id)
-                .collection(media_type)
-                .document(doc_id)
-            )
-            doc = doc_ref.get()
-            if doc.exists:
-                break
+        if job_status == "COMPLETED":
+            # The event doesn't carry the transcript location
+            status = await get_transcription_job_status(job_name)
+        else:
+            status = {
+                "status": "FAILED",
+                "job_name": job_name,
+                "failure_reason": detail.get("FailureReason", "Unknown error"),
+            }
+        await job_tracker.record_result(job_name, status)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    return {"recorded": True, "job_name": job_name, "status": status["status"]}
+
+
+@app.get("/transcription/{user_id}/{doc_id}")
+async def get_transcription(
+    request: Request,
+    user_id: str,
+    doc_id: str,
+    start_s: float = None,
+    end_s: float = None,
+    cursor: int = Query(None, ge=0),
+    page_size: int = Query(None, ge=1, le=MAX_TRANSCRIPT_PAGE_SIZE),
+):
+    if any(bound is not None and bound < 0 for bound in (start_s, end_s)):
+        raise HTTPException(
+            status_code=400, detail="start_s and end_s must not be negative"
+        )
+    if start_s is not None and end_s is not None and start_s > end_s:
+        raise HTTPException(status_code=400, detail="start_s must not be after end_s")
 
-        if not doc or not doc.exists:
+    try:
+        # Get the document from Firestore in a single round trip
+        doc = find_upload_doc(user_id, doc_id)
+        if doc is None:
             raise HTTPException(status_code=404, detail="Document not found")
 
         doc_data = doc.to_dict()
@@ -331,67 +607,178 @@ async def get_transcription(user_id: str, doc_id: str):
                 detail="Transcription not available. Check status first.",
             )
 
-        # Get transcription result
-        transcription = get_transcription_result(transcript_uri)
-        return transcription
+        # Transcripts never change once stored, so the content hash is a
+        # strong validator and repeat loads can be answered with a 304
+        digest = doc_data.get("transcript_hash")
+        paged = any(value is not None for value in (start_s, end_s, cursor, page_size))
+        page_size = page_size or DEFAULT_TRANSCRIPT_PAGE_SIZE
+        page_params = ("page", start_s, end_s, cursor, page_size)
+        if digest:
+            tag = etag_for(digest, *page_params) if paged else digest
+            not_modified = not_modified_response(request, tag)
+            if not_modified:
+                return not_modified
+
+        # A time window or page is answered from the compact copy, whose time
+        # index finds it by binary search and decodes only the words returned
+        if paged:
+            transcript = await load_compact_transcript(doc.reference, doc_data)
+            page = transcript.page(start_s, end_s, cursor, page_size)
+            body = {
+                "start_s": start_s,
+                "end_s": end_s,
+                "duration_s": transcript.duration_seconds,
+                "total_words": len(transcript),
+                "speaker_labels": transcript.speaker_labels,
+                **page,
+            }
+            headers = {}
+            if digest:
+                headers = cache_headers(etag_for(digest, *page_params))
+            return JSONResponse(body, headers=headers)
+
+        # The stored JSON is sent as-is, or its pre-compressed variant when
+        # the client accepts one
+        coding = negotiate_encoding(request.headers.get("accept-encoding"))
+        digest, transcription = await load_transcript(
+            doc.reference, doc_data, coding
+        )
+        return Response(
+            content=transcription,
+            media_type="application/json",
+            headers=cache_headers(digest, coding),
+        )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
 
+@app.get("/uploads/{user_id}")
+async def get_uploads(
+    user_id: str,
+    media_type: str = Query(None, pattern="^(audio|video)$"),
+    order: str = Query("newest", pattern="^(newest|oldest)$"),
+    page_size: int = Query(DEFAULT_UPLOAD_PAGE_SIZE, ge=1, le=MAX_UPLOAD_PAGE_SIZE),
+    cursor: str = None,
+):
+    """List a user's uploads, newest first, with fresh presigned URLs.
+
+    Audio and video are merged into one list ordered by upload time unless
+    media_type picks one; pass next_cursor back to get the following page.
+    """
+    collections = [f"{media_type}_files"] if media_type else MEDIA_COLLECTIONS
+
+    try:
+        docs, next_cursor = await list_uploads(
+            user_id, collections, page_size, cursor, descending=order == "newest"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    try:
+        uploads = []
+        for doc in docs:
+            upload = doc.to_dict()
+            upload["id"] = doc.id
+            upload["media_type"] = doc.reference.parent.id.split("_")[0]
+            upload["s3_key"] = upload_s3_key(upload)
+            uploads.append(upload)
+
+        # Every URL on the page is signed in one trip, mostly from the cache
+        urls = await presigned_urls([upload["s3_key"] for upload in uploads])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+    for upload in uploads:
+        upload["file_url"] = urls[upload["s3_key"]]["url"]
+        upload["url_expires_at"] = urls[upload["s3_key"]]["expires_at"]
+
+    return {"uploads": uploads, "next_cursor": next_cursor}
+
+
 @app.post("/update-media-url")
 async def update_media_url(body: dict):
+    """Get a fresh presigned URL for an upload.
+
+    The upload is identified by its S3 key, its document ID or, for older
+    clients, the expired URL itself; none of these needs a Firestore query.
+    """
     user_id = body.get("user_id")
+    s3_key = body.get("s3_key")
+    doc_id = body.get("doc_id")
     file_url = body.get("file_url")
 
-    expires = file_url.split("Expires=")[-1]
-
-    # if not expired, return the same URL
-    if int(expires) > int(time.time()):
-        return {"new_file_url": file_url}
-
-    if not user_id or not file_url:
+    if not user_id or not (s3_key or doc_id or file_url):
         raise HTTPException(
-            status_code=422, detail="user_id or file_url cannot be empty"
+            status_code=422,
+            detail="user_id and one of s3_key, doc_id or file_url are required",
         )
 
+    if not s3_key and doc_id:
+        doc = find_upload_doc(user_id, doc_id)
+        if doc is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        s3_key = upload_s3_key(doc.to_dict())
+    elif not s3_key:
+        s3_key = s3_key_from_url(file_url)
+    parse_upload_key(user_id, s3_key)
+
     try:
-        # Determine media type based on file_url
-        if "audio" in file_url:
-            media_type = "audio"
-        elif "video" in file_url:
-            media_type = "video"
-        else:
-            raise HTTPException(status_code=400, detail="Invalid media type in URL")
+        # Cached URLs are reused until shortly before they expire
+        entry = await presigned_url(s3_key)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
-        # Search for the document in Firestore by file_url
-        collection_ref = (
-            db.collection("uploads").document(user_id).collection(f"{media_type}_files")
-        )
-        query = collection_ref.where("file_url", "==", file_url).limit(1)
-        docs = query.stream()
+    return {
+        "id": doc_id,
+        "s3_key": s3_key,
+        "new_file_url": entry["url"],
+        "expires_at": entry["expires_at"],
+    }
 
-        doc = next(docs, None)
-        if not doc:
-            raise HTTPException(status_code=404, detail="File not found")
-        # check if its still valid by checking the file_url Expires query param
-        # Get the S3 path from the document
-        file_data = doc.to_dict()
-        s3_path = file_data.get("file_url").split("amazonaws.com/")[-1]
-        # remove stuff after ? in the URL
-        s3_path = s3_path.split("?")[0]
 
-        # Generate a new presigned URL
-        new_file_url = generate_presigned_url(s3_path)
+@app.post("/media-urls")
+async def refresh_media_urls(request: MediaUrlsRequest):
+    """Get presigned URLs for many uploads at once, by S3 key or document ID"""
+    if len(request.s3_keys) + len(request.doc_ids) > MAX_MEDIA_URL_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_MEDIA_URL_BATCH} URLs can be refreshed at once",
+        )
 
-        # Update the Firestore document with the new URL
-        doc.reference.update({"file_url": new_file_url})
+    for s3_key in request.s3_keys:
+        parse_upload_key(request.user_id, s3_key)
 
-        return {"id": doc.id, "new_file_url": new_file_url}
+    try:
+        # Documents are only read for the IDs given, all in one batch
+        doc_keys = {}
+        if request.doc_ids:
+            docs = upload_locator.find_many(
+                request.user_id, request.doc_ids, field_paths=["s3_key", "file_url"]
+            )
+            doc_keys = {
+                doc_id: upload_s3_key(doc.to_dict()) for doc_id, doc in docs.items()
+            }
+        for s3_key in doc_keys.values():
+            parse_upload_key(request.user_id, s3_key)
 
+        urls = await presigned_urls(list(request.s3_keys) + list(doc_keys.values()))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+    return {
+        "urls": {s3_key: urls[s3_key] for s3_key in request.s3_keys},
+        "docs": {
+            doc_id: {"s3_key": s3_key, **urls[s3_key]}
+            for doc_id, s3_key in doc_keys.items()
+        },
+        "missing": [doc_id for doc_id in request.doc_ids if doc_id not in doc_keys],
+    }
+
 
 # Add a new endpoint to manage user subscriptions
 @app.post("/subscriptions/{user_id}")
@@ -0,0 +1,314 @@
+import json
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+from mutagen import File as MutagenFile, MutagenError
+
+try:
+    import imageio_ffmpeg
+except ImportError:  # Only needed where ffprobe isn't installed
+    imageio_ffmpeg = None
+
+# Upper bound on how many bytes a single header read may pull into memory
+MAX_HEADER_READ = 16 * 1024 * 1024  # 16 MB in bytes
+
+FFPROBE_TIMEOUT_SECONDS = 30
+# How ffmpeg -i reports a container's duration, e.g. "Duration: 00:05:00.08"
+FFMPEG_DURATION = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+# Matroska/WebM element IDs (see the EBML and Matroska specifications)
+EBML_HEADER_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+INFO_ID = 0x1549A966
+TIMECODE_SCALE_ID = 0x2AD7B1
+DURATION_ID = 0x4489
+CLUSTER_ID = 0x1F43B675
+
+MP4_TOP_LEVEL_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"}
+
+
+def probe_duration(source, filename: str = "", url: str = None) -> float:
+    """
+    Get the duration in seconds of an audio or video file from its headers.
+
+    MP4/MOV, WebM/MKV and WAV headers are parsed directly, MP3, OGG and FLAC go
+    through mutagen, and ffprobe is only run for containers none of those
+    recognise.
+
+    Args:
+        source: Path to the file, or a seekable binary file object
+        filename (str, optional): Original filename, used for the ffprobe suffix
+        url (str, optional): Where ffprobe can read the file itself, such as a
+            presigned GET URL; without one, file objects are copied to disk
+
+    Returns:
+        float: Duration in seconds
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return _probe_file(f, filename or os.fspath(source), url)
+
+    source.seek(0)
+    try:
+        return _probe_file(source, filename, url)
+    finally:
+        source.seek(0)
+
+
+def _probe_file(f, filename: str, url: str = None) -> float:
+    head = f.read(12)
+    f.seek(0)
+
+    try:
+        if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+            return _probe_wav(f)
+        if head[:4] == struct.pack(">I", EBML_HEADER_ID):
+            return _probe_matroska(f)
+        if head[4:8] in MP4_TOP_LEVEL_BOXES:
+            return _probe_mp4(f)
+        if head[:3] == b"ID3" or head[:4] in (b"OggS", b"fLaC") or _is_mpeg_frame(head):
+            return _probe_mutagen(f)
+    except (ValueError, struct.error, MutagenError) as e:
+        print(f"Header probe failed, falling back to ffprobe: {str(e)}")
+    else:
+        try:
+            return _probe_mutagen(f)
+        except (ValueError, MutagenError):
+            pass
+
+    f.seek(0)
+    return _probe_ffprobe(f, filename, url)
+
+
+def _read_exact(f, size: int) -> bytes:
+    if size > MAX_HEADER_READ:
+        raise ValueError(f"Header of {size} bytes exceeds probe read limit")
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Unexpected end of file while reading headers")
+    return data
+
+
+def _is_mpeg_frame(head: bytes) -> bool:
+    return len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0
+
+
+def _probe_mutagen(f) -> float:
+    """Read the duration of any format mutagen understands."""
+    f.seek(0)
+    audio = MutagenFile(f)
+    if audio is None or not audio.info.length:
+        raise ValueError("Could not determine audio file duration")
+    return audio.info.length
+
+
+def _iter_mp4_boxes(f, end: int):
+    """Yield (type, payload_start, payload_end) for the boxes up to end."""
+    position = f.tell()
+    while position + 8 <= end:
+        f.seek(position)
+        size, box_type = struct.unpack(">I4s", _read_exact(f, 8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", _read_exact(f, 8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            raise ValueError(f"Invalid MP4 box size for {box_type!r}")
+
+        yield box_type, position + header_size, position + size
+        position += size
+
+
+def _probe_mp4(f) -> float:
+    """
+    Read the duration from the movie header (moov/mvhd) of an MP4 or MOV.
+
+    Fragmented files leave the mvhd duration at 0; their total duration is
+    in the movie extends header (mvex/mehd) when the muxer wrote one.
+    """
+    f.seek(0, os.SEEK_END)
+    file_end = f.tell()
+    f.seek(0)
+
+    for box_type, start, end in _iter_mp4_boxes(f, file_end):
+        if box_type != b"moov":
+            continue
+        f.seek(start)
+        timescale = duration = fragment_duration = None
+        for child_type, child_start, child_end in _iter_mp4_boxes(f, end):
+            if child_type == b"mvhd":
+                f.seek(child_start)
+                version = _read_exact(f, 4)[0]
+                if version == 1:
+                    _, _, timescale, duration = struct.unpack(
+                        ">QQIQ", _read_exact(f, 28)
+                    )
+                else:
+                    _, _, timescale, duration = struct.unpack(
+                        ">IIII", _read_exact(f, 16)
+                    )
+            elif child_type == b"mvex":
+                f.seek(child_start)
+                for grandchild_type, grandchild_start, _ in _iter_mp4_boxes(
+                    f, child_end
+                ):
+                    if grandchild_type == b"mehd":
+                        f.seek(grandchild_start)
+                        version = _read_exact(f, 4)[0]
+                        fragment_duration = struct.unpack(
+                            ">Q" if version == 1 else ">I",
+                            _read_exact(f, 8 if version == 1 else 4),
+                        )[0]
+
+        if timescale is None:
+            break
+        if not timescale:
+            raise ValueError("MP4 movie header has no timescale")
+        duration = duration or fragment_duration
+        if not duration:
+            # A zero duration would pass any length limit
+            raise ValueError("MP4 movie header has no duration")
+        return duration / timescale
+
+    raise ValueError("MP4 file has no movie header")
+
+
+def _read_vint(f, keep_marker: bool) -> tuple:
+    """Read an EBML variable-length integer, returning (value, length)."""
+    first = _read_exact(f, 1)[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise ValueError("Invalid EBML variable-length integer")
+
+    value = first if keep_marker else first & (mask - 1)
+    for byte in _read_exact(f, length - 1):
+        value = (value << 8) | byte
+
+    # A size with every value bit set means "unknown size"
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = None
+    return value, length
+
+
+def _probe_matroska(f) -> float:
+    """Read the duration from the Segment Info element of a WebM or MKV."""
+    f.seek(0, os.SEEK_END)
+    file_end = f.tell()
+    f.seek(0)
+
+    def children(end):
+        while f.tell() < end:
+            element_id, _ = _read_vint(f, keep_marker=True)
+            size, _ = _read_vint(f, keep_marker=False)
+            start = f.tell()
+            yield element_id, start, (end if size is None else start + size)
+
+    for element_id, start, end in children(file_end):
+        if element_id != SEGMENT_ID:
+            f.seek(end)
+            continue
+
+        for child_id, child_start, child_end in children(end):
+            if child_id == CLUSTER_ID:
+                break
+            if child_id != INFO_ID:
+                f.seek(child_end)
+                continue
+
+            timecode_scale = 1_000_000
+            duration = None
+            for info_id, info_start, info_end in children(child_end):
+                data = _read_exact(f, info_end - info_start)
+                if info_id == TIMECODE_SCALE_ID:
+                    timecode_scale = int.from_bytes(data, "big")
+                elif info_id == DURATION_ID:
+                    duration = struct.unpack(">f" if len(data) == 4 else ">d", data)[0]
+
+            if duration is None:
+                raise ValueError("Matroska segment info has no duration")
+            return duration * timecode_scale / 1_000_000_000
+        break
+
+    raise ValueError("Matroska file has no segment info")
+
+
+def _probe_wav(f) -> float:
+    """Read the duration from the fmt and data chunks of a WAV file."""
+    f.seek(0, os.SEEK_END)
+    file_end = f.tell()
+    f.seek(12)
+
+    byte_rate = None
+    while f.tell() + 8 <= file_end:
+        chunk_id, size = struct.unpack("<4sI", _read_exact(f, 8))
+        start = f.tell()
+        if chunk_id == b"fmt ":
+            _, _, _, byte_rate = struct.unpack("<HHII", _read_exact(f, 12))
+        elif chunk_id == b"data":
+            if not byte_rate:
+                raise ValueError("WAV data chunk appears before fmt chunk")
+            # Streamed WAVs leave the data size unset, so trust the file size
+            data_size = min(size, file_end - start)
+            return data_size / byte_rate
+        f.seek(start + size + (size & 1))
+
+    raise ValueError("WAV file has no data chunk")
+
+
+def _ffmpeg_duration(source: str) -> float:
+    """Run ffprobe, or the bundled ffmpeg without it, on a path or URL."""
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is not None:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-show_entries", "format=duration", "-of", "json"]
+            + [source],
+            capture_output=True,
+            timeout=FFPROBE_TIMEOUT_SECONDS,
+        )
+        try:
+            return float(json.loads(result.stdout)["format"]["duration"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Could not determine media duration")
+
+    # imageio-ffmpeg ships an ffmpeg binary but no ffprobe; ffmpeg -i prints
+    # the container duration before complaining that no output was given
+    try:
+        ffmpeg = imageio_ffmpeg.get_ffmpeg_exe() if imageio_ffmpeg else None
+    except RuntimeError:
+        ffmpeg = None
+    if ffmpeg is None:
+        raise ValueError("Could not determine media duration")
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-i", source],
+        capture_output=True,
+        timeout=FFPROBE_TIMEOUT_SECONDS,
+    )
+    match = FFMPEG_DURATION.search(result.stderr.decode("utf-8", "replace"))
+    if match is None:
+        raise ValueError("Could not determine media duration")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _probe_ffprobe(f, filename: str, url: str = None) -> float:
+    """Fall back to ffprobe for containers the header parsers don't know."""
+    # Files already on disk, or reachable by URL, are probed in place, and
+    # ffprobe reads only as much as it needs; other uploads are spooled first
+    path = getattr(f, "name", None)
+    if url is not None:
+        return _ffmpeg_duration(url)
+    if isinstance(path, str) and os.path.isfile(path):
+        return _ffmpeg_duration(path)
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1]) as temp_file:
+        shutil.copyfileobj(f, temp_file)
+        temp_file.flush()
+        return _ffmpeg_duration(temp_file.name)
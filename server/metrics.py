@@ -0,0 +1,62 @@
+import threading
+
+# In-process counters, gauges and timing summaries, exposed on /metrics.
+# Each worker process keeps its own numbers.
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_observations = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Add value to a monotonically increasing counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Record the current value of something that goes up and down."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Record one observation (a latency, a size, a rate) in a summary."""
+    with _lock:
+        summary = _observations.get(name)
+        if summary is None:
+            _observations[name] = {
+                "count": 1,
+                "sum": value,
+                "min": value,
+                "max": value,
+                "last": value,
+            }
+            return
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["min"] = min(summary["min"], value)
+        summary["max"] = max(summary["max"], value)
+        summary["last"] = value
+
+
+def snapshot() -> dict:
+    """Return a copy of every metric recorded in this process."""
+    with _lock:
+        observations = {
+            name: {**summary, "avg": summary["sum"] / summary["count"]}
+            for name, summary in _observations.items()
+        }
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "observations": observations,
+        }
+
+
+def reset() -> None:
+    """Clear every metric (used by tests and benchmarks)."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _observations.clear()
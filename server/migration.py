@@ -1,60 +1,443 @@
 from firebase import db
 from firebase_admin import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 from models import SubscriptionTier
 import asyncio
+import os
+import threading
+import time
+import metrics
+from lease import Lease
 
+load_dotenv()
 
-async def migrate_user_subscriptions():
+# User IDs read per page; each page is checked and written, then checkpointed
+MIGRATION_PAGE_SIZE = int(os.getenv("MIGRATION_PAGE_SIZE", "1000"))
+# Parallel get_all calls used to check which users already have a record
+MIGRATION_CONCURRENCY = int(os.getenv("MIGRATION_CONCURRENCY", "4"))
+# Upper bound on subscription records created per second
+MIGRATION_MAX_OPS_PER_SECOND = int(os.getenv("MIGRATION_MAX_OPS_PER_SECOND", "500"))
+# Documents per get_all call
+GET_ALL_BATCH_SIZE = 100
+# Write attempts per record before it's counted as failed
+MAX_WRITE_ATTEMPTS = 5
+# Seconds between progress lines
+PROGRESS_REPORT_INTERVAL = 10
+
+# Where the migration records how far it got, so an interrupted run resumes
+CHECKPOINT_COLLECTION = "migrations"
+CHECKPOINT_DOCUMENT = "user_subscriptions"
+# Lease held by the one replica running the migration in the background
+LEASE_DOCUMENT = "user_subscriptions_lease"
+# How long a lease lasts without renewal; the holder renews it three times per period
+MIGRATION_LEASE_SECONDS = float(os.getenv("MIGRATION_LEASE_SECONDS", "60"))
+# Attempts at a failing background migration before giving up until restart
+MIGRATION_MAX_ATTEMPTS = int(os.getenv("MIGRATION_MAX_ATTEMPTS", "5"))
+
+# Collections whose document IDs are user IDs, in the order they're migrated
+USER_ID_SOURCES = ["users", "uploads"]
+
+# gRPC status code for a create on a document that already exists
+ALREADY_EXISTS = 6
+
+
+class MigrationProgress:
+    """Counters for a migration run, safe to update from BulkWriter threads."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.updated_at = self.started_at
+        self.finished_at = None
+        self.status = "running"
+        self.source = None
+        self.last_id = None
+        self.completed_sources = []
+        self.pages = 0
+        self.scanned = 0
+        self.existing = 0
+        self.created = 0
+        self.failed = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+            self.updated_at = time.time()
+
+    def restore(self, checkpoint: dict):
+        """Continue the counters and position of an interrupted run."""
+        for name in ["pages", "scanned", "existing", "created", "failed"]:
+            setattr(self, name, checkpoint.get(name, 0))
+        self.source = checkpoint.get("source")
+        self.last_id = checkpoint.get("last_id")
+        self.completed_sources = list(checkpoint.get("completed_sources", []))
+
+    def users_per_second(self) -> float:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.scanned / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "status": self.status,
+                "source": self.source,
+                "last_id": self.last_id,
+                "completed_sources": list(self.completed_sources),
+                "pages": self.pages,
+                "scanned": self.scanned,
+                "existing": self.existing,
+                "created": self.created,
+                "failed": self.failed,
+                "users_per_second": round(self.users_per_second(), 1),
+                "started_at": self.started_at,
+                "updated_at": self.updated_at,
+                "finished_at": self.finished_at,
+                "error": self.error,
+            }
+
+    def report(self):
+        print(
+            f"Migration {self.status}: {self.scanned} users scanned, "
+            f"{self.created} created, {self.existing} existing, {self.failed} failed "
+            f"({self.users_per_second():.0f} users/s, at {self.source}/{self.last_id})"
+        )
+
+
+class SubscriptionMigration:
+    """
+    Give every existing user a FREE subscription record.
+
+    User IDs are read a page at a time from each source collection, checked
+    for an existing record with batched get_all calls and created with a
+    BulkWriter. After each page the position is saved to a checkpoint
+    document, so an interrupted run resumes from the last finished page.
+    Records are created, never overwritten, so a record written meanwhile
+    (for example lazily by get_user_subscription) is left alone.
+    """
+
+    def __init__(
+        self,
+        page_size: int = MIGRATION_PAGE_SIZE,
+        concurrency: int = MIGRATION_CONCURRENCY,
+        max_ops_per_second: int = MIGRATION_MAX_OPS_PER_SECOND,
+        resume: bool = True,
+    ):
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.max_ops_per_second = max_ops_per_second
+        self.resume = resume
+        self.progress = MigrationProgress()
+        self.checkpoint_ref = db.collection(CHECKPOINT_COLLECTION).document(
+            CHECKPOINT_DOCUMENT
+        )
+        self.subscriptions_ref = db.collection("subscriptions")
+        # Set to stop after the current page; the run can be resumed later
+        self.stopped = threading.Event()
+        self._last_report = 0
+
+    def user_id_pages(self, source: str, start_after: str = None):
+        """Yield lists of user IDs from a source collection, in ID order."""
+        if source == "uploads":
+            # Upload parents are never written themselves, only their media
+            # subcollections, so queries don't return them; list references
+            # instead and skip past the checkpoint
+            page = []
+            for doc_ref in db.collection(source).list_documents(page_size=self.page_size):
+                if start_after is not None and doc_ref.id <= start_after:
+                    continue
+                page.append(doc_ref.id)
+                if len(page) == self.page_size:
+                    yield page
+                    page = []
+            if page:
+                yield page
+            return
+
+        query = (
+            db.collection(source)
+            .order_by("__name__")
+            .select([])
+            .limit(self.page_size)
+        )
+        while True:
+            page_query = (
+                query.start_after({"__name__": start_after}) if start_after else query
+            )
+            page = [doc.id for doc in page_query.stream()]
+            if not page:
+                return
+            yield page
+            if len(page) < self.page_size:
+                return
+            start_after = page[-1]
+
+    def existing_ids(self, user_ids: list, executor) -> set:
+        """Check which users already have a subscription, in parallel batches."""
+
+        def check(batch):
+            refs = [self.subscriptions_ref.document(user_id) for user_id in batch]
+            # An empty field mask: only existence is needed
+            return [
+                snapshot.id
+                for snapshot in db.get_all(refs, field_paths=[])
+                if snapshot.exists
+            ]
+
+        batches = [
+            user_ids[i : i + GET_ALL_BATCH_SIZE]
+            for i in range(0, len(user_ids), GET_ALL_BATCH_SIZE)
+        ]
+        return {user_id for found in executor.map(check, batches) for user_id in found}
+
+    def _on_write_result(self, reference, result, writer):
+        self.progress.add(created=1)
+
+    def _on_write_error(self, failure, writer) -> bool:
+        """Return whether BulkWriter should retry the failed write."""
+        if failure.code == ALREADY_EXISTS:
+            self.progress.add(existing=1)
+            return False
+        if failure.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        print(f"Error creating subscription: {failure.message}")
+        self.progress.add(failed=1)
+        return False
+
+    def process_page(self, user_ids: list, writer, executor):
+        existing = self.existing_ids(user_ids, executor)
+        for user_id in user_ids:
+            if user_id in existing:
+                continue
+            writer.create(
+                self.subscriptions_ref.document(user_id),
+                {
+                    "user_id": user_id,
+                    "tier": SubscriptionTier.FREE.value,
+                    "is_active": True,
+                    "created_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+        # Wait for this page's writes so the checkpoint never runs ahead
+        writer.flush()
+        self.progress.add(pages=1, scanned=len(user_ids), existing=len(existing))
+
+    def save_checkpoint(self):
+        self.checkpoint_ref.set(
+            {**self.progress.as_dict(), "checkpointed_at": firestore.SERVER_TIMESTAMP}
+        )
+
+    def load_checkpoint(self):
+        """Resume from the checkpoint of an interrupted run, if there is one."""
+        if not self.resume:
+            return
+        checkpoint = self.checkpoint_ref.get()
+        if checkpoint.exists and checkpoint.to_dict().get("status") != "completed":
+            self.progress.restore(checkpoint.to_dict())
+            print(
+                f"Resuming subscription migration after "
+                f"{self.progress.source}/{self.progress.last_id}"
+            )
+
+    def _maybe_report(self):
+        now = time.monotonic()
+        if now - self._last_report >= PROGRESS_REPORT_INTERVAL:
+            self._last_report = now
+            self.progress.report()
+        metrics.set_gauge("migration.users_scanned", self.progress.scanned)
+        metrics.set_gauge("migration.users_per_second", self.progress.users_per_second())
+
+    def run(self) -> MigrationProgress:
+        """Run the migration to completion. Blocking."""
+        print("Starting user subscription migration...")
+        self.load_checkpoint()
+
+        writer = db.bulk_writer(
+            BulkWriterOptions(
+                initial_ops_per_second=min(500, self.max_ops_per_second),
+                max_ops_per_second=self.max_ops_per_second,
+            )
+        )
+        writer.on_write_result(self._on_write_result)
+        writer.on_write_error(self._on_write_error)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for source in USER_ID_SOURCES:
+                    if source in self.progress.completed_sources:
+                        continue
+                    start_after = (
+                        self.progress.last_id if self.progress.source == source else None
+                    )
+                    self.progress.source = source
+                    for page in self.user_id_pages(source, start_after):
+                        if self.stopped.is_set():
+                            break
+                        self.process_page(page, writer, executor)
+                        self.progress.last_id = page[-1]
+                        self.save_checkpoint()
+                        self._maybe_report()
+                    if self.stopped.is_set():
+                        break
+                    self.progress.completed_sources.append(source)
+                    self.progress.last_id = None
+        except Exception as e:
+            self.progress.status = "failed"
+            self.progress.error = str(e)
+            raise
+        finally:
+            writer.close()
+            self.progress.finished_at = time.time()
+            if self.progress.status == "running":
+                self.progress.status = (
+                    "stopped" if self.stopped.is_set() else "completed"
+                )
+            self.save_checkpoint()
+            self.progress.report()
+
+        return self.progress
+
+
+async def migrate_user_subscriptions(**options) -> dict:
     """
     Migrate all existing users to have a subscription tier.
     This will:
-    1. Find all users in the system
-    2. Check if they have a subscription record
-    3. Create a default FREE subscription record if they don't
+    1. Page through all user IDs in the 'users' and 'uploads' collections
+    2. Check in batches which of them have a subscription record
+    3. Create a default FREE subscription record for those that don't
     """
-    print("Starting user subscription migration...")
+    migration = SubscriptionMigration(**options)
+    progress = await asyncio.to_thread(migration.run)
+    return progress.as_dict()
 
-    # Get all user IDs from the 'users' collection
-    users_ref = db.collection("users")
-    users = users_ref.stream()
-    user_ids = [user.id for user in users]
 
-    # Also check uploads collection for user IDs we might have missed
-    uploads_ref = db.collection("uploads")
-    uploads = uploads_ref.stream()
-    upload_user_ids = [upload.id for upload in uploads]
+def migration_lease() -> Lease:
+    """The lease electing the one replica that runs the migration."""
+    return Lease(
+        db.collection(CHECKPOINT_COLLECTION).document(LEASE_DOCUMENT),
+        MIGRATION_LEASE_SECONDS,
+    )
 
-    # Combine and deduplicate user IDs
-    all_user_ids = list(set(user_ids + upload_user_ids))
 
-    print(f"Found {len(all_user_ids)} users to migrate")
+class MigrationSupervisor:
+    """
+    Run the subscription migration in the background on one replica.
+
+    The app serves requests while this runs: get_user_subscription creates a
+    missing FREE record on its own, so the migration only fills in the rest.
+    Each replica tries to take the lease; the holder runs the migration,
+    renewing the lease as it goes and retrying failed runs from their
+    checkpoint, while the others wait and take over if the lease lapses.
+    """
 
-    # Get subscription collection
-    subscriptions_ref = db.collection("subscriptions")
+    def __init__(self, lease: Lease = None, **options):
+        self.lease = lease or migration_lease()
+        self.options = options
+        self.role = "idle"
+        self.attempts = 0
+        self.migration = None
+        self._task = None
 
-    # Check each user and create subscription if needed
-    for user_id in all_user_ids:
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        if self.migration is not None:
+            self.migration.stopped.set()
+        self._task.cancel()
         try:
-            # Check if user already has a subscription
-            subscription_doc = subscriptions_ref.document(user_id).get()
-
-            if not subscription_doc.exists:
-                # Create default free subscription
-                print(f"Creating default FREE subscription for user {user_id}")
-                subscriptions_ref.document(user_id).set(
-                    {
-                        "user_id": user_id,
-                        "tier": SubscriptionTier.FREE.value,
-                        "is_active": True,
-                        "created_at": firestore.SERVER_TIMESTAMP,
-                    }
-                )
-            else:
-                print(f"User {user_id} already has a subscription tier")
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _checkpoint(self) -> dict:
+        checkpoint = await asyncio.to_thread(
+            db.collection(CHECKPOINT_COLLECTION).document(CHECKPOINT_DOCUMENT).get
+        )
+        return checkpoint.to_dict() if checkpoint.exists else {}
+
+    async def _run(self):
+        while True:
+            try:
+                # Finished by this replica or an earlier leader; users added
+                # since then get their record lazily
+                if (await self._checkpoint()).get("status") == "completed":
+                    self.role = "done"
+                    return
+                if await asyncio.to_thread(self.lease.acquire):
+                    self.role = "leader"
+                    if await self._lead():
+                        continue
+                else:
+                    self.role = "standby"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error supervising subscription migration: {str(e)}")
+            if self.attempts >= MIGRATION_MAX_ATTEMPTS:
+                print("Subscription migration failed too many times; giving up")
+                self.role = "failed"
+                return
+            await asyncio.sleep(self.lease.duration / 3)
+
+    async def _lead(self) -> bool:
+        """Run the migration while holding the lease; return whether it finished."""
+        self.attempts += 1
+        self.migration = SubscriptionMigration(**self.options)
+        run = asyncio.create_task(asyncio.to_thread(self.migration.run))
+        try:
+            while not run.done():
+                await asyncio.wait({run}, timeout=self.lease.duration / 3)
+                if run.done() or self.migration.stopped.is_set():
+                    continue
+                try:
+                    renewed = await asyncio.to_thread(self.lease.acquire)
+                except Exception as e:
+                    print(f"Error renewing the migration lease: {str(e)}")
+                    renewed = False
+                if not renewed:
+                    # Another replica may take over; finish the current page
+                    # and leave the rest to it
+                    print("Lost the migration lease; stopping after this page")
+                    self.migration.stopped.set()
+            progress = await run
+            return progress.status == "completed"
+        except asyncio.CancelledError:
+            self.migration.stopped.set()
+            raise
         except Exception as e:
-            print(f"Error processing user {user_id}: {str(e)}")
+            print(f"Subscription migration failed: {str(e)}")
+            return False
+        finally:
+            if run.done():
+                await asyncio.to_thread(self.lease.release)
+            self.role = "standby"
+
+    async def status(self) -> dict:
+        """Report this replica's role and the migration's progress.
+
+        Progress comes from the checkpoint document, so every replica reports
+        the leader's progress; the leader's own counters are used when fresher.
+        """
+        progress = await self._checkpoint()
+        if self.role == "leader" and self.migration is not None:
+            progress = self.migration.progress.as_dict()
+        return {
+            "role": self.role,
+            "holder": self.lease.holder,
+            "attempts": self.attempts,
+            "progress": progress or None,
+        }
+
 
-    print("Migration completed")
+supervisor = MigrationSupervisor()
 
 
 if __name__ == "__main__":
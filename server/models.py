@@ -1,6 +1,6 @@
 from enum import Enum
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -15,3 +15,36 @@ class Subscription(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
     is_active: bool = True
+
+
+class MultipartUploadRequest(BaseModel):
+    user_id: str
+    filename: str
+    content_type: str
+    file_size: int  # Declared size in bytes, checked again once the upload completes
+
+
+class UploadedPart(BaseModel):
+    part_number: int
+    etag: str
+
+
+class CompleteMultipartUploadRequest(BaseModel):
+    user_id: str
+    key: str
+    upload_id: str
+    filename: str  # Original filename
+    content_type: str
+    parts: List[UploadedPart]
+
+
+class AbortMultipartUploadRequest(BaseModel):
+    user_id: str
+    key: str
+    upload_id: str
+
+
+class MediaUrlsRequest(BaseModel):
+    user_id: str
+    s3_keys: List[str] = []
+    doc_ids: List[str] = []
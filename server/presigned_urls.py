@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from urllib.parse import unquote, urlparse
+from cachetools import LRUCache
+from dotenv import load_dotenv
+import aws_async
+import aws_service
+import metrics
+
+load_dotenv()
+
+# Lifetime of the presigned media URLs handed to clients
+PRESIGNED_URL_EXPIRATION = int(os.getenv("PRESIGNED_URL_EXPIRATION", "3600"))
+# A cached URL is reused until this many seconds before it expires, so clients
+# always get one with at least this much life left
+PRESIGNED_URL_REFRESH_MARGIN = int(os.getenv("PRESIGNED_URL_REFRESH_MARGIN", "300"))
+PRESIGNED_URL_CACHE_ENTRIES = int(os.getenv("PRESIGNED_URL_CACHE_ENTRIES", "50000"))
+
+
+def s3_key_from_url(file_url: str) -> str:
+    """Recover the S3 key from a presigned URL (virtual-hosted or path style)."""
+    parsed = urlparse(file_url)
+    key = unquote(parsed.path.lstrip("/"))
+    bucket = aws_service.S3_BUCKET_NAME
+    # Path-style URLs carry the bucket as the first path segment
+    if not parsed.netloc.startswith(f"{bucket}.") and key.startswith(f"{bucket}/"):
+        key = key[len(bucket) + 1 :]
+    return key
+
+
+def upload_s3_key(doc_data: dict) -> str:
+    """The S3 key of an upload document; older ones only have the URL."""
+    return doc_data.get("s3_key") or s3_key_from_url(doc_data["file_url"])
+
+
+class PresignedUrlCache:
+    """
+    Presigned GET URLs for media, keyed by S3 key.
+
+    A URL is generated once and handed out again until shortly before it
+    expires, so refreshing a library full of URLs is mostly cache hits and
+    never needs the upload documents.
+    """
+
+    def __init__(
+        self,
+        expiration: int = PRESIGNED_URL_EXPIRATION,
+        refresh_margin: int = PRESIGNED_URL_REFRESH_MARGIN,
+        max_entries: int = PRESIGNED_URL_CACHE_ENTRIES,
+    ):
+        self.expiration = expiration
+        self.refresh_margin = refresh_margin
+        self._urls = LRUCache(maxsize=max_entries)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict:
+        """Return {"url", "expires_at"} for the key. Blocking (signing)."""
+        now = time.time()
+        with self._lock:
+            cached = self._urls.get(key)
+        if cached is not None and cached["expires_at"] - self.refresh_margin > now:
+            metrics.increment("presigned_urls.hits")
+            return dict(cached)
+
+        metrics.increment("presigned_urls.misses")
+        entry = {
+            "url": aws_service.generate_presigned_url(key, self.expiration),
+            "expires_at": int(now) + self.expiration,
+        }
+        with self._lock:
+            self._urls[key] = entry
+        return dict(entry)
+
+    def get_many(self, keys: list) -> dict:
+        """Return {key: {"url", "expires_at"}} for several keys. Blocking."""
+        return {key: self.get(key) for key in dict.fromkeys(keys)}
+
+
+cache = PresignedUrlCache()
+
+
+async def presigned_url(key: str) -> dict:
+    return await aws_async.run_in_aws_pool(cache.get, key)
+
+
+async def presigned_urls(keys: list) -> dict:
+    """Presign many keys in one trip to the AWS pool."""
+    if not keys:
+        return {}
+    return await aws_async.run_in_aws_pool(cache.get_many, keys)
@@ -0,0 +1,232 @@
+# s3_upload.py
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from botocore.exceptions import BotoCoreError, ClientError
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+MB = 1024 * 1024
+
+# Multipart tuning; S3 requires every part except the last to be at least 5 MB
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(64 * MB)))
+S3_PART_SIZE = max(5 * MB, int(os.getenv("S3_PART_SIZE", str(16 * MB))))
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "8"))
+S3_PART_MAX_ATTEMPTS = int(os.getenv("S3_PART_MAX_ATTEMPTS", "3"))
+S3_PART_RETRY_BACKOFF = float(os.getenv("S3_PART_RETRY_BACKOFF", "0.5"))
+
+# Uploads in progress in this process, keyed by S3 key
+_active_uploads = {}
+_active_uploads_lock = threading.Lock()
+
+
+class UploadProgress:
+    """Bytes sent so far for one upload, safe to update from worker threads."""
+
+    def __init__(self, key: str, total_bytes: int):
+        self.key = key
+        self.total_bytes = total_bytes
+        self.bytes_sent = 0
+        self.parts_completed = 0
+        self.part_retries = 0
+        self.status = "IN_PROGRESS"
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add(self, byte_count: int, parts: int = 0):
+        with self._lock:
+            self.bytes_sent += byte_count
+            self.parts_completed += parts
+
+    def retried(self):
+        with self._lock:
+            self.part_retries += 1
+
+    def finish(self, status: str):
+        self.status = status
+        self.finished_at = time.monotonic()
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def bytes_per_second(self) -> float:
+        elapsed = self.elapsed_seconds
+        return self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "key": self.key,
+            "status": self.status,
+            "total_bytes": self.total_bytes,
+            "bytes_sent": self.bytes_sent,
+            "parts_completed": self.parts_completed,
+            "part_retries": self.part_retries,
+            "percent": (
+                100.0 * self.bytes_sent / self.total_bytes if self.total_bytes else 100.0
+            ),
+            "elapsed_seconds": self.elapsed_seconds,
+            "bytes_per_second": self.bytes_per_second,
+        }
+
+
+def get_upload_progress(key: str):
+    """Return the progress of an upload still running in this process, if any."""
+    with _active_uploads_lock:
+        return _active_uploads.get(key)
+
+
+def list_upload_progress(prefix: str = "") -> list:
+    """Return progress for every running upload whose key starts with prefix."""
+    with _active_uploads_lock:
+        return [
+            progress.to_dict()
+            for key, progress in _active_uploads.items()
+            if key.startswith(prefix)
+        ]
+
+
+class S3UploadEngine:
+    """
+    Upload file objects to S3, splitting large ones into parts that are sent
+    in parallel and retried individually.
+
+    Parts are read sequentially from the file object and at most max_workers
+    of them are in flight at once, so memory stays bounded at roughly
+    max_workers * part_size regardless of the file size.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        multipart_threshold: int = S3_MULTIPART_THRESHOLD,
+        part_size: int = S3_PART_SIZE,
+        max_workers: int = S3_UPLOAD_WORKERS,
+        max_attempts: int = S3_PART_MAX_ATTEMPTS,
+        retry_backoff: float = S3_PART_RETRY_BACKOFF,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+    def upload(self, file_obj, key: str, content_type: str) -> UploadProgress:
+        """
+        Upload the rest of file_obj to key.
+
+        Returns:
+            UploadProgress: Final byte count, part count and throughput
+        """
+        start = file_obj.tell()
+        file_obj.seek(0, os.SEEK_END)
+        total_bytes = file_obj.tell() - start
+        file_obj.seek(start)
+
+        progress = UploadProgress(key, total_bytes)
+        with _active_uploads_lock:
+            _active_uploads[key] = progress
+
+        try:
+            if total_bytes < self.multipart_threshold:
+                self._upload_single(file_obj, key, content_type, progress)
+            else:
+                self._upload_multipart(file_obj, key, content_type, progress)
+            progress.finish("COMPLETED")
+        except Exception:
+            progress.finish("FAILED")
+            metrics.increment("s3_upload.failures")
+            raise
+        finally:
+            with _active_uploads_lock:
+                _active_uploads.pop(key, None)
+
+        metrics.increment("s3_upload.bytes", progress.bytes_sent)
+        metrics.observe("s3_upload.bytes_per_second", progress.bytes_per_second)
+        metrics.observe("s3_upload.seconds", progress.elapsed_seconds)
+        return progress
+
+    def _with_retries(self, progress: UploadProgress, func, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return func(**kwargs)
+            except (ClientError, BotoCoreError):
+                if attempt == self.max_attempts:
+                    raise
+                progress.retried()
+                metrics.increment("s3_upload.part_retries")
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+    def _upload_single(self, file_obj, key, content_type, progress):
+        data = file_obj.read()
+        self._with_retries(
+            progress,
+            self.client.put_object,
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType=content_type,
+        )
+        progress.add(len(data), parts=1)
+
+    def _upload_part(self, key, upload_id, part_number, data, progress):
+        response = self._with_retries(
+            progress,
+            self.client.upload_part,
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        progress.add(len(data), parts=1)
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def _upload_multipart(self, file_obj, key, content_type, progress):
+        upload_id = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, ContentType=content_type
+        )["UploadId"]
+
+        parts = []
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="s3-part"
+            ) as pool:
+                in_flight = set()
+                part_number = 1
+                while data := file_obj.read(self.part_size):
+                    if len(in_flight) >= self.max_workers:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        parts.extend(future.result() for future in done)
+                    in_flight.add(
+                        pool.submit(
+                            self._upload_part, key, upload_id, part_number, data, progress
+                        )
+                    )
+                    part_number += 1
+                parts.extend(future.result() for future in wait(in_flight).done)
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": sorted(parts, key=lambda part: part["PartNumber"])
+                },
+            )
+        except Exception:
+            try:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id
+                )
+            except (ClientError, BotoCoreError) as e:
+                print(f"Failed to abort multipart upload {upload_id}: {str(e)}")
+            raise
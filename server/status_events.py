@@ -0,0 +1,193 @@
+import asyncio
+import json
+import threading
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from job_tracker import stored_status, TERMINAL_STATUSES
+import metrics
+from upload_index import find_upload_doc
+
+# Create router
+status_events_router = APIRouter()
+
+# Comment lines sent on idle SSE streams so proxies don't close them
+SSE_KEEPALIVE_SECONDS = 15
+
+
+class StatusWatcher:
+    """
+    Fan transcription status changes out to every subscriber of an upload.
+
+    Each upload document gets a single Firestore snapshot listener, however many
+    clients are subscribed to it, and the listener is removed once the job
+    finishes or the last subscriber leaves. The job tracker writes the final
+    status to the document, so this works on every replica, including ones
+    that aren't running the tracker.
+    """
+
+    def __init__(self):
+        self._watches = {}  # doc path -> {"queues": set, "listener": Watch}
+        self._lock = threading.Lock()
+
+    def subscribe(self, doc_ref) -> asyncio.Queue:
+        """Get a queue that receives every status of the upload document."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        with self._lock:
+            watch = self._watches.get(doc_ref.path)
+            if watch is None:
+                watch = {"queues": set(), "listener": None}
+                self._watches[doc_ref.path] = watch
+            watch["queues"].add((loop, queue))
+            start_listener = watch["listener"] is None
+            if start_listener:
+                # Placeholder so concurrent subscribers don't start a second one
+                watch["listener"] = False
+
+        if start_listener:
+            listener = doc_ref.on_snapshot(
+                lambda snapshots, changes, read_time: self._publish(
+                    doc_ref.path, snapshots
+                )
+            )
+            with self._lock:
+                if doc_ref.path in self._watches:
+                    self._watches[doc_ref.path]["listener"] = listener
+                else:
+                    listener.unsubscribe()
+
+        metrics.set_gauge("status_events.watched_uploads", len(self._watches))
+        return queue
+
+    def subscriber_count(self, doc_path: str) -> int:
+        with self._lock:
+            watch = self._watches.get(doc_path)
+            return len(watch["queues"]) if watch else 0
+
+    def unsubscribe(self, doc_path: str, queue: asyncio.Queue):
+        with self._lock:
+            watch = self._watches.get(doc_path)
+            if watch is None:
+                return
+            watch["queues"] = {
+                (loop, q) for loop, q in watch["queues"] if q is not queue
+            }
+            if watch["queues"]:
+                return
+            del self._watches[doc_path]
+            listener = watch["listener"]
+
+        if listener:
+            listener.unsubscribe()
+        metrics.set_gauge("status_events.watched_uploads", len(self._watches))
+
+    def _publish(self, doc_path: str, snapshots):
+        """Called on Firestore's listener thread with the latest document."""
+        if not snapshots or not snapshots[0].exists:
+            return
+        status = stored_status(snapshots[0].to_dict())
+
+        with self._lock:
+            watch = self._watches.get(doc_path)
+            subscribers = list(watch["queues"]) if watch else []
+
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, status)
+        metrics.increment("status_events.published", len(subscribers))
+
+
+watcher = StatusWatcher()
+
+
+async def status_updates(doc, keepalive_seconds: float = None):
+    """
+    Yield the upload's current status, then each change until the job finishes.
+
+    When keepalive_seconds is set, None is yielded after that long without a
+    change so callers can keep idle connections open.
+    """
+    status = stored_status(doc.to_dict())
+    yield status
+    if status["status"] in TERMINAL_STATUSES:
+        return
+
+    queue = watcher.subscribe(doc.reference)
+    try:
+        last = status
+        while True:
+            try:
+                status = await asyncio.wait_for(queue.get(), keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if status != last:
+                yield status
+                last = status
+            if status["status"] in TERMINAL_STATUSES:
+                return
+    finally:
+        watcher.unsubscribe(doc.reference.path, queue)
+
+
+@status_events_router.get("/transcription-events/{user_id}/{doc_id}")
+async def transcription_events(user_id: str, doc_id: str):
+    """Stream transcription status changes as Server-Sent Events"""
+    doc = find_upload_doc(user_id, doc_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    async def event_stream():
+        async for status in status_updates(doc, SSE_KEEPALIVE_SECONDS):
+            if status is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@status_events_router.websocket("/ws/transcription-status/{user_id}/{doc_id}")
+async def transcription_status_socket(websocket: WebSocket, user_id: str, doc_id: str):
+    """Push transcription status changes over a WebSocket"""
+    await websocket.accept()
+
+    doc = find_upload_doc(user_id, doc_id)
+    if doc is None:
+        await websocket.close(code=4404, reason="Document not found")
+        return
+
+    updates = status_updates(doc)
+
+    async def send_updates():
+        try:
+            async for status in updates:
+                await websocket.send_json(status)
+            await websocket.close()
+        except WebSocketDisconnect:
+            pass
+
+    async def wait_for_disconnect():
+        # Clients don't send anything, but reading is how a disconnect is noticed
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    sender = asyncio.create_task(send_updates())
+    receiver = asyncio.create_task(wait_for_disconnect())
+    try:
+        done, _ = await asyncio.wait(
+            {sender, receiver}, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            task.result()
+    finally:
+        # A client that leaves stops its updates, and with the last one the
+        # Firestore listener, rather than at the next status change
+        for task in (sender, receiver):
+            task.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        await updates.aclose()
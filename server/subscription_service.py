@@ -1,14 +1,103 @@
+import os
+import threading
+from cachetools import TTLCache
+from dotenv import load_dotenv
 from firebase_admin import firestore
 from firebase import db
 from models import SubscriptionTier
+import metrics
 import time
 
+load_dotenv()
+
+# Subscription records are cached in-process; tiers rarely change, and writes
+# through update_user_subscription invalidate the entry immediately
+SUBSCRIPTION_CACHE_TTL_SECONDS = float(os.getenv("SUBSCRIPTION_CACHE_TTL_SECONDS", "300"))
+SUBSCRIPTION_CACHE_MAX_ENTRIES = int(os.getenv("SUBSCRIPTION_CACHE_MAX_ENTRIES", "10000"))
+# Listen for subscription changes so writes made by other replicas (or
+# directly in Firestore) invalidate this replica's cache too
+SUBSCRIPTION_CACHE_LISTENER = (
+    os.getenv("SUBSCRIPTION_CACHE_LISTENER", "false").lower() == "true"
+)
+
+_cache = TTLCache(maxsize=SUBSCRIPTION_CACHE_MAX_ENTRIES, ttl=SUBSCRIPTION_CACHE_TTL_SECONDS)
+_cache_lock = threading.Lock()
+_listener = None
+
+
+def get_cached_subscription(user_id: str):
+    """Return a copy of the cached subscription record, or None."""
+    with _cache_lock:
+        subscription = _cache.get(user_id)
+    if subscription is None:
+        metrics.increment("subscription_cache.misses")
+        return None
+    metrics.increment("subscription_cache.hits")
+    return dict(subscription)
+
+
+def cache_subscription(user_id: str, subscription: dict):
+    with _cache_lock:
+        _cache[user_id] = dict(subscription)
+
+
+def invalidate_subscription(user_id: str):
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+
+def clear_subscription_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def subscription_cache_stats() -> dict:
+    with _cache_lock:
+        return {
+            "entries": len(_cache),
+            "max_entries": _cache.maxsize,
+            "ttl_seconds": _cache.ttl,
+            "listening": _listener is not None,
+        }
+
+
+def _on_subscriptions_changed(snapshots, changes, read_time):
+    """Called on Firestore's listener thread; drops changed records."""
+    for change in changes:
+        invalidate_subscription(change.document.id)
+    metrics.increment("subscription_cache.invalidations", len(changes))
+
+
+def start_subscription_listener():
+    """
+    Watch the subscriptions collection and invalidate changed records.
+
+    The listener's first snapshot reads every subscription document once, so
+    it's opt-in via SUBSCRIPTION_CACHE_LISTENER.
+    """
+    global _listener
+    if _listener is None:
+        _listener = db.collection("subscriptions").on_snapshot(
+            _on_subscriptions_changed
+        )
+
+
+def stop_subscription_listener():
+    global _listener
+    if _listener is not None:
+        _listener.unsubscribe()
+        _listener = None
+
 
 async def get_user_subscription(user_id: str):
     """Get a user's subscription details from Firestore"""
     if not user_id:
         raise ValueError("User ID is required")
 
+    subscription = get_cached_subscription(user_id)
+    if subscription is not None:
+        return subscription
+
     try:
         doc_ref = db.collection("subscriptions").document(user_id)
         doc = doc_ref.get()
@@ -23,12 +112,15 @@ async def get_user_subscription(user_id: str):
             }
             doc_ref.set(default_subscription)
             # Return a copy of default_subscription with consistent timestamp for immediate use
-            return {
+            subscription = {
                 **default_subscription,
                 "created_at": firestore.SERVER_TIMESTAMP._seconds,
             }
+        else:
+            subscription = doc.to_dict()
 
-        return doc.to_dict()
+        cache_subscription(user_id, subscription)
+        return subscription
     except Exception as e:
         print(f"Error getting user subscription: {str(e)}")
         # Return default free subscription on error, but don't try to save
@@ -63,6 +155,7 @@ async def update_user_subscription(
             doc_ref.set(subscription_data)
         else:
             doc_ref.update(subscription_data)
+        invalidate_subscription(user_id)
 
         # Return a copy with consistent timestamp for immediate use
         return {
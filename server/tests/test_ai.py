@@ -1,9 +1,10 @@
 import pytest
 from fastapi.testclient import TestClient
 from httpx import AsyncClient, ASGITransport
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from main import app
 from ai import ai_router
+import answer_cache
 from datetime import datetime
 from firebase_admin import firestore
 
@@ -45,6 +46,43 @@ def mock_server_timestamp(mocker):
     return mocker.patch("ai.firestore.SERVER_TIMESTAMP", datetime.now())
 
 
+@pytest.fixture(autouse=True)
+def empty_answer_cache():
+    """
+    Fixture to start every test without answers cached by earlier tests.
+    """
+    answer_cache.cache.clear()
+    yield
+    answer_cache.cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def free_tier_user(mocker):
+    """
+    Fixture to route questions through the free lane without reading subscriptions.
+    """
+    return mocker.patch(
+        "ai.subscription.is_pro_user", AsyncMock(return_value=False)
+    )
+
+
+@pytest.fixture
+def mock_batch(mocker):
+    """
+    Fixture to mock the Firestore write batch used to append conversation turns.
+    """
+    return mocker.patch("conversation_store.db.batch").return_value
+
+
+def turn_snapshot(doc_id, data):
+    """A stand-in for a document snapshot from the turns subcollection."""
+    doc = MagicMock()
+    doc.id = doc_id
+    doc.to_dict.return_value = data
+    doc.get.side_effect = data.get
+    return doc
+
+
 ### Tests for /ai/upload endpoint ###
 @pytest.mark.asyncio
 async def test_upload_successful(mock_firebase_collection, mock_server_timestamp):
@@ -144,7 +182,7 @@ async def test_upload_unauthorized_access(
 ### Tests for /ai/ask endpoint ###
 @pytest.mark.asyncio
 async def test_ask_question_successful(
-    mocker, mock_firebase_collection, mock_server_timestamp
+    mocker, mock_firebase_collection, mock_server_timestamp, mock_batch
 ):
     """
     Test case to verify that asking a question returns a valid response
@@ -156,7 +194,6 @@ async def test_ask_question_successful(
     mock_doc.to_dict.return_value = {
         "text": "Sample transcription",
         "user_id": "user123",
-        "conversation_history": [],
     }
     mock_firebase_collection.return_value.document.return_value.get.return_value = (
         mock_doc
@@ -165,9 +202,12 @@ async def test_ask_question_successful(
     # Mock Anthropic response
     mock_response = MagicMock()
     mock_response.content = [type("Content", (), {"text": "Mock answer"})]
+    mock_response.usage = None
     mock_anthropic = MagicMock()
-    mock_anthropic.messages.create.return_value = mock_response
-    mocker.patch("ai.anthropic", mock_anthropic)
+    mock_anthropic.beta.prompt_caching.messages.create = AsyncMock(
+        return_value=mock_response
+    )
+    mocker.patch("ai_gateway.gateway.client", mock_anthropic)
 
     async with AsyncClient(
         app=app, base_url="http://test", transport=ASGITransport(app=app)
@@ -189,10 +229,242 @@ async def test_ask_question_successful(
         assert response.json()["text_id"] == "text123"
 
 
+@pytest.mark.asyncio
+async def test_ask_caches_prompt_prefix_and_records_usage(
+    mocker, mock_firebase_collection, mock_server_timestamp, mock_batch
+):
+    """
+    Test case to verify that the system prompt and transcript are sent as a
+    cacheable prefix ahead of the history, and that the response's cache
+    token counts are saved on the ai_texts document.
+    """
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "text": "Sample transcription",
+        "user_id": "user123",
+    }
+    doc_ref = mock_firebase_collection.return_value.document.return_value
+    doc_ref.get.return_value = mock_doc
+    turns_query = doc_ref.collection.return_value.order_by.return_value.order_by
+    turns_query.return_value.limit.return_value.stream.return_value = [
+        turn_snapshot("turn1", {"question": "First?", "answer": "First answer"})
+    ]
+
+    mock_response = MagicMock()
+    mock_response.content = [type("Content", (), {"text": "Mock answer"})]
+    mock_response.usage = MagicMock(
+        input_tokens=12,
+        output_tokens=30,
+        cache_creation_input_tokens=0,
+        cache_read_input_tokens=2048,
+    )
+    mock_anthropic = MagicMock()
+    create = AsyncMock(return_value=mock_response)
+    mock_anthropic.beta.prompt_caching.messages.create = create
+    mocker.patch("ai_gateway.gateway.client", mock_anthropic)
+
+    async with AsyncClient(
+        app=app, base_url="http://test", transport=ASGITransport(app=app)
+    ) as ac:
+        response = await ac.post(
+            "/ai/ask",
+            json={
+                "text_id": "text123",
+                "question": "Second?",
+                "user_id": "user123",
+                "file_id": "file123",
+                "file_type": "video",
+            },
+        )
+
+    assert response.status_code == 200
+    kwargs = create.call_args.kwargs
+    assert kwargs["system"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "Sample transcription" in kwargs["system"][-1]["text"]
+    assert kwargs["messages"][0] == {"role": "user", "content": "First?"}
+    assert kwargs["messages"][1]["content"][0]["cache_control"] == {
+        "type": "ephemeral"
+    }
+    assert kwargs["messages"][-1] == {"role": "user", "content": "Second?"}
+
+    turn = mock_batch.create.call_args.args[1]
+    assert turn["usage"]["cache_read_input_tokens"] == 2048
+    update = mock_batch.update.call_args.args[1]
+    assert update["token_usage.cache_read_input_tokens"].value == 2048
+    assert update["token_usage.cache_creation_input_tokens"].value == 0
+
+
+@pytest.mark.asyncio
+async def test_repeated_first_question_is_answered_from_cache(
+    mocker, mock_firebase_collection, mock_server_timestamp, mock_batch
+):
+    """
+    Test case to verify that the same first question about the same text is
+    answered without calling Claude again and is still saved as a turn.
+    """
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "text": "Sample transcription",
+        "user_id": "user123",
+        "version": 0,
+    }
+    mock_firebase_collection.return_value.document.return_value.get.return_value = (
+        mock_doc
+    )
+
+    mock_response = MagicMock()
+    mock_response.content = [type("Content", (), {"text": "Mock summary"})]
+    mock_response.usage = None
+    create = AsyncMock(return_value=mock_response)
+    mock_anthropic = MagicMock()
+    mock_anthropic.beta.prompt_caching.messages.create = create
+    mocker.patch("ai_gateway.gateway.client", mock_anthropic)
+    body = {
+        "text_id": "text123",
+        "user_id": "user123",
+        "file_id": "file123",
+        "file_type": "video",
+    }
+
+    async with AsyncClient(
+        app=app, base_url="http://test", transport=ASGITransport(app=app)
+    ) as ac:
+        first = await ac.post("/ai/ask", json={**body, "question": "Summarize this."})
+        repeat = await ac.post(
+            "/ai/ask", json={**body, "question": "  summarize   THIS please"}
+        )
+
+    assert first.json()["answer"] == repeat.json()["answer"] == "Mock summary"
+    create.assert_called_once()
+    assert mock_batch.create.call_count == 2
+    assert mock_batch.create.call_args.args[1]["cached"] is True
+
+
+class FakeMessageStream:
+    """Stands in for the Anthropic SDK's async message stream"""
+
+    def __init__(self, chunks, error=None, usage=None):
+        self.chunks = chunks
+        self.error = error
+        self.usage = usage
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    async def text_stream(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error:
+            raise self.error
+
+    async def get_final_message(self):
+        return MagicMock(usage=self.usage)
+
+
+@pytest.mark.asyncio
+async def test_ask_stream_sends_tokens_then_saves_answer_once(
+    mocker, mock_firebase_collection, mock_server_timestamp, mock_batch
+):
+    """
+    Test case to verify that the streaming endpoint sends each chunk as a
+    token event and writes the whole answer to the conversation once.
+    """
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "text": "Sample transcription",
+        "user_id": "user123",
+    }
+    doc_ref = mock_firebase_collection.return_value.document.return_value
+    doc_ref.get.return_value = mock_doc
+
+    mock_anthropic = MagicMock()
+    mock_anthropic.beta.prompt_caching.messages.stream.return_value = FakeMessageStream(
+        ["Mock ", "streamed ", "answer"],
+        usage=MagicMock(
+            input_tokens=10,
+            output_tokens=3,
+            cache_creation_input_tokens=1500,
+            cache_read_input_tokens=0,
+        ),
+    )
+    mocker.patch("ai_gateway.gateway.client", mock_anthropic)
+
+    async with AsyncClient(
+        app=app, base_url="http://test", transport=ASGITransport(app=app)
+    ) as ac:
+        response = await ac.post(
+            "/ai/ask/stream",
+            json={
+                "text_id": "text123",
+                "question": "What is this about?",
+                "user_id": "user123",
+                "file_id": "file123",
+                "file_type": "video",
+            },
+        )
+
+    assert response.status_code == 200
+    events = [line for line in response.text.splitlines() if line.startswith("event: ")]
+    assert events == ["event: token"] * 3 + ["event: done"]
+    assert '"answer": "Mock streamed answer"' in response.text
+
+    mock_batch.create.assert_called_once()
+    mock_batch.commit.assert_called_once()
+    turn = mock_batch.create.call_args.args[1]
+    assert turn["answer"] == "Mock streamed answer"
+    assert turn["usage"]["cache_creation_input_tokens"] == 1500
+
+
+@pytest.mark.asyncio
+async def test_ask_stream_failure_saves_nothing(
+    mocker, mock_firebase_collection, mock_server_timestamp, mock_batch
+):
+    """
+    Test case to verify that an answer interrupted by an AI error is
+    reported as an error event and not saved.
+    """
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {"text": "Sample", "user_id": "user123"}
+    doc_ref = mock_firebase_collection.return_value.document.return_value
+    doc_ref.get.return_value = mock_doc
+
+    mock_anthropic = MagicMock()
+    mock_anthropic.beta.prompt_caching.messages.stream.return_value = FakeMessageStream(
+        ["Partial"], error=RuntimeError("overloaded")
+    )
+    mocker.patch("ai_gateway.gateway.client", mock_anthropic)
+
+    async with AsyncClient(
+        app=app, base_url="http://test", transport=ASGITransport(app=app)
+    ) as ac:
+        response = await ac.post(
+            "/ai/ask/stream",
+            json={
+                "text_id": "text123",
+                "question": "What is this about?",
+                "user_id": "user123",
+                "file_id": "file123",
+                "file_type": "video",
+            },
+        )
+
+    assert "event: error" in response.text
+    assert "overloaded" in response.text
+    mock_batch.commit.assert_not_called()
+
+
 @pytest.mark.asyncio
 async def test_ask_invalid_text_id(mock_firebase_collection):
     """
-    Test case to verify that an invalid text_id returns a 500 status with
+    Test case to verify that an invalid text_id returns a 404 status with
     the correct error message.
     """
     mock_doc = MagicMock()
@@ -216,8 +488,51 @@ async def test_ask_invalid_text_id(mock_firebase_collection):
         )
 
         # Assert that the response is as expected for an invalid text_id
-        assert response.status_code == 500
-        assert response.json()["detail"] == "Database error: 404: Text ID not found"
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Text ID not found"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/ai/ask", "/ai/ask/stream"])
+async def test_ask_about_text_over_token_budget(
+    mocker, mock_firebase_collection, path
+):
+    """
+    Test case to verify that a text too long for the input token budget is
+    rejected with a 413 before anything is sent to Claude.
+    """
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "text": "word " * 100000,
+        "user_id": "user123",
+    }
+    mock_firebase_collection.return_value.document.return_value.get.return_value = (
+        mock_doc
+    )
+    # Send the whole text rather than retrieved passages
+    mocker.patch("transcript_index.AI_RETRIEVAL_MIN_TOKENS", 10**9)
+    mock_anthropic = MagicMock()
+    mocker.patch("ai_gateway.gateway.client", mock_anthropic)
+
+    async with AsyncClient(
+        app=app, base_url="http://test", transport=ASGITransport(app=app)
+    ) as ac:
+        response = await ac.post(
+            path,
+            json={
+                "text_id": "text123",
+                "question": "What is this about?",
+                "user_id": "user123",
+                "file_id": "file123",
+                "file_type": "video",
+            },
+        )
+
+    assert response.status_code == 413
+    assert response.json()["detail"].startswith("Text is too long to ask about")
+    mock_anthropic.beta.prompt_caching.messages.create.assert_not_called()
+    mock_anthropic.beta.prompt_caching.messages.stream.assert_not_called()
 
 
 ### Tests for /ai/conversation/{text_id} endpoint ###
@@ -232,15 +547,17 @@ async def test_get_conversation_successful(mock_firebase_collection):
     mock_doc.to_dict.return_value = {
         "text": "Sample transcription",
         "user_id": "user123",
-        "conversation_history": [
-            {"question": "What is this about?", "answer": "Mock answer"}
-        ],
         "created_at": "2024-11-01T00:00:00",
         "last_accessed": "2024-11-10T00:00:00",
     }
-    mock_firebase_collection.return_value.document.return_value.get.return_value = (
-        mock_doc
-    )
+    doc_ref = mock_firebase_collection.return_value.document.return_value
+    doc_ref.get.return_value = mock_doc
+    turns_query = doc_ref.collection.return_value.order_by.return_value.order_by
+    turns_query.return_value.limit.return_value.stream.return_value = [
+        turn_snapshot(
+            "turn1", {"question": "What is this about?", "answer": "Mock answer"}
+        )
+    ]
 
     async with AsyncClient(
         app=app, base_url="http://test", transport=ASGITransport(app=app)
@@ -253,7 +570,140 @@ async def test_get_conversation_successful(mock_firebase_collection):
         # Assert that the response contains the expected conversation history
         assert response.status_code == 200
         assert response.json()["text"] == "Sample transcription"
-        assert len(response.json()["conversation"]) == 1
+        assert response.json()["conversation"][0]["answer"] == "Mock answer"
+        assert response.json()["next_cursor"] is None
+        # Changes on every read, so it would break the version ETag
+        assert "last_accessed" not in response.json()
+
+
+@pytest.mark.asyncio
+async def test_get_conversation_pages_with_cursor(mock_firebase_collection):
+    """
+    Test case to verify that a full page of turns returns a cursor which
+    continues after the last turn of that page.
+    """
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {"text": "Sample", "user_id": "user123"}
+    doc_ref = mock_firebase_collection.return_value.document.return_value
+    doc_ref.get.return_value = mock_doc
+    query = doc_ref.collection.return_value.order_by.return_value.order_by.return_value
+    created_at = datetime(2024, 11, 1, 12, 0, 0)
+    query.limit.return_value.stream.return_value = [
+        turn_snapshot(
+            f"turn{i}", {"question": "Q", "answer": "A", "created_at": created_at}
+        )
+        for i in range(2)
+    ]
+    params = {
+        "user_id": "user123",
+        "file_id": "file123",
+        "file_type": "video",
+        "page_size": 2,
+    }
+
+    async with AsyncClient(
+        app=app, base_url="http://test", transport=ASGITransport(app=app)
+    ) as ac:
+        first = await ac.get("/ai/conversation/text123", params=params)
+        cursor = first.json()["next_cursor"]
+        await ac.get("/ai/conversation/text123", params={**params, "cursor": cursor})
+        invalid = await ac.get(
+            "/ai/conversation/text123", params={**params, "cursor": "nope"}
+        )
+
+    assert len(first.json()["conversation"]) == 2
+    query.limit.assert_called_with(2)
+    query.limit.return_value.start_after.assert_called_once_with(
+        {"created_at": created_at, "__name__": "turn1"}
+    )
+    assert invalid.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_conversation_moves_legacy_history_to_turns(
+    mocker, mock_firebase_collection
+):
+    """
+    Test case to verify that a conversation_history array from before turns
+    were stored separately is written to the turns subcollection and removed.
+    """
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = {
+        "text": "Sample",
+        "user_id": "user123",
+        "conversation_history": [
+            {
+                "question": "What is this about?",
+                "answer": "Mock answer",
+                "timestamp": "2024-11-01T00:00:00",
+            }
+        ],
+    }
+    doc_ref = mock_firebase_collection.return_value.document.return_value
+    doc_ref.get.return_value = mock_doc
+    batch = mocker.patch("conversation_store.db.batch").return_value
+
+    async with AsyncClient(
+        app=app, base_url="http://test", transport=ASGITransport(app=app)
+    ) as ac:
+        response = await ac.get(
+            "/ai/conversation/text123",
+            params={"user_id": "user123", "file_id": "file123", "file_type": "video"},
+        )
+
+    assert response.status_code == 200
+    turn_ref, turn = batch.set.call_args.args
+    assert turn["answer"] == "Mock answer"
+    assert turn["created_at"] == datetime(2024, 11, 1)
+    doc_ref.collection.return_value.document.assert_any_call("legacy-00000")
+    assert batch.update.call_args.args[1]["conversation_history"] is (
+        firestore.DELETE_FIELD
+    )
+    batch.commit.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_conversation_revalidates_with_etag(mock_firebase_collection):
+    """
+    Test case to verify that a client holding the current ETag gets a 304,
+    and that a new version of the conversation changes the ETag.
+    """
+    doc_data = {
+        "text": "Sample transcription",
+        "user_id": "user123",
+        "version": 3,
+    }
+    mock_doc = MagicMock()
+    mock_doc.exists = True
+    mock_doc.to_dict.return_value = doc_data
+    mock_firebase_collection.return_value.document.return_value.get.return_value = (
+        mock_doc
+    )
+    params = {"user_id": "user123", "file_id": "file123", "file_type": "video"}
+
+    async with AsyncClient(
+        app=app, base_url="http://test", transport=ASGITransport(app=app)
+    ) as ac:
+        first = await ac.get("/ai/conversation/text123", params=params)
+        etag = first.headers["etag"]
+        repeat = await ac.get(
+            "/ai/conversation/text123",
+            params=params,
+            headers={"If-None-Match": etag},
+        )
+        doc_data["version"] = 4
+        changed = await ac.get(
+            "/ai/conversation/text123",
+            params=params,
+            headers={"If-None-Match": etag},
+        )
+
+    assert repeat.status_code == 304
+    assert repeat.content == b""
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
 
 
 @pytest.mark.asyncio
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import anthropic
+import httpx
+import pytest
+from unittest.mock import AsyncMock, patch
+from anthropic import AsyncAnthropic
+from ai_gateway import (
+    BACKGROUND,
+    FREE,
+    PRO,
+    AIGateway,
+    AIGatewayBusy,
+    PriorityLimiter,
+    retry_delay,
+)
+
+REQUEST = {
+    "model": "claude-3-haiku-20240307",
+    "max_tokens": 100,
+    "messages": [{"role": "user", "content": "Hi"}],
+}
+USAGE = {
+    "input_tokens": 10,
+    "output_tokens": 2,
+    "cache_creation_input_tokens": 0,
+    "cache_read_input_tokens": 8,
+}
+MESSAGE = {
+    "id": "msg_1",
+    "type": "message",
+    "role": "assistant",
+    "model": "claude-3-haiku-20240307",
+    "content": [{"type": "text", "text": "Hello there"}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": USAGE,
+}
+
+
+def sse(events: list) -> bytes:
+    return "".join(
+        f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events
+    ).encode()
+
+
+STREAM = sse(
+    [
+        {"type": "message_start", "message": {**MESSAGE, "content": []}},
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Hello "}},
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "there"}},
+        {"type": "content_block_stop", "index": 0},
+        {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": 2}},
+        {"type": "message_stop"},
+    ]
+)
+
+
+def fake_anthropic(responses: list):
+    """
+    A local stand-in for the Anthropic API: an AsyncAnthropic client whose
+    transport answers each request with the next of the given responses.
+    """
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        return responses[min(len(requests), len(responses)) - 1]
+
+    client = AsyncAnthropic(
+        api_key="test",
+        base_url="http://fake-anthropic",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    return client, requests
+
+
+def error(status: int, headers: dict = None):
+    return httpx.Response(
+        status,
+        headers=headers,
+        json={"type": "error", "error": {"type": "overloaded_error", "message": "busy"}},
+    )
+
+
+@pytest.fixture
+def sleeps():
+    with patch("ai_gateway.asyncio.sleep", new_callable=AsyncMock) as sleep:
+        yield sleep
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_request_waits_for_retry_after(sleeps):
+    client, requests = fake_anthropic(
+        [error(429, {"retry-after": "2"}), httpx.Response(200, json=MESSAGE)]
+    )
+
+    response = await AIGateway(client).create(FREE, **REQUEST)
+
+    assert response.content[0].text == "Hello there"
+    assert response.usage.cache_read_input_tokens == 8
+    assert len(requests) == 2
+    assert 2 <= sleeps.call_args.args[0] <= 2 + 0.5 + 1e-9
+
+
+@pytest.mark.asyncio
+async def test_overload_gives_up_after_the_retry_limit(sleeps):
+    client, requests = fake_anthropic([error(529)])
+
+    with pytest.raises(anthropic.APIStatusError):
+        await AIGateway(client, max_retries=2).create(FREE, **REQUEST)
+
+    assert len(requests) == 3
+    assert sleeps.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried(sleeps):
+    client, requests = fake_anthropic([error(400)])
+
+    with pytest.raises(anthropic.BadRequestError):
+        await AIGateway(client).create(FREE, **REQUEST)
+
+    assert len(requests) == 1
+    sleeps.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_stream_is_retried_until_it_opens(sleeps):
+    client, requests = fake_anthropic(
+        [
+            error(529),
+            httpx.Response(
+                200, content=STREAM, headers={"content-type": "text/event-stream"}
+            ),
+        ]
+    )
+    gateway = AIGateway(client)
+
+    async with gateway.stream(PRO, **REQUEST) as stream:
+        chunks = [text async for text in stream.text_stream]
+        final = await stream.get_final_message()
+
+    assert chunks == ["Hello ", "there"]
+    assert final.usage.cache_read_input_tokens == 8
+    assert len(requests) == 2
+    assert gateway.limiter.in_flight == 0
+
+
+def test_backoff_without_retry_after_is_jittered_and_capped():
+    delays = [retry_delay(10, RuntimeError()) for _ in range(50)]
+
+    assert all(0 <= delay <= 30 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+@pytest.mark.asyncio
+async def test_freed_slots_go_to_pro_before_free_and_background():
+    limiter = PriorityLimiter(capacity=1, max_queue=10)
+    order = []
+
+    async def job(lane, name):
+        async with limiter.slot(lane):
+            order.append(name)
+
+    await limiter.acquire(FREE)
+    waiting = [
+        asyncio.create_task(job(BACKGROUND, "background")),
+        asyncio.create_task(job(FREE, "free")),
+        asyncio.create_task(job(PRO, "pro")),
+    ]
+    await asyncio.sleep(0)
+    assert limiter.queued() == 3
+
+    limiter.release()
+    await asyncio.gather(*waiting)
+
+    assert order == ["pro", "free", "background"]
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_turns_requests_away():
+    limiter = PriorityLimiter(capacity=1, max_queue=1)
+    await limiter.acquire(FREE)
+    waiter = asyncio.create_task(limiter.acquire(FREE))
+    await asyncio.sleep(0)
+
+    with pytest.raises(AIGatewayBusy):
+        await limiter.acquire(PRO)
+
+    waiter.cancel()
+    limiter.release()
+    assert limiter.in_flight == 0
@@ -0,0 +1,60 @@
+from answer_cache import (
+    AnswerCache,
+    cacheable,
+    depends_on_history,
+    normalize_question,
+    text_key,
+)
+
+
+def test_questions_are_normalized():
+    assert normalize_question("Can you please SUMMARIZE this?!") == "summarize this"
+    assert normalize_question("What are the action items") == normalize_question(
+        "what are the action-items?"
+    )
+
+
+def test_follow_up_questions_are_only_cached_as_first_questions():
+    assert depends_on_history("Can you elaborate on that?")
+    assert not depends_on_history("What are the action items?")
+
+    assert cacheable({"version": 0}, "Tell me more about it")
+    assert not cacheable({"version": 3}, "Tell me more about it")
+    assert cacheable({"version": 3}, "What are the action items?")
+
+
+def test_texts_with_the_same_content_share_a_scope():
+    assert text_key({"text": "Same"}, "model") == text_key({"text": "Same"}, "model")
+    assert text_key({"text": "Same"}, "model") != text_key({"text": "Other"}, "model")
+    assert text_key({"text": "Same"}, "model") != text_key({"text": "Same"}, "other")
+
+
+def test_answers_expire_after_the_ttl():
+    now = [1000.0]
+    cache = AnswerCache(ttl=60, max_entries=10, timer=lambda: now[0])
+    cache.put("text", "Summarize this", "Summary")
+    assert cache.get("text", "summarize this.") == "Summary"
+    assert cache.get("other text", "Summarize this") is None
+
+    now[0] += 61
+    assert cache.get("text", "Summarize this") is None
+
+
+def test_size_is_bounded():
+    cache = AnswerCache(max_entries=2)
+    for i in range(3):
+        cache.put("text", f"Question {i}", f"Answer {i}")
+
+    assert cache.stats()["entries"] == 2
+    assert cache.get("text", "Question 0") is None
+
+
+def test_near_duplicates_match_only_when_enabled():
+    exact = AnswerCache()
+    near = AnswerCache(similarity=0.6)
+    for cache in (exact, near):
+        cache.put("text", "What are the main action items?", "Items")
+
+    assert exact.get("text", "What are the action items?") is None
+    assert near.get("text", "What are the action items?") == "Items"
+    assert near.get("text", "Who spoke first?") is None
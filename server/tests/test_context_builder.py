@@ -0,0 +1,113 @@
+import pytest
+from datetime import datetime
+from fastapi import HTTPException
+from unittest.mock import AsyncMock, MagicMock, patch
+import context_builder
+from context_builder import build_context, count_tokens, refresh_summary
+
+
+def make_turns(count, answer="An answer"):
+    return [
+        {
+            "id": f"turn{i}",
+            "question": f"Question {i}?",
+            "answer": answer,
+            "created_at": datetime(2024, 11, 1, 12, i),
+        }
+        for i in range(count)
+    ]
+
+
+def test_all_turns_fit_within_a_generous_budget():
+    context = build_context("Transcript", None, make_turns(3), "Next?", budget=10000)
+
+    assert context["turns"] == 3
+    assert context["dropped_turns"] == 0
+    assert len(context["messages"]) == 7
+    assert context["messages"][-1] == {"role": "user", "content": "Next?"}
+
+
+def test_oldest_turns_are_dropped_when_over_budget():
+    turns = make_turns(5, answer="x" * 350)  # about 100 tokens each
+    fixed = build_context("Transcript", "Summary", [], "Next?")["estimated_tokens"]
+
+    context = build_context("Transcript", "Summary", turns, "Next?", budget=fixed + 250)
+
+    assert context["turns"] == 2
+    assert context["dropped_turns"] == 3
+    assert context["messages"][0]["content"] == "Question 3?"
+    assert context["estimated_tokens"] <= fixed + 250
+    assert "Summary" in context["system"][-1]["text"]
+
+
+def test_transcript_over_budget_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        build_context("word " * 1000, None, [], "Next?", budget=100)
+
+    assert error.value.status_code == 413
+
+
+def test_token_estimate_errs_high_for_english():
+    assert count_tokens("The quick brown fox jumps over the lazy dog.") >= 10
+
+
+@pytest.mark.asyncio
+async def test_summary_waits_for_a_batch_of_older_turns():
+    ai_text_ref = MagicMock()
+    ai_text_ref.get.return_value.to_dict.return_value = {}
+    create = AsyncMock()
+    limit = context_builder.AI_RECENT_TURNS + context_builder.AI_SUMMARY_BATCH_TURNS
+
+    with patch("context_builder.recent_turns", return_value=make_turns(limit)):
+        assert not await refresh_summary(ai_text_ref, create)
+
+    create.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_summary_folds_turns_older_than_the_recent_ones():
+    ai_text_ref = MagicMock()
+    previous = {
+        "text": "Earlier summary",
+        "through": {"created_at": datetime(2024, 11, 1), "id": "old"},
+        "turns": 4,
+    }
+    ai_text_ref.get.return_value.to_dict.return_value = {"summary": previous}
+    response = MagicMock()
+    response.content = [MagicMock(text="New summary")]
+    create = AsyncMock(return_value=response)
+    turns = make_turns(
+        context_builder.AI_RECENT_TURNS + context_builder.AI_SUMMARY_BATCH_TURNS + 1
+    )
+    folded = turns[: -context_builder.AI_RECENT_TURNS]
+
+    with patch("context_builder.recent_turns", return_value=turns) as recent, patch(
+        "context_builder.db"
+    ), patch("context_builder._store_summary", return_value=True) as store:
+        assert await refresh_summary(ai_text_ref, create)
+
+    assert recent.call_args.kwargs["after"] == previous["through"]
+    prompt = create.call_args.kwargs["messages"][0]["content"]
+    assert "Earlier summary" in prompt
+    assert folded[-1]["question"] in prompt
+    assert turns[-1]["question"] not in prompt
+
+    summary = store.call_args.args[3]
+    assert summary["text"] == "New summary"
+    assert summary["through"]["id"] == folded[-1]["id"]
+    assert summary["turns"] == 4 + len(folded)
+
+
+def test_concurrent_summary_refresh_is_not_overwritten():
+    ai_text_ref = MagicMock()
+    ai_text_ref.get.return_value.to_dict.return_value = {
+        "summary": {"through": {"id": "turn9"}}
+    }
+    transaction = MagicMock()
+
+    stored = context_builder._store_summary.to_wrap(
+        transaction, ai_text_ref, {"through": {"id": "turn4"}}, {"text": "Stale"}
+    )
+
+    assert not stored
+    transaction.update.assert_not_called()
@@ -0,0 +1,102 @@
+import gzip
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from httpx import AsyncClient, ASGITransport
+from http_cache import (
+    CompressionMiddleware,
+    etag_matches,
+    format_etag,
+    negotiate_encoding,
+)
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware)
+LARGE = {"words": ["hello"] * 1000}
+
+
+@app.get("/json")
+async def large_json():
+    return JSONResponse(LARGE, headers={"ETag": '"abc"'})
+
+
+@app.get("/small")
+async def small_json():
+    return {"ok": True}
+
+
+@app.get("/events")
+async def events():
+    async def stream():
+        for i in range(3):
+            yield f"data: {'x' * 2000}{i}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def test_negotiates_by_quality_and_support():
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("*") == "br"
+    assert negotiate_encoding("gzip, br;q=0.5") == "gzip"
+
+
+def test_etag_matching_covers_codings_and_weak_tags():
+    assert etag_matches('"abc"', "abc")
+    assert etag_matches('W/"abc-gzip", "other"', "abc")
+    assert etag_matches("*", "abc")
+    assert not etag_matches('"abcd"', "abc")
+    assert not etag_matches(None, "abc")
+    assert format_etag("abc", "gzip") == '"abc-gzip"'
+
+
+@pytest.mark.asyncio
+async def test_compresses_complete_json_responses():
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        response = await ac.get("/json", headers={"Accept-Encoding": "gzip"})
+        small = await ac.get("/small", headers={"Accept-Encoding": "gzip"})
+        plain = await ac.get("/json", headers={"Accept-Encoding": "identity"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == '"abc-gzip"'
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.json() == LARGE
+    assert int(response.headers["content-length"]) < len(plain.content)
+
+    assert "content-encoding" not in small.headers
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["etag"] == '"abc"'
+
+
+@pytest.mark.asyncio
+async def test_prefers_brotli_when_accepted():
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        response = await ac.get("/json", headers={"Accept-Encoding": "gzip, br"})
+
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["etag"] == '"abc-br"'
+    assert response.json() == LARGE
+
+
+@pytest.mark.asyncio
+async def test_streams_pass_through_uncompressed():
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as ac:
+        response = await ac.get("/events", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.text.count("data: ") == 3
+
+
+def test_stored_gzip_variant_is_deterministic():
+    from http_cache import compress
+
+    assert compress(b"x" * 100, "gzip") == compress(b"x" * 100, "gzip")
+    assert gzip.decompress(compress(b"x" * 100, "gzip")) == b"x" * 100
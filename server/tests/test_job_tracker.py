@@ -0,0 +1,157 @@
+import asyncio
+import pytest
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+from job_tracker import JobTracker
+
+
+@pytest.fixture
+def mock_db():
+    with patch("job_tracker.db") as mock_db, patch(
+        "job_tracker.firestore.SERVER_TIMESTAMP", "mock_timestamp"
+    ):
+        yield mock_db
+
+
+def make_tracker(**kwargs):
+    options = {"min_poll_interval": 10, "max_poll_interval": 300, "reload_interval": 60}
+    options.update(kwargs)
+    return JobTracker(**options)
+
+
+@pytest.mark.asyncio
+async def test_poll_lists_pages_and_fetches_only_finished_jobs(mock_db):
+    """Running jobs come from paged list calls; only finished jobs are fetched"""
+    tracker = make_tracker()
+    past = time.time() - 1000
+    tracker.track("transcribe_running", "uploads/u/audio_files/a", past)
+    tracker.track("transcribe_done", "uploads/u/video_files/b", past)
+
+    pages = {
+        ("QUEUED", None): ([], None),
+        ("IN_PROGRESS", None): ([{"TranscriptionJobName": "transcribe_other"}], "page2"),
+        ("IN_PROGRESS", "page2"): (
+            [{"TranscriptionJobName": "transcribe_running"}],
+            None,
+        ),
+    }
+
+    async def list_jobs(status, prefix, next_token, page_size):
+        return pages[(status, next_token)]
+
+    get_status = AsyncMock(
+        return_value={
+            "status": "COMPLETED",
+            "job_name": "transcribe_done",
+            "transcript_uri": "https://transcripts/b.json",
+        }
+    )
+
+    with patch("job_tracker.aws_async.list_transcription_jobs", list_jobs), patch(
+        "job_tracker.aws_async.get_transcription_job_status", get_status
+    ):
+        await tracker.poll_once()
+
+    get_status.assert_awaited_once_with("transcribe_done")
+    batch = mock_db.batch.return_value
+    batch.update.assert_any_call(
+        mock_db.document.return_value,
+        {
+            "transcription_status": "COMPLETED",
+            "transcript_uri": "https://transcripts/b.json",
+        },
+    )
+    batch.commit.assert_called_once()
+    assert tracker.due_jobs(time.time() + 1) == []
+    assert "transcribe_done" not in tracker._jobs
+
+
+def test_first_check_waits_for_expected_processing_time():
+    """Longer media is checked later; unknown durations use the minimum interval"""
+    tracker = make_tracker()
+    now = time.time()
+    tracker.track("short", "doc/a", now)
+    tracker.track("long", "doc/b", now, media_duration=3600)
+
+    assert tracker._jobs["short"]["next_check"] == pytest.approx(now + 10)
+    assert tracker._jobs["long"]["next_check"] == pytest.approx(now + 1800)
+    assert tracker.next_poll_delay(now) == pytest.approx(10)
+
+
+@pytest.mark.asyncio
+async def test_running_jobs_back_off_exponentially(mock_db):
+    tracker = make_tracker()
+    tracker.track("transcribe_slow", "doc/a", time.time() - 100)
+
+    async def list_jobs(status, prefix, next_token, page_size):
+        if status == "IN_PROGRESS":
+            return [{"TranscriptionJobName": "transcribe_slow"}], None
+        return [], None
+
+    delays = []
+    with patch("job_tracker.aws_async.list_transcription_jobs", list_jobs):
+        for _ in range(6):
+            tracker._jobs["transcribe_slow"]["next_check"] = 0
+            before = time.time()
+            await tracker.poll_once()
+            delays.append(tracker._jobs["transcribe_slow"]["next_check"] - before)
+
+    assert [round(delay) for delay in delays] == [20, 40, 80, 160, 300, 300]
+
+
+@pytest.mark.asyncio
+async def test_record_result_ignores_unknown_jobs(mock_db):
+    tracker = make_tracker()
+    mock_db.collection.return_value.document.return_value.get.return_value.exists = False
+
+    await tracker.record_result("transcribe_unknown", {"status": "FAILED"})
+
+    mock_db.batch.assert_not_called()
+
+
+class FakeLease:
+    def __init__(self, granted):
+        self.granted = granted
+        self.duration = 60
+        self.released = False
+
+    def acquire(self):
+        return self.granted
+
+    def release(self):
+        self.released = True
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("leader", [True, False])
+async def test_only_the_lease_holder_polls(mock_db, leader):
+    tracker = make_tracker(lease=FakeLease(leader))
+    job = MagicMock(id="transcribe_running")
+    job.to_dict.return_value = {"doc_path": "uploads/u/audio_files/a", "created_at": None}
+    mock_db.collection.return_value.where.return_value.stream.return_value = [job]
+    tracker.track("transcribe_running", "uploads/u/audio_files/a", time.time() - 1000)
+    list_jobs = AsyncMock(return_value=([], None))
+
+    with patch("job_tracker.aws_async.list_transcription_jobs", list_jobs), patch(
+        "job_tracker.aws_async.get_transcription_job_status",
+        AsyncMock(return_value={"status": "IN_PROGRESS"}),
+    ):
+        tracker.start()
+        await asyncio.sleep(0.05)
+        await tracker.stop()
+
+    assert list_jobs.await_count == (2 if leader else 0)
+    assert tracker.lease.released == leader
+
+
+@pytest.mark.asyncio
+async def test_standby_records_new_jobs_without_watching_them(mock_db):
+    tracker = make_tracker(lease=FakeLease(False))
+    await tracker.hold_lease()
+
+    await tracker.register(
+        "transcribe_new", MagicMock(path="uploads/u/audio_files/a"), "u"
+    )
+
+    mock_db.collection.return_value.document.return_value.set.assert_called_once()
+    assert tracker._jobs == {}
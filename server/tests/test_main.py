@@ -1,35 +1,21 @@
+import gzip
 import pytest
 from fastapi.testclient import TestClient
 from httpx import AsyncClient
 from io import BytesIO
 from main import app, MAX_FILE_SIZE, MAX_DURATION_SECONDS
 from unittest.mock import patch, MagicMock
-import tempfile
 
 # Constants
 MB = 1024 * 1024  # 1 MB in bytes
 
 
-def mock_video_clip():
-    """Create a mock VideoFileClip"""
-    mock = MagicMock()
-    mock.__enter__ = MagicMock(return_value=mock)
-    mock.__exit__ = MagicMock(return_value=None)
-    return mock
-
-
 @pytest.fixture
 def mock_dependencies():
     """Mock all external dependencies"""
-    # Create VideoFileClip mock with context manager support
-    video_clip_mock = mock_video_clip()
-    video_clip_mock.duration = 119  # Default duration
-
-    # Create the patches
+    # Default duration returned by the header probe
     patches = [
-        patch("moviepy.editor.VideoFileClip", return_value=video_clip_mock),
-        patch("main.VideoFileClip", return_value=video_clip_mock),
-        patch("main.get_audio_duration", return_value=119),
+        patch("main.probe_duration", return_value=119),
     ]
 
     # Start all patches
@@ -65,7 +51,7 @@ def create_file_with_size(size_mb: float) -> BytesIO:
 async def test_case_1_valid_file(mock_dependencies):
     """Test Case 1: 499 MB, 1:59 - Should accept"""
     file = create_file_with_size(499)
-    mock_dependencies[0].return_value.duration = 119  # 1:59 in seconds
+    mock_dependencies[0].return_value = 119  # 1:59 in seconds
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         response = await ac.post(
@@ -87,7 +73,7 @@ async def test_case_1_valid_file(mock_dependencies):
 async def test_case_2_exceeds_duration(mock_dependencies):
     """Test Case 2: 500 MB, 2:01 - Should fail duration check"""
     file = create_file_with_size(500)
-    mock_dependencies[0].return_value.duration = 121  # 2:01 in seconds
+    mock_dependencies[0].return_value = 121  # 2:01 in seconds
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         response = await ac.post(
@@ -104,7 +90,7 @@ async def test_case_2_exceeds_duration(mock_dependencies):
 async def test_case_3_exceeds_size(mock_dependencies):
     """Test Case 3: 501 MB, 2:00 - Should fail size check"""
     file = create_file_with_size(501)
-    mock_dependencies[0].return_value.duration = 120  # 2:00 in seconds
+    mock_dependencies[0].return_value = 120  # 2:00 in seconds
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         response = await ac.post(
@@ -121,7 +107,7 @@ async def test_case_3_exceeds_size(mock_dependencies):
 async def test_case_4_exceeds_both(mock_dependencies):
     """Test Case 4: 501 MB, 2:01 - Should fail size check first"""
     file = create_file_with_size(501)
-    mock_dependencies[0].return_value.duration = 121  # 2:01 in seconds
+    mock_dependencies[0].return_value = 121  # 2:01 in seconds
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         response = await ac.post(
@@ -151,7 +137,7 @@ async def test_case_5_null_file():
 async def test_case_6_null_duration(mock_dependencies):
     """Test Case 6: 499 MB, Null duration - Should fail with required error"""
     file = create_file_with_size(499)
-    mock_dependencies[0].return_value.duration = None
+    mock_dependencies[0].return_value = None
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         response = await ac.post(
@@ -166,7 +152,7 @@ async def test_case_6_null_duration(mock_dependencies):
 @pytest.mark.asyncio
 async def test_case_7_null_size_and_duration(mock_dependencies):
     """Test Case 7: Null file and duration check"""
-    mock_dependencies[0].return_value.duration = None
+    mock_dependencies[0].return_value = None
 
     async with AsyncClient(app=app, base_url="http://test") as ac:
         response = await ac.post(
@@ -183,3 +169,286 @@ def test_root_endpoint(client):
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {"message": "Welcome to the Scribe API"}
+
+
+@pytest.mark.asyncio
+async def test_validate_media_file_stops_reading_past_size_limit():
+    """Oversized uploads are rejected without reading the rest of the stream"""
+    from fastapi import HTTPException, UploadFile
+    from starlette.datastructures import Headers
+    import main
+
+    file = create_file_with_size(8)
+    upload = UploadFile(
+        file=file,
+        filename="too_big.mp3",
+        headers=Headers({"content-type": "audio/mpeg"}),
+    )
+    read_sizes = []
+    original_read = upload.read
+
+    async def tracking_read(size=-1):
+        read_sizes.append(size)
+        return await original_read(size)
+
+    upload.read = tracking_read
+
+    with patch("main.subscription.is_pro_user", return_value=False), patch(
+        "main.MAX_FILE_SIZE", 2 * MB
+    ):
+        with pytest.raises(HTTPException) as exc_info:
+            await main.validate_media_file(upload, "test_user")
+
+    assert "size exceeds" in exc_info.value.detail
+    assert all(size == main.UPLOAD_CHUNK_SIZE for size in read_sizes)
+    assert len(read_sizes) == 3
+
+
+@pytest.mark.asyncio
+async def test_multipart_initiate_rejects_declared_oversize():
+    """Direct uploads over the tier limit get no part URLs"""
+    with patch("main.subscription.is_pro_user", return_value=False), patch(
+        "main.create_multipart_upload"
+    ) as create_upload:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(
+                "/uploads/multipart/initiate",
+                json={
+                    "user_id": "test_user",
+                    "filename": "big.mp4",
+                    "content_type": "video/mp4",
+                    "file_size": MAX_FILE_SIZE + 1,
+                },
+            )
+
+    assert response.status_code == 400
+    assert "size exceeds" in response.json()["detail"]
+    create_upload.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_multipart_complete_rejects_other_users_key():
+    """Users can only complete uploads under their own S3 prefix"""
+    with patch("main.complete_multipart_upload") as complete_upload:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(
+                "/uploads/multipart/complete",
+                json={
+                    "user_id": "test_user",
+                    "key": "other_user/video/abc_clip.mp4",
+                    "upload_id": "upload-1",
+                    "filename": "clip.mp4",
+                    "content_type": "video/mp4",
+                    "parts": [{"part_number": 1, "etag": '"etag-1"'}],
+                },
+            )
+
+    assert response.status_code == 403
+    complete_upload.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_transcription_status_is_answered_from_firestore():
+    """The status endpoint returns the stored status without calling AWS"""
+    doc = MagicMock()
+    doc.exists = True
+    doc.to_dict.return_value = {
+        "transcription_job_name": "transcribe_123",
+        "transcription_status": "COMPLETED",
+        "transcript_uri": "https://transcripts/123.json",
+        "job_registered": True,
+    }
+
+    with patch("main.find_upload_doc", return_value=doc), patch(
+        "main.get_transcription_job_status"
+    ) as aws_status:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get("/transcription-status/test_user/doc123")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "status": "COMPLETED",
+        "job_name": "transcribe_123",
+        "transcript_uri": "https://transcripts/123.json",
+    }
+    aws_status.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_transcription_pages_are_served_from_the_compact_copy():
+    """A time window returns one page of words and a cursor for the next"""
+    from transcript_format import CompactTranscript, encode_transcript
+
+    items = [
+        {
+            "start_time": str(i),
+            "end_time": str(i + 0.5),
+            "alternatives": [{"confidence": "0.9", "content": f"w{i}"}],
+            "type": "pronunciation",
+        }
+        for i in range(100)
+    ]
+    transcript = CompactTranscript(encode_transcript({"results": {"items": items}}))
+    doc = MagicMock()
+    doc.exists = True
+    doc.to_dict.return_value = {"transcript_uri": "https://transcripts/123.json"}
+
+    with patch("main.find_upload_doc", return_value=doc), patch(
+        "main.load_compact_transcript", return_value=transcript
+    ), patch("main.load_transcript") as load_full:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get(
+                "/transcription/test_user/doc123",
+                params={"start_s": 10, "end_s": 60, "page_size": 20},
+            )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [w["content"] for w in body["words"]][:2] == ["w10", "w11"]
+    assert len(body["words"]) == 20
+    assert body["next_cursor"] == 30
+    assert body["total_words"] == 100
+    load_full.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "params", [{"start_s": 60, "end_s": 10}, {"start_s": -5}, {"end_s": -1}]
+)
+async def test_transcription_rejects_invalid_time_windows(params):
+    """A reversed or negative time window is a 400, not an empty page"""
+    with patch("main.find_upload_doc") as find:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get("/transcription/test_user/doc123", params=params)
+
+    assert response.status_code == 400
+    find.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_transcription_is_served_precompressed_and_revalidated():
+    """Stored transcripts are sent pre-compressed and answered with 304 once seen"""
+    doc = MagicMock()
+    doc.exists = True
+    doc.to_dict.return_value = {
+        "transcript_uri": "https://transcripts/123.json",
+        "transcript_hash": "a" * 64,
+    }
+
+    with patch("main.find_upload_doc", return_value=doc), patch(
+        "main.load_transcript", return_value=("a" * 64, gzip.compress(b"{}"))
+    ) as load:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get(
+                "/transcription/test_user/doc123",
+                headers={"Accept-Encoding": "gzip"},
+            )
+            repeat = await ac.get(
+                "/transcription/test_user/doc123",
+                headers={
+                    "Accept-Encoding": "gzip",
+                    "If-None-Match": response.headers["etag"],
+                },
+            )
+
+    assert load.call_args.args[2] == "gzip"
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == f'"{"a" * 64}-gzip"'
+    assert response.json() == {}
+    assert repeat.status_code == 304
+    load.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_media_url_refresh_by_key_needs_no_firestore():
+    """Refreshing by S3 key signs from the cache without touching Firestore"""
+    entry = {"url": "https://signed/url", "expires_at": 2000}
+
+    with patch("main.presigned_url", return_value=entry), patch(
+        "main.find_upload_doc"
+    ) as find_doc:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(
+                "/update-media-url",
+                json={"user_id": "test_user", "s3_key": "test_user/video/1_a.mp4"},
+            )
+            foreign = await ac.post(
+                "/update-media-url",
+                json={"user_id": "test_user", "s3_key": "other/video/1_a.mp4"},
+            )
+
+    assert response.status_code == 200
+    assert response.json()["new_file_url"] == "https://signed/url"
+    assert foreign.status_code == 403
+    find_doc.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_media_urls_are_refreshed_in_one_batch():
+    """Document IDs are resolved in one batch and missing ones reported"""
+    doc = MagicMock()
+    doc.to_dict.return_value = {"s3_key": "test_user/audio/1_a.mp3"}
+    urls = {
+        "test_user/audio/1_a.mp3": {"url": "https://signed/a", "expires_at": 1},
+        "test_user/video/2_b.mp4": {"url": "https://signed/b", "expires_at": 1},
+    }
+
+    with patch(
+        "main.upload_locator.find_many", return_value={"doc1": doc}
+    ) as find_many, patch("main.presigned_urls", return_value=urls) as sign:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.post(
+                "/media-urls",
+                json={
+                    "user_id": "test_user",
+                    "s3_keys": ["test_user/video/2_b.mp4"],
+                    "doc_ids": ["doc1", "gone"],
+                },
+            )
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["urls"]["test_user/video/2_b.mp4"]["url"] == "https://signed/b"
+    assert body["docs"]["doc1"]["url"] == "https://signed/a"
+    assert body["missing"] == ["gone"]
+    find_many.assert_called_once()
+    sign.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_uploads_listing_signs_urls_in_one_batch():
+    """A library page lists projected uploads with fresh URLs and a cursor"""
+    doc = MagicMock()
+    doc.id = "doc1"
+    doc.reference.parent.id = "video_files"
+    doc.to_dict.return_value = {
+        "filename": "1_a.mp4",
+        "s3_key": "test_user/video/1_a.mp4",
+        "file_url": "https://old/url",
+    }
+    urls = {"test_user/video/1_a.mp4": {"url": "https://signed/a", "expires_at": 9}}
+
+    with patch("main.list_uploads", return_value=([doc], "next")) as list_page, patch(
+        "main.presigned_urls", return_value=urls
+    ) as sign:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get("/uploads/test_user", params={"page_size": 1})
+            invalid = await ac.get("/uploads/test_user", params={"media_type": "pdf"})
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "uploads": [
+            {
+                "id": "doc1",
+                "filename": "1_a.mp4",
+                "media_type": "video",
+                "s3_key": "test_user/video/1_a.mp4",
+                "file_url": "https://signed/a",
+                "url_expires_at": 9,
+            }
+        ],
+        "next_cursor": "next",
+    }
+    assert list_page.call_args.args[1] == ["audio_files", "video_files"]
+    sign.assert_called_once()
+    assert invalid.status_code == 422
@@ -0,0 +1,151 @@
+import pytest
+import struct
+import subprocess
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+from media_probe import probe_duration
+
+
+def mp4_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def build_mp4(timescale: int, duration: int, version: int = 0) -> bytes:
+    """Build a minimal MP4 with the media data ahead of the movie header"""
+    if version == 1:
+        mvhd = bytes([1, 0, 0, 0]) + struct.pack(">QQIQ", 0, 0, timescale, duration)
+    else:
+        mvhd = bytes(4) + struct.pack(">IIII", 0, 0, timescale, duration)
+    return (
+        mp4_box(b"ftyp", b"isom" + bytes(4))
+        + mp4_box(b"mdat", bytes(4096))
+        + mp4_box(b"moov", mp4_box(b"mvhd", mvhd + bytes(80)))
+    )
+
+
+def ebml_element(element_id: int, payload: bytes) -> bytes:
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    size = (1 << 56) | len(payload)  # 8-byte size vint
+    return id_bytes + size.to_bytes(8, "big") + payload
+
+
+def build_matroska(duration_ticks: float, timecode_scale: int = 1_000_000) -> bytes:
+    info = ebml_element(0x2AD7B1, timecode_scale.to_bytes(3, "big")) + ebml_element(
+        0x4489, struct.pack(">d", duration_ticks)
+    )
+    segment = ebml_element(0x1549A966, info) + ebml_element(0x1F43B675, bytes(64))
+    return ebml_element(0x1A45DFA3, b"\x42\x82\x84webm") + ebml_element(
+        0x18538067, segment
+    )
+
+
+def build_wav(seconds: float, sample_rate: int = 16000) -> bytes:
+    byte_rate = sample_rate * 2
+    data = bytes(int(seconds * byte_rate))
+    fmt = struct.pack("<HHIIHH", 1, 1, sample_rate, byte_rate, 2, 16)
+    body = (
+        b"WAVE"
+        + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+        + b"data" + struct.pack("<I", len(data)) + data
+    )
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+@pytest.mark.parametrize("version", [0, 1])
+def test_probe_mp4_reads_movie_header(version):
+    """The mvhd duration is found even when moov comes after mdat"""
+    data = build_mp4(timescale=1000, duration=90500, version=version)
+    assert probe_duration(BytesIO(data)) == pytest.approx(90.5)
+
+
+def build_fragmented_mp4(timescale: int, fragment_duration: int = None) -> bytes:
+    """Build a fragmented MP4: an empty moov with a zero mvhd duration"""
+    mvhd = bytes(4) + struct.pack(">IIII", 0, 0, timescale, 0) + bytes(80)
+    moov = mp4_box(b"mvhd", mvhd)
+    if fragment_duration is not None:
+        mehd = bytes(4) + struct.pack(">I", fragment_duration)
+        moov += mp4_box(b"mvex", mp4_box(b"mehd", mehd))
+    return (
+        mp4_box(b"ftyp", b"isom" + bytes(4))
+        + mp4_box(b"moov", moov)
+        + mp4_box(b"moof", bytes(64))
+        + mp4_box(b"mdat", bytes(4096))
+    )
+
+
+def test_probe_fragmented_mp4_reads_movie_extends_header():
+    data = build_fragmented_mp4(timescale=1000, fragment_duration=300080)
+    assert probe_duration(BytesIO(data)) == pytest.approx(300.08)
+
+
+def test_probe_empty_moov_is_not_zero_seconds():
+    """Without mehd, a fragmented MP4 goes to the fallback rather than passing as 0 s"""
+    data = build_fragmented_mp4(timescale=1000)
+    with patch("media_probe._probe_ffprobe", return_value=300.08) as ffprobe:
+        assert probe_duration(BytesIO(data), "clip.mp4") == pytest.approx(300.08)
+    ffprobe.assert_called_once()
+
+
+def test_probe_matroska_applies_timecode_scale():
+    data = build_matroska(duration_ticks=125000.0)
+    assert probe_duration(BytesIO(data)) == pytest.approx(125.0)
+
+
+def test_probe_wav_uses_byte_rate():
+    data = build_wav(seconds=3.0)
+    assert probe_duration(BytesIO(data)) == pytest.approx(3.0)
+
+
+def test_probe_accepts_a_path(tmp_path):
+    media = tmp_path / "clip.mov"
+    media.write_bytes(build_mp4(timescale=600, duration=600 * 42))
+    assert probe_duration(str(media)) == pytest.approx(42.0)
+
+
+def test_probe_restores_file_position():
+    f = BytesIO(build_wav(seconds=1.0))
+    f.seek(100)
+    probe_duration(f)
+    assert f.tell() == 0
+
+
+def test_probe_unknown_container_falls_back_to_ffprobe():
+    with patch("media_probe._probe_ffprobe", return_value=12.0) as ffprobe:
+        assert probe_duration(BytesIO(b"not a media file" * 10), "x.bin") == 12.0
+    ffprobe.assert_called_once()
+
+
+def test_probe_unknown_container_with_url_runs_ffprobe_on_it():
+    source = BytesIO(b"not a media file" * 10)
+    result = MagicMock(stdout=b'{"format": {"duration": "7.5"}}')
+
+    with patch("media_probe.shutil.which", return_value="/usr/bin/ffprobe"), patch(
+        "media_probe.subprocess.run", return_value=result
+    ) as run, patch("media_probe.shutil.copyfileobj") as copy:
+        duration = probe_duration(source, "x.bin", url="https://bucket/x.bin?sig")
+
+    assert duration == 7.5
+    assert run.call_args.args[0][-1] == "https://bucket/x.bin?sig"
+    copy.assert_not_called()
+
+
+def test_probe_unknown_container_without_ffprobe_raises():
+    with patch("media_probe.shutil.which", return_value=None):
+        with pytest.raises(ValueError, match="Could not determine media duration"):
+            probe_duration(BytesIO(b"not a media file" * 10), "x.bin")
+
+
+def test_probe_falls_back_to_bundled_ffmpeg_without_ffprobe(tmp_path):
+    """Containers the parsers miss are probed with imageio-ffmpeg's binary"""
+    imageio_ffmpeg = pytest.importorskip("imageio_ffmpeg")
+    ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+    path = tmp_path / "clip.avi"
+    subprocess.run(
+        [ffmpeg, "-loglevel", "error", "-f", "lavfi", "-i", "anullsrc=r=8000:cl=mono",
+         "-t", "3", "-c:a", "pcm_s16le", str(path)],
+        check=True,
+    )
+
+    with patch("media_probe.shutil.which", return_value=None):
+        with open(path, "rb") as f:
+            assert probe_duration(BytesIO(f.read()), "clip.avi") == pytest.approx(3, abs=0.1)
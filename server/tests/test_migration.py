@@ -0,0 +1,204 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+import migration
+from lease import claim_lease
+from migration import SubscriptionMigration, migrate_user_subscriptions
+
+
+class FakeQuery:
+    def __init__(self, db, name, start_after=None, limit=None):
+        self.db, self.name = db, name
+        self._start_after, self._limit = start_after, limit
+
+    def order_by(self, field):
+        return self
+
+    def select(self, fields):
+        return self
+
+    def limit(self, count):
+        return FakeQuery(self.db, self.name, self._start_after, count)
+
+    def start_after(self, fields):
+        return FakeQuery(self.db, self.name, fields["__name__"], self._limit)
+
+    def stream(self):
+        self.db.queries += 1
+        ids = sorted(self.db.collections[self.name])
+        if self._start_after is not None:
+            ids = [i for i in ids if i > self._start_after]
+        return [SimpleNamespace(id=i) for i in ids[: self._limit]]
+
+
+class FakeDoc:
+    def __init__(self, db, collection, id):
+        self.db, self.collection, self.id = db, collection, id
+
+    def get(self):
+        data = self.db.collections[self.collection].get(self.id)
+        return SimpleNamespace(
+            id=self.id, exists=data is not None, to_dict=lambda: dict(data or {})
+        )
+
+    def set(self, data):
+        self.db.collections[self.collection][self.id] = dict(data)
+
+
+class FakeCollection(FakeQuery):
+    def document(self, id):
+        return FakeDoc(self.db, self.name, id)
+
+    def list_documents(self, page_size=None):
+        return [FakeDoc(self.db, self.name, i) for i in sorted(self.db.collections[self.name])]
+
+
+class FakeBulkWriter:
+    def __init__(self, db):
+        self.db, self.pending = db, []
+
+    def on_write_result(self, callback):
+        self.result_callback = callback
+
+    def on_write_error(self, callback):
+        self.error_callback = callback
+
+    def create(self, ref, data):
+        self.pending.append((ref, data))
+
+    def flush(self):
+        for ref, data in self.pending:
+            if ref.id in self.db.fail_ids:
+                self.db.fail_ids.discard(ref.id)
+                raise RuntimeError("write failed")
+            ref.set(data)
+            self.result_callback(ref, None, self)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+
+
+class FakeDb:
+    def __init__(self, users, uploads, subscriptions):
+        self.collections = {
+            "users": dict.fromkeys(users, {}),
+            "uploads": dict.fromkeys(uploads, {}),
+            "subscriptions": {i: {"tier": "pro"} for i in subscriptions},
+            "migrations": {},
+        }
+        self.queries = 0
+        self.get_all_calls = 0
+        self.fail_ids = set()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def get_all(self, refs, field_paths=None):
+        self.get_all_calls += 1
+        return [ref.get() for ref in refs]
+
+    def bulk_writer(self, options=None):
+        return FakeBulkWriter(self)
+
+
+@pytest.fixture
+def fake_db():
+    users = [f"user{i:03d}" for i in range(250)]
+    db = FakeDb(users, users[200:] + ["upload_only"], users[:50])
+    with patch("migration.db", db):
+        yield db
+
+
+@pytest.mark.asyncio
+async def test_creates_missing_records_only(fake_db):
+    progress = await migrate_user_subscriptions(page_size=100, concurrency=2)
+
+    subscriptions = fake_db.collections["subscriptions"]
+    assert len(subscriptions) == 251
+    assert subscriptions["user000"] == {"tier": "pro"}
+    assert subscriptions["upload_only"]["tier"] == "free"
+    assert progress["status"] == "completed"
+    assert progress["created"] == 201
+    assert progress["scanned"] == 301
+    # 3 pages of users and 1 of uploads, each checked with one get_all
+    assert fake_db.queries == 3
+    assert fake_db.get_all_calls == 4
+
+
+def test_interrupted_run_resumes_from_checkpoint(fake_db):
+    fake_db.fail_ids.add("user150")
+    with pytest.raises(RuntimeError):
+        SubscriptionMigration(page_size=100).run()
+
+    checkpoint = fake_db.collections["migrations"]["user_subscriptions"]
+    assert checkpoint["status"] == "failed"
+    assert checkpoint["last_id"] == "user099"
+
+    progress = SubscriptionMigration(page_size=100).run()
+    assert progress.status == "completed"
+    assert len(fake_db.collections["subscriptions"]) == 251
+    assert fake_db.queries == 2 + 2
+
+
+def test_already_existing_records_are_not_retried(fake_db):
+    run = SubscriptionMigration()
+    failure = SimpleNamespace(code=migration.ALREADY_EXISTS, attempts=1, message="")
+
+    assert run._on_write_error(failure, None) is False
+    assert run.progress.existing == 1
+    assert run._on_write_error(SimpleNamespace(code=14, attempts=1, message=""), None)
+
+
+def test_lease_is_exclusive_until_it_expires():
+    lease = claim_lease(None, "a", now=100, duration=60)
+    assert lease == {"holder": "a", "expires_at": 160, "renewed_at": 100}
+
+    assert claim_lease(lease, "b", now=150, duration=60) is None
+    assert claim_lease(lease, "a", now=150, duration=60)["expires_at"] == 210
+    assert claim_lease(lease, "b", now=161, duration=60)["holder"] == "b"
+
+
+class FakeLease:
+    def __init__(self, granted):
+        self.granted = granted
+        self.holder = "replica"
+        self.duration = 0.03
+        self.released = False
+
+    def acquire(self):
+        return self.granted
+
+    def release(self):
+        self.released = True
+
+
+@pytest.mark.asyncio
+async def test_leader_runs_the_migration_in_the_background(fake_db):
+    supervisor = migration.MigrationSupervisor(FakeLease(True), page_size=100)
+
+    supervisor.start()
+    await asyncio.wait_for(supervisor._task, 5)
+
+    assert supervisor.role == "done"
+    assert supervisor.lease.released
+    assert len(fake_db.collections["subscriptions"]) == 251
+    status = await supervisor.status()
+    assert status["progress"]["status"] == "completed"
+    assert status["progress"]["scanned"] == 301
+
+
+@pytest.mark.asyncio
+async def test_standby_waits_for_the_leader(fake_db):
+    supervisor = migration.MigrationSupervisor(FakeLease(False))
+
+    supervisor.start()
+    await asyncio.sleep(0.05)
+    assert supervisor.role == "standby"
+    assert len(fake_db.collections["subscriptions"]) == 50
+
+    # The leader elsewhere finishes
+    fake_db.collections["migrations"]["user_subscriptions"] = {"status": "completed"}
+    await asyncio.wait_for(supervisor._task, 5)
+    assert supervisor.role == "done"
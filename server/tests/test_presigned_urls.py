@@ -0,0 +1,50 @@
+from unittest.mock import patch
+import pytest
+import presigned_urls
+from presigned_urls import PresignedUrlCache, s3_key_from_url
+
+
+@pytest.fixture
+def signer():
+    with patch(
+        "presigned_urls.aws_service.generate_presigned_url",
+        side_effect=lambda key, expiration: f"https://signed/{key}",
+    ) as generate:
+        yield generate
+
+
+def test_urls_are_reused_until_close_to_expiry(signer):
+    cache = PresignedUrlCache(expiration=3600, refresh_margin=300)
+
+    with patch("presigned_urls.time.time", return_value=1000):
+        first = cache.get("user/audio/a.mp3")
+    with patch("presigned_urls.time.time", return_value=1000 + 3299):
+        assert cache.get("user/audio/a.mp3") == first
+    assert signer.call_count == 1
+
+    with patch("presigned_urls.time.time", return_value=1000 + 3300):
+        renewed = cache.get("user/audio/a.mp3")
+    assert signer.call_count == 2
+    assert renewed["expires_at"] == 1000 + 3300 + 3600
+
+
+def test_batch_signs_each_key_once(signer):
+    cache = PresignedUrlCache()
+    urls = cache.get_many(["user/audio/a.mp3", "user/video/b.mp4", "user/audio/a.mp3"])
+
+    assert set(urls) == {"user/audio/a.mp3", "user/video/b.mp4"}
+    assert signer.call_count == 2
+
+
+def test_recovers_key_from_old_urls():
+    with patch.object(presigned_urls.aws_service, "S3_BUCKET_NAME", "media"):
+        assert (
+            s3_key_from_url(
+                "https://media.s3.amazonaws.com/user/audio/1_my%20file.mp3?Expires=1"
+            )
+            == "user/audio/1_my file.mp3"
+        )
+        assert (
+            s3_key_from_url("https://s3.us-east-1.amazonaws.com/media/user/video/2.mp4")
+            == "user/video/2.mp4"
+        )
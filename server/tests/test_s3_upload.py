@@ -0,0 +1,99 @@
+import pytest
+import threading
+from io import BytesIO
+from botocore.exceptions import ClientError
+from s3_upload import S3UploadEngine, get_upload_progress
+
+KB = 1024
+
+
+class FakeS3Client:
+    """In-memory stand-in for the boto3 S3 client calls used by the engine"""
+
+    def __init__(self, failing_parts=None):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.failing_parts = dict(failing_parts or {})
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = Body
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.uploads["upload-1"] = {}
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self.lock:
+            if self.failing_parts.get(PartNumber, 0) > 0:
+                self.failing_parts[PartNumber] -= 1
+                raise ClientError(
+                    {"Error": {"Code": "SlowDown", "Message": "Slow down"}}, "UploadPart"
+                )
+            self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        self.objects[Key] = b"".join(parts[number] for number in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+
+
+def make_engine(client, **kwargs):
+    options = {
+        "multipart_threshold": 64 * KB,
+        "part_size": 16 * KB,
+        "max_workers": 3,
+        "max_attempts": 3,
+        "retry_backoff": 0,
+    }
+    options.update(kwargs)
+    return S3UploadEngine(client, "bucket", **options)
+
+
+def test_small_upload_uses_single_put():
+    client = FakeS3Client()
+    data = b"a" * (10 * KB)
+
+    progress = make_engine(client).upload(BytesIO(data), "user/audio/a.mp3", "audio/mpeg")
+
+    assert client.objects["user/audio/a.mp3"] == data
+    assert progress.parts_completed == 1
+    assert progress.bytes_sent == len(data)
+    assert progress.status == "COMPLETED"
+
+
+def test_large_upload_is_split_into_ordered_parts():
+    client = FakeS3Client()
+    data = bytes(range(256)) * (1000)  # 250 KB, 16 parts
+
+    progress = make_engine(client).upload(BytesIO(data), "user/video/v.mp4", "video/mp4")
+
+    assert client.objects["user/video/v.mp4"] == data
+    assert progress.parts_completed == 16
+    assert progress.bytes_per_second > 0
+    assert get_upload_progress("user/video/v.mp4") is None
+
+
+def test_failed_part_is_retried():
+    client = FakeS3Client(failing_parts={2: 2})
+    data = b"b" * (100 * KB)
+
+    progress = make_engine(client).upload(BytesIO(data), "key", "video/mp4")
+
+    assert client.objects["key"] == data
+    assert progress.part_retries == 2
+
+
+def test_part_exhausting_retries_aborts_upload():
+    client = FakeS3Client(failing_parts={3: 5})
+
+    with pytest.raises(ClientError):
+        make_engine(client).upload(BytesIO(b"c" * (100 * KB)), "key", "video/mp4")
+
+    assert client.aborted == ["upload-1"]
+    assert "key" not in client.objects
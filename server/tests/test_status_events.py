@@ -0,0 +1,128 @@
+import asyncio
+import pytest
+import threading
+from unittest.mock import MagicMock, patch
+from httpx import AsyncClient, ASGITransport
+from main import app
+from status_events import StatusWatcher, watcher
+
+
+class FakeDocRef:
+    """Upload document reference whose snapshot listener is driven by the test"""
+
+    def __init__(self, path="uploads/user123/audio_files/doc123"):
+        self.path = path
+        self.callbacks = []
+        self.listener = MagicMock()
+
+    def on_snapshot(self, callback):
+        self.callbacks.append(callback)
+        return self.listener
+
+    def push(self, data):
+        snapshot = MagicMock()
+        snapshot.exists = True
+        snapshot.to_dict.return_value = data
+        # Firestore calls listeners from its own thread
+        thread = threading.Thread(
+            target=lambda: [callback([snapshot], [], None) for callback in self.callbacks]
+        )
+        thread.start()
+        thread.join()
+
+
+def make_doc(doc_ref, data):
+    doc = MagicMock()
+    doc.exists = True
+    doc.reference = doc_ref
+    doc.to_dict.return_value = data
+    return doc
+
+
+@pytest.mark.asyncio
+async def test_one_listener_fans_out_to_every_subscriber():
+    watcher = StatusWatcher()
+    doc_ref = FakeDocRef()
+
+    first = watcher.subscribe(doc_ref)
+    second = watcher.subscribe(doc_ref)
+    doc_ref.push({"transcription_status": "FAILED", "transcription_job_name": "job"})
+
+    assert len(doc_ref.callbacks) == 1
+    assert (await asyncio.wait_for(first.get(), 1))["status"] == "FAILED"
+    assert (await asyncio.wait_for(second.get(), 1))["status"] == "FAILED"
+
+    watcher.unsubscribe(doc_ref.path, first)
+    doc_ref.listener.unsubscribe.assert_not_called()
+    watcher.unsubscribe(doc_ref.path, second)
+    doc_ref.listener.unsubscribe.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_sse_stream_ends_when_transcription_completes():
+    doc_ref = FakeDocRef()
+    doc = make_doc(
+        doc_ref,
+        {"transcription_status": "IN_PROGRESS", "transcription_job_name": "job"},
+    )
+
+    async def complete_later():
+        while not doc_ref.callbacks:
+            await asyncio.sleep(0.01)
+        doc_ref.push(
+            {
+                "transcription_status": "COMPLETED",
+                "transcription_job_name": "job",
+                "transcript_uri": "https://transcripts/job.json",
+            }
+        )
+
+    with patch("status_events.find_upload_doc", return_value=doc):
+        completer = asyncio.create_task(complete_later())
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as ac:
+            response = await ac.get("/transcription-events/user123/doc123")
+        await completer
+
+    assert response.status_code == 200
+    events = [line for line in response.text.splitlines() if line.startswith("data: ")]
+    assert '"IN_PROGRESS"' in events[0]
+    assert '"COMPLETED"' in events[1]
+    assert len(events) == 2
+    doc_ref.listener.unsubscribe.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_websocket_client_leaving_releases_its_subscription():
+    doc_ref = FakeDocRef()
+    doc = make_doc(
+        doc_ref,
+        {"transcription_status": "IN_PROGRESS", "transcription_job_name": "job"},
+    )
+    incoming = asyncio.Queue()
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "websocket.send":
+            # The client leaves as soon as it has the first status
+            await incoming.put({"type": "websocket.disconnect", "code": 1001})
+
+    await incoming.put({"type": "websocket.connect"})
+    scope = {
+        "type": "websocket",
+        "path": "/ws/transcription-status/user123/doc123",
+        "raw_path": b"/ws/transcription-status/user123/doc123",
+        "query_string": b"",
+        "headers": [],
+        "subprotocols": [],
+    }
+
+    with patch("status_events.find_upload_doc", return_value=doc):
+        # Returns without any further status change
+        await asyncio.wait_for(app(scope, incoming.get, send), 1)
+
+    assert '"IN_PROGRESS"' in sent[1]["text"]
+    assert watcher.subscriber_count(doc_ref.path) == 0
+    doc_ref.listener.unsubscribe.assert_called_once()
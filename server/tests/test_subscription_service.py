@@ -0,0 +1,72 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import metrics
+import subscription_service as subscription
+from models import SubscriptionTier
+
+
+@pytest.fixture
+def subscriptions():
+    """Subscription collection backed by a dict, counting document reads"""
+    records = {"user123": {"user_id": "user123", "tier": "pro", "is_active": True}}
+    reads = []
+
+    def document(user_id):
+        doc_ref = MagicMock()
+
+        def get():
+            reads.append(user_id)
+            doc = MagicMock()
+            doc.exists = user_id in records
+            doc.to_dict.return_value = dict(records.get(user_id, {}))
+            return doc
+
+        doc_ref.get.side_effect = get
+        doc_ref.update.side_effect = lambda data: records[user_id].update(data)
+        return doc_ref
+
+    with patch("subscription_service.db") as mock_db:
+        mock_db.collection.return_value.document.side_effect = document
+        subscription.clear_subscription_cache()
+        metrics.reset()
+        yield {"records": records, "reads": reads}
+        subscription.clear_subscription_cache()
+
+
+@pytest.mark.asyncio
+async def test_repeat_tier_checks_hit_the_cache(subscriptions):
+    assert await subscription.is_pro_user("user123")
+    assert await subscription.is_pro_user("user123")
+
+    assert subscriptions["reads"] == ["user123"]
+    counters = metrics.snapshot()["counters"]
+    assert counters["subscription_cache.hits"] == 1
+    assert counters["subscription_cache.misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_update_invalidates_the_cached_record(subscriptions):
+    assert await subscription.is_pro_user("user123")
+
+    await subscription.update_user_subscription("user123", SubscriptionTier.FREE)
+
+    assert not await subscription.is_pro_user("user123")
+
+
+@pytest.mark.asyncio
+async def test_cached_records_cannot_be_mutated_by_callers(subscriptions):
+    record = await subscription.get_user_subscription("user123")
+    record["tier"] = "free"
+
+    assert await subscription.is_pro_user("user123")
+
+
+@pytest.mark.asyncio
+async def test_listener_drops_records_changed_elsewhere(subscriptions):
+    await subscription.get_user_subscription("user123")
+    change = MagicMock()
+    change.document.id = "user123"
+
+    subscription._on_subscriptions_changed([], [change], None)
+
+    assert subscription.get_cached_subscription("user123") is None
@@ -0,0 +1,154 @@
+import pytest
+from transcript_format import CompactTranscript, encode_transcript
+
+TRANSCRIPT = {
+    "results": {
+        "transcripts": [{"transcript": "Hello there. Hi."}],
+        "speaker_labels": {
+            "speakers": 2,
+            "segments": [
+                {
+                    "speaker_label": "spk_0",
+                    "items": [
+                        {"start_time": "0.0", "speaker_label": "spk_0"},
+                        {"start_time": "0.6", "speaker_label": "spk_0"},
+                    ],
+                },
+                {
+                    "speaker_label": "spk_1",
+                    "items": [{"start_time": "2.5", "speaker_label": "spk_1"}],
+                },
+            ],
+        },
+        "items": [
+            {
+                "start_time": "0.0",
+                "end_time": "0.5",
+                "alternatives": [{"confidence": "0.99", "content": "Hello"}],
+                "type": "pronunciation",
+            },
+            {
+                "start_time": "0.6",
+                "end_time": "1.1",
+                "alternatives": [{"confidence": "0.87", "content": "there"}],
+                "type": "pronunciation",
+            },
+            {
+                "alternatives": [{"confidence": "0.0", "content": "."}],
+                "type": "punctuation",
+            },
+            {
+                "start_time": "2.5",
+                "end_time": "2.9",
+                "alternatives": [{"confidence": "0.95", "content": "Hi"}],
+                "type": "pronunciation",
+            },
+            {
+                "alternatives": [{"confidence": "0.0", "content": "."}],
+                "type": "punctuation",
+            },
+        ],
+    }
+}
+
+
+def test_round_trips_words_speakers_and_text():
+    transcript = CompactTranscript(encode_transcript(TRANSCRIPT))
+
+    assert len(transcript) == 5
+    assert transcript.text == "Hello there. Hi."
+    assert transcript.speaker_labels == ["spk_0", "spk_1"]
+    assert transcript.duration_seconds == 2.9
+
+    words = transcript.words(0, 5)
+    assert [w["content"] for w in words] == ["Hello", "there", ".", "Hi", "."]
+    assert words[1] == {
+        "index": 1,
+        "content": "there",
+        "start_time": 0.6,
+        "end_time": 1.1,
+        "confidence": 0.87,
+        "speaker_label": "spk_0",
+        "type": "pronunciation",
+    }
+    # Punctuation is pinned to the word before it
+    assert words[2]["start_time"] == words[2]["end_time"] == 1.1
+    assert words[2]["type"] == "punctuation"
+    assert words[3]["speaker_label"] == "spk_1"
+
+
+def test_time_range_decodes_only_matching_words():
+    transcript = CompactTranscript(encode_transcript(TRANSCRIPT))
+
+    assert [w["content"] for w in transcript.words_between(0.5, 2.5)] == ["there", "."]
+    assert [w["index"] for w in transcript.words_between(2.5)] == [3, 4]
+    assert transcript.words_between(10, 20) == []
+
+
+def test_repeated_words_share_one_string_entry():
+    items = [
+        {
+            "start_time": str(i),
+            "end_time": str(i + 0.5),
+            "alternatives": [{"confidence": "1.0", "content": "la"}],
+            "type": "pronunciation",
+        }
+        for i in range(1000)
+    ]
+    data = encode_transcript({"results": {"items": items}})
+
+    assert data.count(b"la") == 1
+    assert CompactTranscript(data).words(999, 1000)[0]["start_time"] == 999
+
+
+def test_memory_mapped_file(tmp_path):
+    path = tmp_path / "transcript.bin"
+    path.write_bytes(encode_transcript(TRANSCRIPT))
+
+    transcript = CompactTranscript.open(str(path))
+    assert transcript.words_between(2.0, 3.0)[0]["content"] == "Hi"
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        CompactTranscript(b"{}" * 100)
+
+
+def test_window_includes_words_still_running_at_its_start():
+    items = [
+        {"start_time": "0.0", "end_time": "5.0", "alternatives": [{"content": "long"}]},
+        {"start_time": "1.0", "end_time": "1.5", "alternatives": [{"content": "a"}]},
+        {"start_time": "3.0", "end_time": "3.5", "alternatives": [{"content": "b"}]},
+    ]
+    transcript = CompactTranscript(encode_transcript({"results": {"items": items}}))
+
+    assert [w["content"] for w in transcript.words_between(4.0, 10)] == [
+        "long",
+        "a",
+        "b",
+    ]
+    assert [w["content"] for w in transcript.words_between(5.0)] == []
+
+
+def test_pages_walk_the_window_with_cursors():
+    items = [
+        {
+            "start_time": str(i),
+            "end_time": str(i + 0.5),
+            "alternatives": [{"content": f"w{i}"}],
+        }
+        for i in range(10)
+    ]
+    transcript = CompactTranscript(encode_transcript({"results": {"items": items}}))
+
+    page = transcript.page(start_s=2, end_s=7, page_size=3)
+    assert [w["content"] for w in page["words"]] == ["w2", "w3", "w4"]
+    assert page["next_cursor"] == 5
+    assert page["window_words"] == 5
+
+    page = transcript.page(start_s=2, end_s=7, cursor=page["next_cursor"], page_size=3)
+    assert [w["content"] for w in page["words"]] == ["w5", "w6"]
+    assert page["next_cursor"] is None
+
+    # A cursor outside the window is clamped to it
+    assert transcript.page(start_s=2, end_s=7, cursor=0, page_size=1)["cursor"] == 2
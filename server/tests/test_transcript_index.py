@@ -0,0 +1,110 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import transcript_index
+from context_builder import build_context
+from transcript_format import CompactTranscript, encode_transcript
+from transcript_index import (
+    TranscriptIndex,
+    chunk_text,
+    chunk_transcript,
+    format_passages,
+    retrieve_passages,
+)
+
+TOPICS = [
+    "The budget for the marketing campaign was approved by the board.",
+    "Our hiking trip to the mountains was delayed by heavy snow.",
+    "The new database migration reduced query latency considerably.",
+    "Lunch options near the office include tacos and ramen.",
+]
+
+
+def word(content, start, end, speaker):
+    return {
+        "start_time": str(start),
+        "end_time": str(end),
+        "speaker_label": speaker,
+        "alternatives": [{"confidence": "0.9", "content": content}],
+        "type": "pronunciation",
+    }
+
+
+def test_plain_text_is_split_into_bounded_passages():
+    text = " ".join(f"Sentence number {i} is here." for i in range(200))
+
+    chunks = chunk_text(text)
+
+    assert len(chunks) > 1
+    assert all(len(c["text"].split()) <= transcript_index.CHUNK_MAX_WORDS for c in chunks)
+    assert " ".join(c["text"] for c in chunks) == text
+    assert chunks[0]["start_ms"] == -1
+
+
+def test_timed_transcript_is_split_by_speaker_with_times():
+    items = [
+        word("Hello", 0.0, 0.4, "spk_0"),
+        {"alternatives": [{"confidence": "0", "content": ","}], "type": "punctuation"},
+        word("there", 0.5, 0.9, "spk_0"),
+        word("Hi", 61.0, 61.5, "spk_1"),
+    ]
+    transcript = CompactTranscript(
+        encode_transcript({"results": {"items": items, "transcripts": []}})
+    )
+
+    chunks = chunk_transcript(transcript)
+
+    assert [c["text"] for c in chunks] == ["Hello, there", "Hi"]
+    assert chunks[0]["speaker"] == "spk_0"
+    assert (chunks[1]["start_ms"], chunks[1]["end_ms"]) == (61000, 61500)
+
+
+def test_search_ranks_matching_passages_and_survives_a_round_trip():
+    chunks = [{"text": t, "start_ms": i * 60000, "end_ms": i * 60000 + 5000, "speaker": "spk_0"}
+              for i, t in enumerate(TOPICS)]
+    index = TranscriptIndex.from_bytes(TranscriptIndex.build(chunks).to_bytes())
+
+    passages = index.search("What happened with the database latency?", k=1)
+
+    assert [p["index"] for p in passages] == [2]
+    assert passages[0]["speaker"] == "spk_0"
+    assert format_passages(passages).startswith("[00:02:00-00:02:05] spk_0\n")
+
+
+def test_unmatched_questions_get_passages_from_across_the_text():
+    index = TranscriptIndex.build(chunk_text(" ".join(TOPICS * 100)))
+
+    passages = index.search("Summarize this for me", k=3)
+
+    assert len(passages) == 3
+    assert passages[0]["index"] == 0
+    assert passages[-1]["index"] == index.chunk_count - 1
+
+
+@pytest.mark.asyncio
+async def test_long_texts_without_an_index_are_indexed_on_first_question():
+    text = " ".join(TOPICS * 400)
+    ai_text_ref = MagicMock()
+    stored = {}
+
+    with patch.object(transcript_index, "AI_RETRIEVAL_MIN_TOKENS", 1000), patch(
+        "transcript_index.store"
+    ) as store, patch.dict(transcript_index._loaded, clear=True):
+        store.put.side_effect = lambda digest, data, *args: stored.update({digest: data})
+        passages = await retrieve_passages(
+            ai_text_ref, {"text": text}, "Where did the hiking trip go?"
+        )
+
+    digest = ai_text_ref.update.call_args.args[0]["index_hash"]
+    assert digest in stored
+    assert "mountains" in passages[0]["text"]
+
+    context = build_context(
+        text, None, [], "Where did the hiking trip go?", passages=format_passages(passages)
+    )
+    assert text not in context["system"][1]["text"]
+    assert "mountains" in context["messages"][-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_short_texts_are_sent_in_full():
+    assert await retrieve_passages(MagicMock(), {"text": TOPICS[0]}, "Budget?") is None
@@ -0,0 +1,107 @@
+import gzip
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+import metrics
+from transcript_store import TranscriptStore, content_hash, load_transcript
+
+TRANSCRIPT = json.dumps({"results": {"transcripts": [{"transcript": "Hello"}]}}).encode()
+
+
+@pytest.fixture
+def fake_s3():
+    """Replace the S3 calls used by the store with an in-memory bucket"""
+    bucket = {}
+    with patch(
+        "transcript_store.aws_service.put_bytes_to_s3",
+        side_effect=lambda key, data, content_type: bucket.__setitem__(key, data),
+    ), patch(
+        "transcript_store.aws_service.get_bytes_from_s3", side_effect=bucket.get
+    ), patch(
+        "transcript_store.aws_service.download_transcription_result",
+        return_value=TRANSCRIPT,
+    ) as download:
+        metrics.reset()
+        yield {"bucket": bucket, "download": download}
+
+
+def test_fetch_stores_under_content_hash(fake_s3, tmp_path):
+    store = TranscriptStore(max_bytes=1024, cache_dir=str(tmp_path))
+
+    digest, data = store.fetch_and_store("https://aws/transcript.json")
+
+    assert digest == content_hash(TRANSCRIPT)
+    assert data == TRANSCRIPT
+    assert fake_s3["bucket"][f"transcripts/{digest}.json"] == TRANSCRIPT
+    assert (tmp_path / digest[:2] / f"{digest}.json").read_bytes() == TRANSCRIPT
+
+
+def test_reads_fall_through_tiers_and_count_hits(fake_s3, tmp_path):
+    digest, _ = TranscriptStore(cache_dir=str(tmp_path)).fetch_and_store("uri")
+
+    # A fresh process: empty memory, warm disk
+    store = TranscriptStore(cache_dir=str(tmp_path))
+    assert store.get(digest) == TRANSCRIPT
+    assert store.get(digest) == TRANSCRIPT
+
+    # Another replica without a disk tier reads our S3 copy
+    assert TranscriptStore(cache_dir=None).get(digest) == TRANSCRIPT
+    assert TranscriptStore(cache_dir=None).get("0" * 64) is None
+
+    counters = metrics.snapshot()["counters"]
+    assert counters["transcript_store.hits.disk"] == 1
+    assert counters["transcript_store.hits.memory"] == 1
+    assert counters["transcript_store.hits.s3"] == 1
+    assert counters["transcript_store.misses"] == 1
+
+
+def test_memory_tier_is_bounded_by_bytes(fake_s3):
+    store = TranscriptStore(max_bytes=len(TRANSCRIPT) + 10, cache_dir=None)
+    store.put("a" * 64, TRANSCRIPT)
+    store.put("b" * 64, TRANSCRIPT)
+
+    assert store.get_cached("a" * 64) is None
+    assert store.get_cached("b" * 64) == TRANSCRIPT
+    assert store.stats()["memory_bytes"] <= len(TRANSCRIPT) + 10
+
+
+@pytest.mark.asyncio
+async def test_load_transcript_records_hash_and_skips_aws_afterwards(fake_s3):
+    doc_ref = MagicMock()
+    doc_data = {"transcript_uri": "https://aws/transcript.json"}
+
+    with patch("transcript_store.store", TranscriptStore(cache_dir=None)):
+        digest, data = await load_transcript(doc_ref, doc_data)
+        doc_ref.update.assert_called_once_with({"transcript_hash": digest})
+
+        doc_data["transcript_hash"] = digest
+        assert await load_transcript(doc_ref, doc_data) == (digest, data)
+
+    fake_s3["download"].assert_called_once()
+
+
+def test_compact_variant_is_stored_and_built_for_older_transcripts(fake_s3, tmp_path):
+    store = TranscriptStore(cache_dir=str(tmp_path))
+    digest, _ = store.fetch_and_store("uri")
+    assert f"transcripts/{digest}.bin" in fake_s3["bucket"]
+    assert store.get_compact(digest).text == "Hello"
+
+    # Stored before the compact format existed: encoded from the JSON once
+    del fake_s3["bucket"][f"transcripts/{digest}.bin"]
+    store = TranscriptStore(cache_dir=None)
+    assert store.get_compact(digest).text == "Hello"
+    assert f"transcripts/{digest}.bin" in fake_s3["bucket"]
+    assert store.get_compact("0" * 64) is None
+
+
+def test_precompressed_variant_is_stored_once(fake_s3):
+    store = TranscriptStore(cache_dir=None)
+    digest, _ = store.fetch_and_store("uri")
+
+    encoded = store.get_encoded(digest, "gzip")
+    assert gzip.decompress(encoded) == TRANSCRIPT
+    assert fake_s3["bucket"][f"transcripts/{digest}.json.gz"] == encoded
+
+    # Missing variants of older transcripts are built from the JSON
+    del fake_s3["bucket"][f"transcripts/{digest}.json.gz"]
+    assert TranscriptStore(cache_dir=None).get_encoded(digest, "gzip") == encoded
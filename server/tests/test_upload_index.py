@@ -0,0 +1,142 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from upload_index import (
+    MEDIA_COLLECTIONS,
+    UploadLocator,
+    decode_cursor,
+    encode_cursor,
+    list_uploads,
+)
+
+
+def make_snapshot(collection, exists=True):
+    doc = MagicMock()
+    doc.exists = exists
+    doc.reference.parent.id = collection
+    return doc
+
+
+def test_unknown_upload_is_found_with_one_batched_read():
+    locator = UploadLocator()
+    with patch("upload_index.db") as db:
+        db.get_all.return_value = [
+            make_snapshot("audio_files", exists=False),
+            make_snapshot("video_files"),
+        ]
+
+        doc = locator.find("user123", "doc123")
+
+    assert doc.reference.parent.id == "video_files"
+    db.get_all.assert_called_once()
+    assert len(db.get_all.call_args.args[0]) == 2
+    assert locator.location("user123", "doc123") == "video_files"
+
+
+def test_known_upload_is_read_directly():
+    locator = UploadLocator()
+    locator.remember("user123", "doc123", "video_files")
+    with patch("upload_index.db") as db:
+        doc_ref = db.collection.return_value.document.return_value.collection.return_value.document.return_value
+        doc_ref.get.return_value = make_snapshot("video_files")
+
+        assert locator.find("user123", "doc123").exists
+
+    db.collection.return_value.document.return_value.collection.assert_called_once_with(
+        "video_files"
+    )
+    db.get_all.assert_not_called()
+
+
+def test_missing_upload_is_forgotten():
+    locator = UploadLocator()
+    locator.remember("user123", "doc123", "audio_files")
+    with patch("upload_index.db") as db:
+        doc_ref = db.collection.return_value.document.return_value.collection.return_value.document.return_value
+        doc_ref.get.return_value = make_snapshot("audio_files", exists=False)
+        db.get_all.return_value = [make_snapshot("audio_files", exists=False)] * 2
+
+        assert locator.find("user123", "doc123") is None
+
+    assert locator.location("user123", "doc123") is None
+
+
+class FakeUpload:
+    """Listed upload snapshot with an upload time and a parent collection"""
+
+    def __init__(self, collection, doc_id, timestamp):
+        self.id = doc_id
+        self.reference = MagicMock()
+        self.reference.parent.id = collection
+        self.data = {"upload_timestamp": timestamp, "filename": doc_id}
+
+    def get(self, field):
+        return self.data[field]
+
+
+@pytest.fixture
+def library():
+    """Three audio and two video uploads at alternating times"""
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    uploads = {
+        "audio_files": [
+            FakeUpload("audio_files", f"a{i}", start + timedelta(minutes=m))
+            for i, m in enumerate([1, 3, 5])
+        ],
+        "video_files": [
+            FakeUpload("video_files", f"v{i}", start + timedelta(minutes=m))
+            for i, m in enumerate([2, 4])
+        ],
+    }
+    queries = []
+
+    def list_collection(user_id, collection, page_size, after, descending):
+        queries.append(collection)
+        docs = sorted(
+            uploads[collection], key=lambda d: (d.get("upload_timestamp"), d.id),
+            reverse=descending,
+        )
+        if after:
+            position = (datetime.fromisoformat(after[0]), after[1])
+            docs = [
+                d for d in docs
+                if ((d.get("upload_timestamp"), d.id) < position) == descending
+                and (d.get("upload_timestamp"), d.id) != position
+            ]
+        return docs[:page_size]
+
+    with patch("upload_index._list_collection", side_effect=list_collection):
+        yield queries
+
+
+@pytest.mark.asyncio
+async def test_pages_merge_both_media_types_by_upload_time(library):
+    seen = []
+    cursor = None
+    while True:
+        docs, cursor = await list_uploads("user123", MEDIA_COLLECTIONS, 2, cursor)
+        seen.append([doc.id for doc in docs])
+        if cursor is None:
+            break
+
+    assert seen == [["a2", "v1"], ["a1", "v0"], ["a0"]]
+    # Collections read to the end aren't queried again
+    assert library.count("video_files") == 2
+    assert library.count("audio_files") == 3
+
+
+@pytest.mark.asyncio
+async def test_single_media_type_oldest_first(library):
+    docs, cursor = await list_uploads(
+        "user123", ["video_files"], 10, descending=False
+    )
+
+    assert [doc.id for doc in docs] == ["v0", "v1"]
+    assert cursor is None
+
+
+def test_rejects_foreign_cursors():
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor({"secrets": None}))
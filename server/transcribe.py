@@ -2,6 +2,7 @@ import os
 from firebase import db
 from firebase_admin import firestore
 from datetime import datetime
+from transcript_index import index_text
 
 class TranscriptionService:
     def __init__(self, transcription_method=None):
@@ -64,13 +65,22 @@ class TranscriptionService:
             
             # Create AI texts subcollection
             ai_text_ref = file_ref.collection("ai_texts").document(text_id)
+
+            # Long transcriptions get a retrieval index for /ai/ask; without
+            # one it's built on the first question
+            try:
+                index_hash = index_text(transcription_text)
+            except Exception as e:
+                print(f"Failed to index transcription: {str(e)}")
+                index_hash = None
             
             # Store transcription
             ai_text_ref.set({
                 "text": transcription_text,
                 "user_id": user_id,
                 "created_at": firestore.SERVER_TIMESTAMP,
-                "conversation_history": [],
+                "version": 0,
+                "index_hash": index_hash,
                 "last_accessed": firestore.SERVER_TIMESTAMP,
                 "file_type": file_type,
                 "original_file_path": file_path
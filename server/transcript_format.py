@@ -0,0 +1,262 @@
+import json
+import mmap
+import struct
+from functools import cached_property
+import numpy as np
+
+# Compact columnar transcript format ("SCRT"), little-endian:
+#
+#   header     magic, version, word count, string count, speaker count
+#   sections   (offset, length) of each section below, 8-byte aligned
+#   strings    uint32 offsets into a UTF-8 blob holding each distinct word once
+#   word_ids   uint32 per word: index into the string table
+#   start_ms   uint32 per word, non-decreasing
+#   end_ms     uint32 per word
+#   confidence uint16 per word, confidence * 10000
+#   speaker    int16 per word: index into the speaker table, -1 if unknown
+#   kind       uint8 per word: 0 pronunciation, 1 punctuation
+#   speakers   JSON list of speaker labels
+#   text       UTF-8 full transcript text
+#
+# Every column is read with np.frombuffer straight from the bytes or memory
+# map, so opening a transcript decodes nothing; only the words a request asks
+# for are turned into Python objects.
+
+MAGIC = b"SCRT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIII")
+SECTIONS = [
+    ("string_offsets", np.uint32),
+    ("string_blob", np.uint8),
+    ("word_ids", np.uint32),
+    ("start_ms", np.uint32),
+    ("end_ms", np.uint32),
+    ("confidence", np.uint16),
+    ("speaker", np.int16),
+    ("kind", np.uint8),
+    ("speakers", np.uint8),
+    ("text", np.uint8),
+]
+SECTION_TABLE = struct.Struct("<" + "QQ" * len(SECTIONS))
+
+KINDS = ["pronunciation", "punctuation"]
+CONFIDENCE_SCALE = 10000
+
+
+def _seconds_to_ms(value) -> int:
+    return int(round(float(value) * 1000))
+
+
+def _item_speakers(results: dict) -> dict:
+    """Map item start times to speakers for transcripts that only label segments."""
+    speakers = {}
+    for segment in results.get("speaker_labels", {}).get("segments", []):
+        for item in segment.get("items", []):
+            speakers[item["start_time"]] = item.get(
+                "speaker_label", segment.get("speaker_label")
+            )
+    return speakers
+
+
+def encode_transcript(transcript: dict) -> bytes:
+    """Encode an AWS Transcribe result into the compact columnar format."""
+    results = transcript.get("results", {})
+    items = results.get("items", [])
+    segment_speakers = _item_speakers(results)
+
+    strings = {}
+    speaker_labels = {}
+    word_ids, start_ms, end_ms, confidence, speaker, kind = [], [], [], [], [], []
+    last_end = 0
+
+    for item in items:
+        alternative = (item.get("alternatives") or [{}])[0]
+        content = alternative.get("content", "")
+        word_ids.append(strings.setdefault(content, len(strings)))
+
+        # Punctuation has no timing of its own; pin it to the previous word
+        if "start_time" in item:
+            start = _seconds_to_ms(item["start_time"])
+            end = _seconds_to_ms(item.get("end_time", item["start_time"]))
+        else:
+            start = end = last_end
+        start = max(start, start_ms[-1] if start_ms else 0)
+        start_ms.append(start)
+        end_ms.append(max(end, start))
+        last_end = end_ms[-1]
+
+        confidence.append(
+            int(round(float(alternative.get("confidence") or 0) * CONFIDENCE_SCALE))
+        )
+        label = item.get("speaker_label") or segment_speakers.get(item.get("start_time"))
+        speaker.append(
+            speaker_labels.setdefault(label, len(speaker_labels)) if label else -1
+        )
+        kind.append(1 if item.get("type") == "punctuation" else 0)
+
+    blob = bytearray()
+    string_offsets = [0]
+    for content in strings:
+        blob += content.encode("utf-8")
+        string_offsets.append(len(blob))
+
+    text = "".join(
+        entry.get("transcript", "") for entry in results.get("transcripts", [])
+    )
+    columns = {
+        "string_offsets": np.asarray(string_offsets, dtype=np.uint32),
+        "string_blob": np.frombuffer(bytes(blob), dtype=np.uint8),
+        "word_ids": np.asarray(word_ids, dtype=np.uint32),
+        "start_ms": np.asarray(start_ms, dtype=np.uint32),
+        "end_ms": np.asarray(end_ms, dtype=np.uint32),
+        "confidence": np.asarray(confidence, dtype=np.uint16),
+        "speaker": np.asarray(speaker, dtype=np.int16),
+        "kind": np.asarray(kind, dtype=np.uint8),
+        "speakers": np.frombuffer(
+            json.dumps(list(speaker_labels)).encode("utf-8"), dtype=np.uint8
+        ),
+        "text": np.frombuffer(text.encode("utf-8"), dtype=np.uint8),
+    }
+
+    out = bytearray(HEADER.size + SECTION_TABLE.size)
+    table = []
+    for name, dtype in SECTIONS:
+        out += bytes(-len(out) % 8)
+        data = columns[name].astype(dtype, copy=False).tobytes()
+        table += [len(out), len(data)]
+        out += data
+
+    HEADER.pack_into(
+        out, 0, MAGIC, VERSION, 0, len(items), len(strings), len(speaker_labels)
+    )
+    SECTION_TABLE.pack_into(out, HEADER.size, *table)
+    return bytes(out)
+
+
+class CompactTranscript:
+    """
+    Read-only view over an encoded transcript.
+
+    Wraps bytes, a memoryview or a memory map without copying it; columns are
+    numpy views into that buffer.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        magic, version, _, self.word_count, _, _ = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a compact transcript")
+
+        table = SECTION_TABLE.unpack_from(buffer, HEADER.size)
+        self._columns = {}
+        for index, (name, dtype) in enumerate(SECTIONS):
+            offset, length = table[2 * index], table[2 * index + 1]
+            self._columns[name] = np.frombuffer(
+                buffer, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset
+            )
+
+        self.start_ms = self._columns["start_ms"]
+        self.end_ms = self._columns["end_ms"]
+        self.speaker_labels = json.loads(self._columns["speakers"].tobytes() or b"[]")
+
+    @classmethod
+    def open(cls, path: str) -> "CompactTranscript":
+        """Memory-map an encoded transcript file; pages load on first access."""
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self.word_count
+
+    @property
+    def duration_seconds(self) -> float:
+        return float(self.end_ms.max()) / 1000 if self.word_count else 0.0
+
+    @property
+    def text(self) -> str:
+        return self._columns["text"].tobytes().decode("utf-8")
+
+    def _content(self, string_id: int) -> str:
+        offsets = self._columns["string_offsets"]
+        return (
+            self._columns["string_blob"][offsets[string_id] : offsets[string_id + 1]]
+            .tobytes()
+            .decode("utf-8")
+        )
+
+    def words(self, start: int, stop: int) -> list:
+        """Decode the words with indexes in [start, stop)."""
+        start, stop = max(0, start), min(stop, self.word_count)
+        word_ids = self._columns["word_ids"]
+        confidence = self._columns["confidence"]
+        speaker = self._columns["speaker"]
+        kind = self._columns["kind"]
+
+        words = []
+        for i in range(start, stop):
+            speaker_index = int(speaker[i])
+            words.append(
+                {
+                    "index": i,
+                    "content": self._content(int(word_ids[i])),
+                    "start_time": int(self.start_ms[i]) / 1000,
+                    "end_time": int(self.end_ms[i]) / 1000,
+                    "confidence": int(confidence[i]) / CONFIDENCE_SCALE,
+                    "speaker_label": (
+                        self.speaker_labels[speaker_index] if speaker_index >= 0 else None
+                    ),
+                    "type": KINDS[int(kind[i])],
+                }
+            )
+        return words
+
+    @cached_property
+    def latest_end_ms(self):
+        """Running maximum of the end times, built on first use.
+
+        Start times are sorted but end times aren't (overlapping speakers), so
+        this is what lets a binary search find the first word still being
+        spoken at a given time.
+        """
+        return np.maximum.accumulate(self.end_ms) if self.word_count else self.end_ms
+
+    def index_range(self, start_s: float = None, end_s: float = None) -> tuple:
+        """Binary-search the word indexes overlapping [start_s, end_s).
+
+        The range runs from the first word still being spoken at start_s to
+        the last word starting before end_s.
+        """
+        lo = 0 if start_s is None else int(
+            np.searchsorted(self.latest_end_ms, start_s * 1000, side="right")
+        )
+        hi = self.word_count if end_s is None else int(
+            np.searchsorted(self.start_ms, end_s * 1000, side="left")
+        )
+        return lo, max(lo, hi)
+
+    def words_between(self, start_s: float = None, end_s: float = None) -> list:
+        """Decode only the words overlapping [start_s, end_s)."""
+        return self.words(*self.index_range(start_s, end_s))
+
+    def page(
+        self,
+        start_s: float = None,
+        end_s: float = None,
+        cursor: int = None,
+        page_size: int = None,
+    ) -> dict:
+        """
+        Decode one page of the words overlapping [start_s, end_s).
+
+        The cursor is the index of the first word to return; next_cursor is
+        None once the window is exhausted.
+        """
+        lo, hi = self.index_range(start_s, end_s)
+        first = lo if cursor is None else min(max(cursor, lo), hi)
+        last = hi if page_size is None else min(hi, first + page_size)
+        return {
+            "cursor": first,
+            "next_cursor": last if last < hi else None,
+            "window_words": hi - lo,
+            "words": self.words(first, last),
+        }
@@ -0,0 +1,361 @@
+import io
+import json
+import os
+import re
+import threading
+from cachetools import LRUCache
+from dotenv import load_dotenv
+import numpy as np
+import aws_async
+import metrics
+from context_builder import count_tokens
+from transcript_store import content_hash, store
+
+load_dotenv()
+
+# Texts estimated above this many tokens are answered from retrieved passages
+# rather than in full; shorter ones fit comfortably and are prompt-cached whole
+AI_RETRIEVAL_MIN_TOKENS = int(os.getenv("AI_RETRIEVAL_MIN_TOKENS", "20000"))
+# Passages sent with each question
+AI_RETRIEVAL_TOP_K = int(os.getenv("AI_RETRIEVAL_TOP_K", "8"))
+# Loaded indexes kept per worker
+TRANSCRIPT_INDEX_CACHE_ENTRIES = int(os.getenv("TRANSCRIPT_INDEX_CACHE_ENTRIES", "32"))
+
+# A chunk ends at a change of speaker, after this long, or at this many words
+CHUNK_SECONDS = 60
+CHUNK_MAX_WORDS = 200
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Indexes are stored next to transcripts, keyed by the hash of the text
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in is it "
+    "its me my of on or our she so that the their them they this to was we "
+    "were what when where which who will with you your".split()
+)
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def tokenize(text: str) -> list:
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+def _chunk(text: str, start_ms: int = -1, end_ms: int = -1, speaker: str = None):
+    return {"text": text, "start_ms": start_ms, "end_ms": end_ms, "speaker": speaker}
+
+
+def chunk_text(text: str) -> list:
+    """Split plain text into passages of whole sentences, without timing.
+
+    A sentence longer than a passage (unpunctuated text) is split by words.
+    """
+    chunks, words = [], []
+    for sentence in SENTENCE_END.split(text.strip()):
+        sentence_words = sentence.split()
+        if words and len(words) + len(sentence_words) > CHUNK_MAX_WORDS:
+            chunks.append(_chunk(" ".join(words)))
+            words = []
+        words += sentence_words
+        while len(words) >= CHUNK_MAX_WORDS:
+            chunks.append(_chunk(" ".join(words[:CHUNK_MAX_WORDS])))
+            words = words[CHUNK_MAX_WORDS:]
+    if words:
+        chunks.append(_chunk(" ".join(words)))
+    return chunks
+
+
+def chunk_transcript(transcript) -> list:
+    """Split a CompactTranscript into timed passages, one speaker each."""
+    chunks, words = [], []
+    for word in transcript.words(0, len(transcript)):
+        # Punctuation attaches to the word before it
+        if word["type"] == "punctuation":
+            if words:
+                words[-1] = {**words[-1], "content": words[-1]["content"] + word["content"]}
+            continue
+        if words and (
+            word["speaker_label"] != words[0]["speaker_label"]
+            or word["start_time"] - words[0]["start_time"] >= CHUNK_SECONDS
+            or len(words) >= CHUNK_MAX_WORDS
+        ):
+            chunks.append(_passage(words))
+            words = []
+        words.append(word)
+    if words:
+        chunks.append(_passage(words))
+    return chunks
+
+
+def _passage(words: list) -> dict:
+    return _chunk(
+        " ".join(word["content"] for word in words),
+        int(round(words[0]["start_time"] * 1000)),
+        int(round(max(word["end_time"] for word in words) * 1000)),
+        words[0]["speaker_label"],
+    )
+
+
+def _pack_strings(strings: list) -> tuple:
+    """(offsets, UTF-8 blob) for a list of strings, as in transcript_format."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(e) for e in encoded], dtype=np.uint64)
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _unpack_string(offsets, blob, index: int) -> str:
+    return blob[offsets[index] : offsets[index + 1]].tobytes().decode("utf-8")
+
+
+def _format_time(ms: int) -> str:
+    seconds = ms // 1000
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class TranscriptIndex:
+    """
+    BM25 index over the passages of one transcript.
+
+    Postings are stored term by term in flat NumPy arrays (an inverted index
+    in CSR layout), so a query touches only the postings of its own terms and
+    scores every passage with a few vector operations.
+    """
+
+    def __init__(self, arrays: dict):
+        self._arrays = arrays
+        self.chunk_count = len(arrays["chunk_lengths"])
+        self.speakers = json.loads(arrays["speakers"].tobytes() or b"[]")
+        self._terms = None
+
+    @classmethod
+    def build(cls, chunks: list) -> "TranscriptIndex":
+        term_ids = {}
+        postings = []  # (term id, chunk, count)
+        lengths = []
+        for chunk_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk["text"])
+            lengths.append(len(tokens))
+            terms, counts = np.unique(tokens, return_counts=True)
+            for term, count in zip(terms.tolist(), counts.tolist()):
+                postings.append((term_ids.setdefault(term, len(term_ids)), chunk_id, count))
+
+        postings.sort()
+        posting_terms = np.array([p[0] for p in postings], dtype=np.uint32)
+        term_offsets, term_blob = _pack_strings(list(term_ids))
+        text_offsets, text_blob = _pack_strings([c["text"] for c in chunks])
+        speakers = list(dict.fromkeys(c["speaker"] for c in chunks if c["speaker"]))
+        speaker_ids = {speaker: i for i, speaker in enumerate(speakers)}
+
+        return cls(
+            {
+                "version": np.array([INDEX_VERSION], dtype=np.uint16),
+                "term_offsets": term_offsets,
+                "term_blob": term_blob,
+                "posting_offsets": np.searchsorted(
+                    posting_terms, np.arange(len(term_ids) + 1)
+                ).astype(np.uint32),
+                "posting_chunks": np.array([p[1] for p in postings], dtype=np.uint32),
+                "posting_counts": np.array(
+                    [min(p[2], 65535) for p in postings], dtype=np.uint16
+                ),
+                "chunk_lengths": np.array(lengths, dtype=np.uint32),
+                "chunk_start_ms": np.array([c["start_ms"] for c in chunks], dtype=np.int64),
+                "chunk_end_ms": np.array([c["end_ms"] for c in chunks], dtype=np.int64),
+                "chunk_speakers": np.array(
+                    [speaker_ids.get(c["speaker"], -1) for c in chunks], dtype=np.int16
+                ),
+                "speakers": np.frombuffer(json.dumps(speakers).encode(), dtype=np.uint8),
+                "text_offsets": text_offsets,
+                "text_blob": text_blob,
+            }
+        )
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **self._arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TranscriptIndex":
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+        if int(arrays["version"][0]) != INDEX_VERSION:
+            raise ValueError("Unsupported transcript index version")
+        return cls(arrays)
+
+    def _term_id(self, term: str):
+        # The term table is only turned into a dict once a query needs it
+        if self._terms is None:
+            offsets, blob = self._arrays["term_offsets"], self._arrays["term_blob"]
+            self._terms = {
+                _unpack_string(offsets, blob, i): i for i in range(len(offsets) - 1)
+            }
+        return self._terms.get(term)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every passage for the query."""
+        lengths = self._arrays["chunk_lengths"].astype(np.float64)
+        scores = np.zeros(self.chunk_count)
+        if not self.chunk_count:
+            return scores
+        average = lengths.mean() or 1.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average)
+
+        offsets = self._arrays["posting_offsets"]
+        for term in set(tokenize(query)):
+            term_id = self._term_id(term)
+            if term_id is None:
+                continue
+            start, stop = offsets[term_id], offsets[term_id + 1]
+            chunks = self._arrays["posting_chunks"][start:stop]
+            counts = self._arrays["posting_counts"][start:stop].astype(np.float64)
+            idf = np.log1p((self.chunk_count - len(chunks) + 0.5) / (len(chunks) + 0.5))
+            scores[chunks] += idf * counts * (BM25_K1 + 1) / (counts + norm[chunks])
+        return scores
+
+    def search(self, query: str, k: int = AI_RETRIEVAL_TOP_K) -> list:
+        """
+        The k best passages, in transcript order. A question that matches
+        nothing (say, "summarize this") gets passages spread evenly across
+        the transcript instead.
+        """
+        scores = self.scores(query)
+        k = min(k, self.chunk_count)
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = np.sort(best[scores[best] > 0])
+        if not len(best):
+            best = np.unique(np.linspace(0, self.chunk_count - 1, k).astype(int))
+        return [self.passage(int(i), float(scores[i])) for i in best]
+
+    def passage(self, index: int, score: float = 0.0) -> dict:
+        speaker = int(self._arrays["chunk_speakers"][index])
+        return {
+            "index": index,
+            "text": _unpack_string(
+                self._arrays["text_offsets"], self._arrays["text_blob"], index
+            ),
+            "start_ms": int(self._arrays["chunk_start_ms"][index]),
+            "end_ms": int(self._arrays["chunk_end_ms"][index]),
+            "speaker": self.speakers[speaker] if speaker >= 0 else None,
+            "score": score,
+        }
+
+
+def format_passages(passages: list) -> str:
+    """Passages as prompt text, each headed by its time range and speaker."""
+    blocks = []
+    for passage in passages:
+        if passage["start_ms"] >= 0:
+            heading = f"[{_format_time(passage['start_ms'])}-{_format_time(passage['end_ms'])}]"
+        else:
+            heading = f"[Passage {passage['index'] + 1}]"
+        if passage["speaker"]:
+            heading += f" {passage['speaker']}"
+        blocks.append(f"{heading}\n{passage['text']}")
+    return "\n\n".join(blocks)
+
+
+_loaded = LRUCache(maxsize=TRANSCRIPT_INDEX_CACHE_ENTRIES)
+_lock = threading.Lock()
+
+
+def index_text(text: str, transcript=None):
+    """
+    Build and store the retrieval index of a text long enough to need one.
+
+    Timed passages come from the upload's CompactTranscript when its text is
+    the one being indexed; otherwise the text is split by sentences. Returns
+    the index hash to record on the ai_texts document, or None for short
+    texts. Blocking (S3 write).
+    """
+    if count_tokens(text) < AI_RETRIEVAL_MIN_TOKENS:
+        return None
+
+    if transcript is not None and transcript.text.strip() == text.strip():
+        chunks = chunk_transcript(transcript)
+    else:
+        chunks = chunk_text(text)
+
+    index = TranscriptIndex.build(chunks)
+    digest = content_hash(text.encode("utf-8"))
+    store.put(digest, index.to_bytes(), INDEX_SUFFIX, "application/octet-stream")
+    with _lock:
+        _loaded[digest] = index
+    metrics.increment("transcript_index.builds")
+    return digest
+
+
+async def build_text_index(text: str, transcript_hash: str = None):
+    """
+    Index a new ai_texts text off the event loop, using the upload's stored
+    transcript for timing when there is one. Returns the index hash, or None
+    for short texts or if indexing fails; the first question retries then.
+    """
+    if count_tokens(text) < AI_RETRIEVAL_MIN_TOKENS:
+        return None
+
+    def build():
+        transcript = store.get_compact(transcript_hash) if transcript_hash else None
+        return index_text(text, transcript)
+
+    try:
+        return await aws_async.run_in_aws_pool(build)
+    except Exception as e:
+        print(f"Failed to index text: {str(e)}")
+        return None
+
+
+def load_index(digest: str):
+    """The stored index with this hash, or None. Blocking on first load."""
+    with _lock:
+        index = _loaded.get(digest)
+    if index is not None:
+        return index
+
+    data = store.get(digest, INDEX_SUFFIX)
+    if data is None:
+        return None
+    index = TranscriptIndex.from_bytes(data)
+    with _lock:
+        _loaded[digest] = index
+    metrics.increment("transcript_index.loads")
+    return index
+
+
+async def retrieve_passages(ai_text_ref, doc_data: dict, question: str):
+    """
+    The passages most relevant to a question, or None to send the full text.
+
+    Texts indexed before this existed, or whose index went missing, are
+    indexed on their first question; if that fails the full text is used.
+    """
+    if count_tokens(doc_data["text"]) < AI_RETRIEVAL_MIN_TOKENS:
+        return None
+
+    digest = doc_data.get("index_hash")
+    try:
+        index = await aws_async.run_in_aws_pool(load_index, digest) if digest else None
+        if index is None:
+            digest = await aws_async.run_in_aws_pool(index_text, doc_data["text"])
+            ai_text_ref.update({"index_hash": digest})
+            index = await aws_async.run_in_aws_pool(load_index, digest)
+    except Exception as e:
+        # The full text still answers the question, just less cheaply
+        metrics.increment("transcript_index.errors")
+        print(f"Failed to load text index: {str(e)}")
+        return None
+
+    passages = index.search(question)
+    metrics.observe("transcript_index.passages", len(passages))
+    return passages
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from cachetools import LRUCache
+from dotenv import load_dotenv
+import aws_async
+import aws_service
+import metrics
+from http_cache import ENCODING_SUFFIXES, compress, supported_encodings
+from transcript_format import CompactTranscript, encode_transcript
+
+load_dotenv()
+
+# In-memory tier, bounded by the total size of the cached transcripts
+TRANSCRIPT_CACHE_MAX_BYTES = int(
+    os.getenv("TRANSCRIPT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+# Optional local disk tier between memory and S3
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR")
+# Our own copies of finished transcripts, keyed by content hash
+TRANSCRIPT_S3_PREFIX = "transcripts/"
+# Compact columnar variant of each transcript, stored under the same hash
+COMPACT_SUFFIX = ".bin"
+# Opened compact transcripts kept around; they share the cached bytes or map
+# the disk copy, so each one is small
+COMPACT_CACHE_ENTRIES = int(os.getenv("COMPACT_TRANSCRIPT_CACHE_ENTRIES", "64"))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class TranscriptStore:
+    """
+    Content-addressed store for finished transcripts.
+
+    Completed transcripts never change, so they are fetched from the AWS-hosted
+    URI once, stored under the SHA-256 of their bytes and served from the
+    fastest tier that has them after that: a size-bounded in-memory LRU, an
+    optional local disk directory, then our own S3 copy. The hash is recorded
+    on the upload document so later reads skip the AWS URI entirely.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = TRANSCRIPT_CACHE_MAX_BYTES,
+        cache_dir: str = TRANSCRIPT_CACHE_DIR,
+    ):
+        self.cache_dir = cache_dir
+        self._memory = LRUCache(maxsize=max_bytes, getsizeof=len)
+        self._compact = LRUCache(maxsize=COMPACT_CACHE_ENTRIES)
+        self._lock = threading.Lock()
+
+    def _s3_key(self, digest: str, suffix: str) -> str:
+        return f"{TRANSCRIPT_S3_PREFIX}{digest}{suffix}"
+
+    def _disk_path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}{suffix}")
+
+    def get_cached(self, digest: str, suffix: str = ".json"):
+        """Return the stored bytes from memory only, without any I/O."""
+        with self._lock:
+            data = self._memory.get(digest + suffix)
+        if data is not None:
+            metrics.increment("transcript_store.hits.memory")
+        return data
+
+    def _remember(self, digest: str, suffix: str, data: bytes):
+        # Entries larger than the whole cache are served but not kept
+        if len(data) <= self._memory.maxsize:
+            with self._lock:
+                self._memory[digest + suffix] = data
+
+    def _read_disk(self, digest: str, suffix: str):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(digest, suffix), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, digest: str, suffix: str, data: bytes):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(digest, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see partial content
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+    def get(self, digest: str, suffix: str = ".json"):
+        """Return the stored bytes from the fastest tier that has them, or None.
+
+        Blocking (disk and S3 I/O); run it on the AWS pool from async code.
+        """
+        data = self.get_cached(digest, suffix)
+        if data is not None:
+            return data
+
+        data = self._read_disk(digest, suffix)
+        if data is not None:
+            metrics.increment("transcript_store.hits.disk")
+        else:
+            data = aws_service.get_bytes_from_s3(self._s3_key(digest, suffix))
+            if data is None:
+                metrics.increment("transcript_store.misses")
+                return None
+            metrics.increment("transcript_store.hits.s3")
+            self._write_disk(digest, suffix, data)
+
+        self._remember(digest, suffix, data)
+        return data
+
+    def put(
+        self,
+        digest: str,
+        data: bytes,
+        suffix: str = ".json",
+        content_type: str = "application/json",
+    ):
+        """Store bytes in every tier under the given content hash."""
+        aws_service.put_bytes_to_s3(self._s3_key(digest, suffix), data, content_type)
+        self._write_disk(digest, suffix, data)
+        self._remember(digest, suffix, data)
+
+    def fetch_and_store(self, transcript_uri: str) -> tuple:
+        """Download a transcript from AWS, store it and return (hash, bytes)."""
+        data = aws_service.download_transcription_result(transcript_uri)
+        # Make sure it parses before it's stored for good
+        try:
+            json.loads(data)
+        except ValueError as e:
+            raise ValueError(f"Failed to get transcription result: {str(e)}")
+
+        digest = content_hash(data)
+        self.put(digest, data)
+        self.put_compact(digest, json.loads(data))
+        for coding in supported_encodings():
+            self.put_encoded(digest, data, coding)
+        metrics.increment("transcript_store.fetches")
+        return digest, data
+
+    def put_encoded(self, digest: str, data: bytes, coding: str) -> bytes:
+        """Compress the transcript JSON once and store it for every later read."""
+        encoded = compress(data, coding)
+        self.put(
+            digest,
+            encoded,
+            ".json" + ENCODING_SUFFIXES[coding],
+            "application/octet-stream",
+        )
+        return encoded
+
+    def get_encoded(self, digest: str, coding: str):
+        """
+        Return the transcript JSON pre-compressed with a content coding, or
+        None if it isn't stored. Variants missing for transcripts stored
+        earlier are built on first use. Blocking.
+        """
+        encoded = self.get(digest, ".json" + ENCODING_SUFFIXES[coding])
+        if encoded is not None:
+            return encoded
+        data = self.get(digest)
+        if data is None:
+            return None
+        return self.put_encoded(digest, data, coding)
+
+    def put_compact(self, digest: str, transcript: dict) -> bytes:
+        """Encode a parsed transcript and store the compact variant."""
+        data = encode_transcript(transcript)
+        self.put(digest, data, COMPACT_SUFFIX, "application/octet-stream")
+        return data
+
+    def get_compact(self, digest: str):
+        """
+        Return the transcript as a CompactTranscript, or None if it isn't stored.
+
+        The disk copy is memory-mapped when there is one; otherwise the view
+        wraps the cached bytes. Transcripts stored before the compact format
+        existed are encoded from their JSON on first use. Blocking.
+        """
+        with self._lock:
+            transcript = self._compact.get(digest)
+        if transcript is not None:
+            return transcript
+
+        path = self._disk_path(digest, COMPACT_SUFFIX) if self.cache_dir else None
+        if path and os.path.exists(path):
+            transcript = CompactTranscript.open(path)
+        else:
+            data = self.get(digest, COMPACT_SUFFIX)
+            if data is None:
+                source = self.get(digest)
+                if source is None:
+                    return None
+                data = self.put_compact(digest, json.loads(source))
+            transcript = CompactTranscript(data)
+
+        with self._lock:
+            self._compact[digest] = transcript
+        return transcript
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory.currsize,
+                "memory_max_bytes": self._memory.maxsize,
+                "compact_entries": len(self._compact),
+            }
+
+
+store = TranscriptStore()
+
+
+async def load_transcript(doc_ref, doc_data: dict, coding: str = None) -> tuple:
+    """
+    Get an upload's transcript as (content hash, JSON bytes).
+
+    With a content coding the bytes are the stored pre-compressed variant.
+    Reads go through the store; only the first read of a transcript touches
+    the AWS-hosted URI, after which its hash is saved on the upload document.
+    """
+    suffix = ".json" + ENCODING_SUFFIXES[coding] if coding else ".json"
+    digest = doc_data.get("transcript_hash")
+    if digest:
+        data = store.get_cached(digest, suffix)
+        if data is None:
+            if coding:
+                data = await aws_async.run_in_aws_pool(store.get_encoded, digest, coding)
+            else:
+                data = await aws_async.run_in_aws_pool(store.get, digest)
+        if data is not None:
+            return digest, data
+
+    digest, data = await aws_async.run_in_aws_pool(
+        store.fetch_and_store, doc_data["transcript_uri"]
+    )
+    doc_ref.update({"transcript_hash": digest})
+    if coding:
+        data = await aws_async.run_in_aws_pool(store.get_encoded, digest, coding)
+    return digest, data
+
+
+async def load_compact_transcript(doc_ref, doc_data: dict):
+    """Get an upload's transcript as a CompactTranscript for partial reads."""
+    digest = doc_data.get("transcript_hash")
+    if digest:
+        transcript = await aws_async.run_in_aws_pool(store.get_compact, digest)
+        if transcript is not None:
+            return transcript
+
+    digest, _ = await load_transcript(doc_ref, {**doc_data, "transcript_hash": None})
+    return await aws_async.run_in_aws_pool(store.get_compact, digest)
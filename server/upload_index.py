@@ -0,0 +1,220 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+from datetime import datetime
+from cachetools import LRUCache
+from dotenv import load_dotenv
+from firebase_admin import firestore
+from starlette.concurrency import run_in_threadpool
+from firebase import db
+import metrics
+
+load_dotenv()
+
+# Subcollections of uploads/{user_id} holding upload documents
+MEDIA_COLLECTIONS = ["audio_files", "video_files"]
+# Upload locations remembered per worker
+UPLOAD_LOCATION_CACHE_ENTRIES = int(
+    os.getenv("UPLOAD_LOCATION_CACHE_ENTRIES", "100000")
+)
+
+# Fields returned when listing uploads; transcripts and job details stay out
+UPLOAD_LIST_FIELDS = [
+    "id",
+    "filename",
+    "original_filename",
+    "s3_key",
+    "file_url",
+    "content_type",
+    "media_duration",
+    "upload_timestamp",
+    "transcription_status",
+    "transcription_job_name",
+]
+
+
+def upload_ref(user_id: str, collection: str, doc_id: str):
+    return (
+        db.collection("uploads")
+        .document(user_id)
+        .collection(collection)
+        .document(doc_id)
+    )
+
+
+class UploadLocator:
+    """
+    Find upload documents in a single Firestore round trip.
+
+    Remembers which media collection each upload lives in, learned when it's
+    uploaded or first looked up, so a known upload is one get(). An unknown
+    one is fetched from both collections in a single get_all batch rather
+    than one get() per collection.
+    """
+
+    def __init__(self, max_entries: int = UPLOAD_LOCATION_CACHE_ENTRIES):
+        self._locations = LRUCache(maxsize=max_entries)
+        self._lock = threading.Lock()
+
+    def remember(self, user_id: str, doc_id: str, collection: str):
+        with self._lock:
+            self._locations[(user_id, doc_id)] = collection
+
+    def forget(self, user_id: str, doc_id: str):
+        with self._lock:
+            self._locations.pop((user_id, doc_id), None)
+
+    def location(self, user_id: str, doc_id: str):
+        with self._lock:
+            return self._locations.get((user_id, doc_id))
+
+    def find(self, user_id: str, doc_id: str):
+        """Return the upload's document snapshot, or None if it doesn't exist."""
+        collection = self.location(user_id, doc_id)
+        if collection is not None:
+            metrics.increment("upload_locator.hits")
+            doc = upload_ref(user_id, collection, doc_id).get()
+            if doc.exists:
+                return doc
+            self.forget(user_id, doc_id)
+
+        metrics.increment("upload_locator.misses")
+        refs = [
+            upload_ref(user_id, collection, doc_id) for collection in MEDIA_COLLECTIONS
+        ]
+        for doc in db.get_all(refs):
+            if doc.exists:
+                self.remember(user_id, doc_id, doc.reference.parent.id)
+                return doc
+        return None
+
+    def find_many(self, user_id: str, doc_ids: list, field_paths: list = None) -> dict:
+        """
+        Return {doc_id: snapshot} for the uploads that exist, in one get_all.
+
+        Known uploads contribute one reference and unknown ones one per media
+        collection; field_paths limits the fields read.
+        """
+        refs = []
+        for doc_id in dict.fromkeys(doc_ids):
+            collection = self.location(user_id, doc_id)
+            collections = [collection] if collection else MEDIA_COLLECTIONS
+            refs += [upload_ref(user_id, c, doc_id) for c in collections]
+        if not refs:
+            return {}
+
+        found = {}
+        for doc in db.get_all(refs, field_paths=field_paths):
+            if doc.exists:
+                self.remember(user_id, doc.id, doc.reference.parent.id)
+                found[doc.id] = doc
+        # Remembered locations that no longer exist are dropped
+        for doc_id in doc_ids:
+            if doc_id not in found:
+                self.forget(user_id, doc_id)
+        metrics.increment("upload_locator.batch_reads")
+        return found
+
+
+locator = UploadLocator()
+
+
+def find_upload_doc(user_id: str, doc_id: str):
+    """Find an upload document in either media collection."""
+    return locator.find(user_id, doc_id)
+
+
+def encode_cursor(positions: dict) -> str:
+    """Opaque page cursor holding each collection's last (timestamp, doc ID)."""
+    return base64.urlsafe_b64encode(json.dumps(positions).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Reverse encode_cursor; raises ValueError for anything it didn't make."""
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(positions, dict) or not set(positions) <= set(MEDIA_COLLECTIONS):
+        raise ValueError("Invalid cursor")
+    return positions
+
+
+def _sort_key(doc) -> tuple:
+    return (doc.get("upload_timestamp"), doc.id)
+
+
+def _list_collection(user_id: str, collection: str, page_size: int, after, descending: bool):
+    """One page of a media collection ordered by upload time. Blocking."""
+    direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+    query = (
+        db.collection("uploads")
+        .document(user_id)
+        .collection(collection)
+        .select(UPLOAD_LIST_FIELDS)
+        .order_by("upload_timestamp", direction=direction)
+        .order_by("__name__", direction=direction)
+        .limit(page_size)
+    )
+    if after:
+        timestamp, doc_id = after
+        query = query.start_after(
+            {"upload_timestamp": datetime.fromisoformat(timestamp), "__name__": doc_id}
+        )
+    return list(query.stream())
+
+
+async def list_uploads(
+    user_id: str,
+    collections: list,
+    page_size: int,
+    cursor: str = None,
+    descending: bool = True,
+) -> tuple:
+    """
+    List one page of a user's uploads across media collections.
+
+    Each collection is queried for a page in upload order, concurrently, and
+    the results are merged, so the page is ordered by upload_timestamp across
+    audio and video alike. Returns (snapshots, next cursor or None).
+    """
+    # Positions: [] before the first page, [timestamp, doc ID] of the last
+    # upload returned, or None once the collection has been read to the end
+    positions = decode_cursor(cursor) if cursor else {}
+    positions = {c: positions.get(c, []) for c in collections}
+    active = [c for c in collections if positions[c] is not None]
+
+    pages = await asyncio.gather(
+        *[
+            run_in_threadpool(
+                _list_collection, user_id, c, page_size, positions[c], descending
+            )
+            for c in active
+        ]
+    )
+
+    merged = sorted(
+        (doc for page in pages for doc in page), key=_sort_key, reverse=descending
+    )[:page_size]
+
+    next_positions = dict(positions)
+    for collection, page in zip(active, pages):
+        taken = [doc for doc in merged if doc.reference.parent.id == collection]
+        if len(page) < page_size and len(taken) == len(page):
+            next_positions[collection] = None
+        elif taken:
+            last = taken[-1]
+            next_positions[collection] = [
+                last.get("upload_timestamp").isoformat(),
+                last.id,
+            ]
+
+    for doc in merged:
+        locator.remember(user_id, doc.id, doc.reference.parent.id)
+    metrics.increment("uploads.listed", len(merged))
+
+    if all(position is None for position in next_positions.values()):
+        return merged, None
+    return merged, encode_cursor(next_positions)